@@ -1,48 +1,87 @@
 import streamlit as st
 import grpc
-import base64
 from include import text2image_pb2
 from include import text2image_pb2_grpc
+from include.transport import image_chunks
+from include.healthcheck import server_status
+from include.fair_queue import CLIENT_ID_KEY, PRIORITY_KEY
+from include.sampling import DEFAULT_REFINE_STRENGTH, upscale_saves
+from include.image_encoding import extension_for_mime
 from PIL import Image
 import io
 import os
 import sys
 import subprocess
 import time
-import socket
+import uuid
+from concurrent import futures
 from streamlit_drawable_canvas import st_canvas
 
 st.set_page_config(page_title="Text-to-Image Generator", layout="centered")
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'include'))
 
-def is_server_running():
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            return s.connect_ex(('localhost', 50051)) == 0
-    except:
-        return False
-
-if not is_server_running():
-    st.info("Starting gRPC server... Please wait.")
-    server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'include', 'grpc_server.py')
-    if os.name == 'nt':
-        subprocess.Popen(
-            [sys.executable, server_script],
-            cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'include'),
-            creationflags=subprocess.CREATE_NO_WINDOW
-        )
-    for _ in range(30):
-        if is_server_running():
-            break
-        time.sleep(0.5)
-    if is_server_running():
-        st.success("gRPC server is now running!")
-    else:
-        st.error("Failed to start gRPC server. Please start it manually and refresh this page.")
-        st.stop()
+GRPC_SERVER_ADDRESS = os.environ.get("GRPC_SERVER_ADDRESS", "localhost:50051")
+
+# Loading weights and warming up can take minutes on a cold start
+SERVER_START_TIMEOUT = float(os.environ.get("SERVER_START_TIMEOUT", 900))
+
+# Seconds between progress refreshes while a generation runs, and results kept per session
+POLL_INTERVAL = 0.25
+HISTORY_SIZE = 10
+
+@st.cache_resource
+def get_channel():
+    # One channel per Streamlit process, shared by every session and rerun. Reconnect backoff is
+    # capped so a server that is still starting is noticed within seconds
+    return grpc.insecure_channel(GRPC_SERVER_ADDRESS, options=[
+        ("grpc.max_receive_message_length", 64 * 1024 * 1024),
+        ("grpc.max_reconnect_backoff_ms", 2000),
+    ])
+
+@st.cache_resource
+def get_stub():
+    return text2image_pb2_grpc.Text2ImageStub(get_channel())
+
+@st.cache_resource
+def get_executor():
+    # Consumes progress streams in the background, so reruns don't block on or cancel a generation
+    return futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix="generation")
+
+def wait_for_server():
+    if server_status(channel=get_channel()) is None:
+        st.info("Starting gRPC server... Please wait.")
+        server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'include', 'grpc_server.py')
+        if os.name == 'nt':
+            subprocess.Popen(
+                [sys.executable, server_script],
+                cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'include'),
+                creationflags=subprocess.CREATE_NO_WINDOW
+            )
 
-channel = grpc.insecure_channel('localhost:50051')
-stub = text2image_pb2_grpc.Text2ImageStub(channel)
+    if server_status(channel=get_channel()) != "SERVING":
+        # The port opens right away; the health service says when the models are ready
+        deadline = time.time() + SERVER_START_TIMEOUT
+        with st.spinner("Loading model... Please wait."):
+            while server_status(channel=get_channel()) != "SERVING" and time.time() < deadline:
+                time.sleep(1)
+        if server_status(channel=get_channel()) == "SERVING":
+            st.success("gRPC server is now running!")
+        else:
+            st.error("Failed to start gRPC server. Please start it manually and refresh this page.")
+            st.stop()
+
+# Checked once per session; later failures surface as RPC errors
+if not st.session_state.get("server_ready"):
+    wait_for_server()
+    st.session_state.server_ready = True
+
+stub = get_stub()
+
+# Each browser session is its own interactive client to the server's fair queueing and per-client
+# limits, rather than every session counting as this process's one connection
+if "client_id" not in st.session_state:
+    st.session_state.client_id = f"streamlit-{uuid.uuid4().hex[:12]}"
+metadata = ((CLIENT_ID_KEY, st.session_state.client_id), (PRIORITY_KEY, "interactive"))
 
 # UI Header
 st.markdown('<h1 style="white-space: nowrap; text-align: center; margin: 0 auto;">Text to Image Generator</h1>', unsafe_allow_html=True)
@@ -223,8 +262,131 @@ with col1:
 with col2:
     height = st.slider("Height", min_value=256, max_value=1024, value=512, step=64)
 
+# A fixed seed makes results reproducible and lets the server answer repeats from its cache
+seed = st.number_input("Seed (optional)", min_value=0, value=None, step=1)
+
+# Draft runs a few DPM++ steps for quick iteration; Final is full quality
+quality = st.radio("Quality", ["Final", "Draft"], horizontal=True)
+
+# Variations are generated together in one batched call
+num_images = st.slider("Number of Images", min_value=1, max_value=4, value=1)
+
+# Large text-to-image outputs can be drafted at the model's native resolution and refined from an upscale
+upscale = False
+if mode == "Text to Image" and upscale_saves(width, height, DEFAULT_REFINE_STRENGTH):
+    upscale = st.checkbox("Draft at 512px, then upscale (much faster)", value=True)
+
+request_args = {"profile": quality.lower(), "num_images": num_images}
+if seed is not None:
+    request_args["seed"] = int(seed)
+
+class PendingGeneration:
+    """A submitted request: the RPC runs in the background while reruns poll its progress."""
+
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.step = 0
+        self.total_steps = 0
+        self.elapsed = 0.0
+        self.preview = None
+        self.future = None
+
+def consume_stream(call, pending):
+    # Runs on the executor; returns the final ImageResponseV2
+    for update in call:
+        if update.HasField("result"):
+            return update.result
+        pending.step, pending.total_steps, pending.elapsed = update.step, update.total_steps, update.elapsed_seconds
+        if update.preview_png:
+            pending.preview = update.preview_png
+    return text2image_pb2.ImageResponseV2(status="error: stream ended without a result")
+
+def submit_generation():
+    pending = PendingGeneration(prompt)
+    if mode == "Text to Image":
+        request = text2image_pb2.TextRequest(
+            prompt=prompt,
+            width=width,
+            height=height,
+            mode="upscale" if upscale else "direct",
+            **request_args
+        )
+        # Stream progress so the user sees steps and previews while denoising
+        call = stub.GenerateImageStream(request, metadata=metadata)
+        pending.future = get_executor().submit(consume_stream, call, pending)
+
+    elif mode == "Image to Image":
+        # Raw bytes, uploaded in chunks so large photos don't hit message limits
+        pending.future = stub.UploadImageFromImage.future(
+            image_chunks(prompt, input_image.getvalue(), width, height, strength, **request_args),
+            metadata=metadata
+        )
+
+    elif mode == "Freehand Drawing":
+        # Convert NumPy canvas to PNG bytes
+        image = Image.fromarray((canvas_result.image_data[:, :, :3]).astype('uint8'))
+        buf = io.BytesIO()
+        image.save(buf, format='PNG')
+
+        request = text2image_pb2.Img2ImgRequestV2(
+            prompt=prompt,
+            input_image=buf.getvalue(),
+            width=width,
+            height=height,
+            strength=0.75,  # Default for drawing
+            **request_args
+        )
+        pending.future = stub.GenerateImageFromImageV2.future(request, metadata=metadata)
+    return pending
+
+def wait_for_result(pending):
+    # Polls instead of blocking in the RPC; a rerun interrupts this loop, and the next run picks it up again
+    progress_bar = st.progress(0.0, text="Waiting for the GPU...")
+    preview_slot = st.empty()
+    shown_preview = None
+    while not pending.future.done():
+        if pending.total_steps:
+            progress_bar.progress(
+                min(pending.step / pending.total_steps, 1.0),
+                text=f"Step {pending.step}/{pending.total_steps} ({pending.elapsed:.1f}s)"
+            )
+        if pending.preview is not shown_preview:
+            shown_preview = pending.preview
+            preview_slot.image(shown_preview, caption="Preview", width=256)
+        time.sleep(POLL_INTERVAL)
+    progress_bar.empty()
+    preview_slot.empty()
+    return pending.future.result()
+
+def show_result(result, key):
+    if result["size_adjustment"]:
+        st.info(f"Size adjusted: {result['size_adjustment']}")
+    images = result["images"]
+    suffix = extension_for_mime(result["mime_type"])
+    # One image full width, variations in a two-column grid
+    columns = st.columns(1 if len(images) == 1 else 2)
+    for i, (image, image_seed) in enumerate(zip(images, result["seeds"])):
+        with columns[i % len(columns)]:
+            st.image(image, caption=f"Seed {image_seed}" if image_seed is not None else None,
+                     use_container_width=True)
+            st.download_button(
+                label="Download Image",
+                data=image,
+                file_name=f"generated_image_{i + 1}{suffix}" if len(images) > 1 else f"generated_image{suffix}",
+                mime=result["mime_type"],
+                key=f"download_{key}_{i}"
+            )
+
+# Results of this session, newest first, kept as the encoded bytes the server returned (with their MIME type)
+# so reruns redraw them without refetching
+if "history" not in st.session_state:
+    st.session_state.history = []
+    st.session_state.generations = 0
+pending = st.session_state.get("pending")
+resumed = pending is not None
+
 # Generate button
-if st.button("Generate Image"):
+if st.button("Generate Image", disabled=resumed):
     if mode != "Freehand Drawing" and not prompt.strip():
         st.warning("Please enter a prompt.")
     elif mode == "Image to Image" and input_image is None:
@@ -232,59 +394,46 @@ if st.button("Generate Image"):
     elif mode == "Freehand Drawing" and (canvas_result.image_data is None):
         st.warning("Please draw something on the canvas.")
     else:
-        with st.spinner("Generating image..."):
-            try:
-                if mode == "Text to Image":
-                    request = text2image_pb2.TextRequest(
-                        prompt=prompt,
-                        width=width,
-                        height=height
-                    )
-                    response = stub.GenerateImage(request)
-
-                elif mode == "Image to Image":
-                    image_bytes = input_image.read()
-                    image_b64 = base64.b64encode(image_bytes).decode('utf-8')
-
-                    request = text2image_pb2.Img2ImgRequest(
-                        prompt=prompt,
-                        input_image_base64=image_b64,
-                        width=width,
-                        height=height,
-                        strength=strength
-                    )
-                    response = stub.GenerateImageFromImage(request)
-
-                elif mode == "Freehand Drawing":
-                    # Convert NumPy canvas to PNG bytes
-                    image = Image.fromarray((canvas_result.image_data[:, :, :3]).astype('uint8'))
-                    buf = io.BytesIO()
-                    image.save(buf, format='PNG')
-                    image_bytes = buf.getvalue()
-                    image_b64 = base64.b64encode(image_bytes).decode('utf-8')
-
-                    request = text2image_pb2.Img2ImgRequest(
-                        prompt=prompt,
-                        input_image_base64=image_b64,
-                        width=width,
-                        height=height,
-                        strength=0.75  # Default for drawing
-                    )
-                    response = stub.GenerateImageFromImage(request)
-
-                if response.status == "success":
-                    image_data = base64.b64decode(response.image_base64)
-                    image = Image.open(io.BytesIO(image_data))
-                    st.image(image, use_container_width=True)
-
-                    st.download_button(
-                        label="Download Image",
-                        data=image_data,
-                        file_name="generated_image.png",
-                        mime="image/png"
-                    )
-                else:
-                    st.error(f"Error: {response.status}")
-
-            except Exception as e:
-                st.error(f"Error communicating with the server: {str(e)}")
\ No newline at end of file
+        pending = st.session_state.pending = submit_generation()
+
+if pending is not None:
+    try:
+        response = wait_for_result(pending)
+    except grpc.RpcError as e:
+        # Invalid requests and overload come back as status codes rather than error responses
+        if e.code() in (grpc.StatusCode.INVALID_ARGUMENT, grpc.StatusCode.RESOURCE_EXHAUSTED):
+            st.session_state.error = f"Error: {e.details()}"
+        else:
+            st.session_state.error = f"Error communicating with the server: {str(e)}"
+    except Exception as e:
+        st.session_state.error = f"Error communicating with the server: {str(e)}"
+    else:
+        if response.status == "success":
+            images = list(response.images) or [response.image]
+            st.session_state.generations += 1
+            st.session_state.history.insert(0, {
+                "id": st.session_state.generations,
+                "prompt": pending.prompt,
+                "images": images,
+                "seeds": list(response.seeds) or [None] * len(images),
+                "mime_type": response.mime_type or "image/png",
+                "size_adjustment": response.size_adjustment,
+            })
+            del st.session_state.history[HISTORY_SIZE:]
+        else:
+            st.session_state.error = f"Error: {response.status}"
+    st.session_state.pending = None
+    if resumed:
+        # The button was drawn disabled while this ran
+        st.rerun()
+
+if "error" in st.session_state:
+    st.error(st.session_state.pop("error"))
+history = st.session_state.history
+if history:
+    show_result(history[0], history[0]["id"])
+if len(history) > 1:
+    with st.expander(f"Previous results ({len(history) - 1})"):
+        for result in history[1:]:
+            st.markdown(f"**{result['prompt']}**")
+            show_result(result, result["id"])
@@ -0,0 +1,139 @@
+import argparse
+import gc
+import json
+import sys
+import time
+
+import numpy as np
+import torch
+
+import grpc_server
+from batching import GenerationJob
+from metrics import RequestTrace
+
+# Compares inference backends in this process, stage by stage, on identical seeded batches:
+#   python include/backend_benchmark.py --backends cuda,cpu:bf16,cpu:int8 --steps 20 --batch-sizes 1,4
+#   BACKEND=cpu python include/backend_benchmark.py --backends cpu:fp32,cpu:bf16 --size 384x384
+# A backend is a BACKEND name, with an optional CPU_PRECISION after a colon. Server settings such as
+# MODEL_PATH, CPU_THREADS and MEMORY_BUDGET_MB apply as they would to grpc_server.py.
+
+STAGES = ("text_encode", "denoise", "vae_decode")
+PROMPT = "a lighthouse on a cliff at sunset, photograph"
+
+
+def parse_size(value):
+    width, _, height = value.partition("x")
+    return int(width), int(height or width)
+
+
+def measure(run_batch, width, height, steps, batch_size, repeats, seed):
+    # Mean seconds per batch for each stage, and the images of the last repeat
+    totals = dict.fromkeys(STAGES + ("total",), 0.0)
+    images = None
+    for _ in range(repeats):
+        trace = RequestTrace("txt2img", width, height, steps)
+        jobs = [
+            GenerationJob(PROMPT, width=width, height=height, num_inference_steps=steps, seed=seed + i, trace=trace)
+            for i in range(batch_size)
+        ]
+        start = time.perf_counter()
+        images = run_batch(jobs[0].batch_key(), jobs)
+        totals["total"] += time.perf_counter() - start
+        for stage in STAGES:
+            totals[stage] += trace.stages.get(stage, 0.0)
+    return {stage: seconds / repeats for stage, seconds in totals.items()}, images
+
+
+def pixel_difference(images, reference):
+    # Mean absolute difference in 0-255 pixel values, image by image
+    return float(np.mean([
+        np.abs(np.asarray(a, dtype=np.float32) - np.asarray(b, dtype=np.float32)).mean()
+        for a, b in zip(images, reference)
+    ]))
+
+
+def benchmark(spec, args):
+    name, _, precision = spec.partition(":")
+    backend = grpc_server.make_backend(name, precision or None)
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    backend.load()
+    result = {"backend": spec, "variant": backend.variant or "cuda-fp16", "device": backend.device}
+    result["load_seconds"] = time.perf_counter() - start
+    run_batch = grpc_server.make_batch_runner(backend, backend.make_planner())
+
+    width, height = args.size
+    # First calls at a shape pay for kernel selection and allocator growth
+    measure(run_batch, width, height, 1, 1, 1, args.seed)
+    result["batches"] = []
+    images = {}
+    for batch_size in args.batch_sizes:
+        stages, images[batch_size] = measure(run_batch, width, height, args.steps, batch_size, args.repeats, args.seed)
+        result["batches"].append(dict(
+            batch_size=batch_size,
+            seconds_per_image=stages["total"] / batch_size,
+            images_per_second=batch_size / stages["total"],
+            stage_seconds=stages
+        ))
+    if backend.device.startswith("cuda"):
+        result["peak_memory_mb"] = torch.cuda.max_memory_allocated() / 2 ** 20
+
+    # Release the weights before the next backend loads its own
+    del backend, run_batch
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    return result, images
+
+
+def print_report(results):
+    stage_columns = " ".join(f"{stage:>11}" for stage in STAGES)
+    print(f"{'backend':>14} {'batch':>5} {'s/image':>8} {'images/s':>8} {stage_columns} {'diff':>6}")
+    for result in results:
+        for batch in result["batches"]:
+            stages = " ".join(f"{batch['stage_seconds'][stage]:11.3f}" for stage in STAGES)
+            diff = batch.get("pixel_difference")
+            print(
+                f"{result['backend']:>14} {batch['batch_size']:>5} {batch['seconds_per_image']:8.3f} "
+                f"{batch['images_per_second']:8.3f} {stages} {'-' if diff is None else f'{diff:6.2f}':>6}"
+            )
+    print("diff: mean absolute pixel difference from the first backend on the same device (same seeds)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare inference backends on identical seeded batches")
+    parser.add_argument("--backends", default="auto", help="comma-separated, e.g. cuda,cpu:bf16,cpu:int8")
+    parser.add_argument("--size", type=parse_size, default=(512, 512), help="WIDTHxHEIGHT")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--batch-sizes", type=lambda v: [int(b) for b in v.split(",")], default=[1])
+    parser.add_argument("--repeats", type=int, default=3, help="timed batches per batch size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    references = {}  # device -> images per batch size of the first backend on it
+    for spec in args.backends.split(","):
+        print(f"Benchmarking {spec}...")
+        try:
+            result, images = benchmark(spec.strip(), args)
+        except ValueError as e:
+            sys.exit(f"{spec}: {e}")
+        # Generators are per device, so only backends on the same device start from the same noise;
+        # fake images have nothing to compare
+        reference = references.setdefault(result["device"], images) if result["variant"] != "fake" else images
+        if reference is not images:
+            for batch in result["batches"]:
+                size = batch["batch_size"]
+                batch["pixel_difference"] = pixel_difference(images[size], reference[size])
+        results.append(result)
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+import random
+
+import torch
+from PIL import Image
+from diffusers import (
+    StableDiffusionPipeline,
+    StableDiffusionImg2ImgPipeline,
+    StableDiffusionInpaintPipeline,
+    AutoencoderKL
+)
+
+from fake_pipeline import FakePipeline
+from memory_planner import MemoryPlanner
+from pipelines import PipelineRegistry
+from prompt_cache import PromptEmbeddingCache
+from sampling import LATENT_MULTIPLE, build_schedulers
+
+# Inference engines the server can run on; "auto" picks fake, cuda or cpu from PIPELINE and DEVICE
+BACKENDS = ("cuda", "cpu", "fake")
+
+# CPU weight formats: bf16 needs native support (AVX512-BF16/AMX, Arm SVE) to beat fp32;
+# int8 quantizes the UNet's and text encoder's linear layers dynamically and keeps convolutions fp32
+CPU_PRECISIONS = ("auto", "fp32", "bf16", "int8")
+
+
+def resolve_backend(name, pipeline="diffusers", device="cuda"):
+    """Returns the backend name "auto" stands for; raises ValueError for unknown ones."""
+    if name and name != "auto":
+        if name not in BACKENDS:
+            raise ValueError(f"unknown backend {name!r}, expected one of {', '.join(BACKENDS)} or auto")
+        if name == "cuda" and not torch.cuda.is_available():
+            raise ValueError("the cuda backend needs a CUDA device; use cpu or auto")
+        return name
+    if pipeline == "fake":
+        return "fake"
+    if device.startswith("cuda") and torch.cuda.is_available():
+        return "cuda"
+    return "cpu"
+
+
+class Backend:
+    """An inference engine behind the batch runner.
+
+    The runner calls ``encode_prompt``, ``denoise`` and ``decode`` for each
+    batch (plus ``encode_image`` for img2img init latents), always from the
+    scheduler thread. Subclasses provide ``load``, which builds ``registry``
+    and optionally ``prompt_cache`` and ``schedulers``; the base class drives
+    diffusers-style pipelines from there.
+    """
+
+    name = None
+
+    def __init__(self, device="cpu", negative_prompt=""):
+        self.device = device
+        self.negative_prompt = negative_prompt
+        self.registry = None
+        self.prompt_cache = None
+        self.schedulers = None
+
+    @property
+    def variant(self):
+        # Tells results of this engine apart in the result cache; the CUDA fp16 reference has none
+        return self.name
+
+    def load(self):
+        raise NotImplementedError
+
+    def pipeline(self, task):
+        return self.registry.get(task)
+
+    def encode_prompt(self, prompts):
+        """Returns the pipeline arguments for ``prompts``, from cached text-encoder outputs where possible."""
+        if self.prompt_cache is None:
+            return {"prompt": list(prompts), "negative_prompt": [self.negative_prompt] * len(prompts)}
+        return {
+            "prompt_embeds": self.prompt_cache.encode(prompts),
+            "negative_prompt_embeds": self.prompt_cache.negative(len(prompts)),
+        }
+
+    def encode_image(self, image):
+        """Returns the init latents of an img2img input image, or of a list of them as one batch."""
+        raise NotImplementedError(f"the {self.name} backend takes init images as they are")
+
+    def denoise(self, task, scheduler, seeds, **kwargs):
+        """Runs the task's pipeline up to latents; ``kwargs`` are passed through to it."""
+        pipeline = self.pipeline(task)
+        if self.schedulers is not None:
+            # Batches run one at a time on the scheduler thread, so swapping in a shared instance is safe
+            pipeline.scheduler = self.schedulers[scheduler]
+        if any(seed is not None for seed in seeds):
+            # One generator per image keeps seeded results independent of batch composition
+            kwargs["generator"] = [
+                torch.Generator(device=self.device).manual_seed(
+                    seed if seed is not None else random.randrange(2 ** 63)
+                )
+                for seed in seeds
+            ]
+        latents = pipeline(output_type="latent", **kwargs).images
+        self.synchronize()
+        return latents
+
+    def decode(self, latents):
+        """Returns PIL images of the latents."""
+        raise NotImplementedError
+
+    def upscale(self, latents, width, height, space="pixel"):
+        """Returns img2img init latents of ``latents`` enlarged to (width, height), see sampling.UPSCALE_SPACES."""
+        if space == "latent":
+            size = (height // LATENT_MULTIPLE, width // LATENT_MULTIPLE)
+            return torch.nn.functional.interpolate(latents, size=size, mode="bicubic", align_corners=False)
+        images = [image.resize((width, height), Image.LANCZOS) for image in self.decode(latents)]
+        return self.encode_image(images)
+
+    def synchronize(self):
+        # Waits for queued device work, so stage timings are honest
+        pass
+
+    def make_planner(self):
+        # A MemoryPlanner where device memory must be planned, else None; needs no weights
+        return None
+
+    def apply_plan(self, task, plan):
+        pass
+
+    def stats(self):
+        return self.prompt_cache.stats() if self.prompt_cache is not None else {}
+
+
+class FakeBackend(Backend):
+    """FakePipeline per task: flat-colour images on CPU, for testing without model weights."""
+
+    name = "fake"
+
+    def __init__(self, step_time=0.0, default_steps=50, image_step_time=0.0, negative_prompt=""):
+        super().__init__("cpu", negative_prompt)
+        self.step_time = step_time
+        self.default_steps = default_steps
+        self.image_step_time = image_step_time
+
+    def load(self):
+        print("Using fake pipeline")
+        self.registry = PipelineRegistry({})
+        for task in ("txt2img", "img2img"):
+            pipeline = FakePipeline(self.step_time, self.default_steps, image_step_time=self.image_step_time)
+            self.registry.add(task, pipeline)
+        return self
+
+    def decode(self, latents):
+        # FakePipeline ignores output_type and already returns images
+        return latents
+
+    def upscale(self, latents, width, height, space="pixel"):
+        # FakePipeline takes init images as they are, in either space
+        return [image.resize((width, height)) for image in latents]
+
+
+class DiffusersBackend(Backend):
+    """Stable Diffusion through diffusers and torch on ``device``, in ``dtype``."""
+
+    dtype = torch.float32
+
+    def __init__(self, model_path, vae_path, device="cpu", negative_prompt="", local_files_only=False,
+                 prompt_cache_entries=512):
+        super().__init__(device, negative_prompt)
+        self.model_path = model_path
+        self.vae_path = vae_path
+        self.local_files_only = local_files_only
+        self.prompt_cache_entries = prompt_cache_entries
+
+    def load(self):
+        # safetensors checkpoints are memory-mapped rather than read and unpickled
+        print(f"Loading VAE from {self.vae_path}...")
+        vae = AutoencoderKL.from_pretrained(
+            self.vae_path,
+            torch_dtype=self.dtype,
+            use_safetensors=True,
+            local_files_only=self.local_files_only
+        ).to(self.device)
+
+        print(f"Loading text-to-image pipeline from {self.model_path} ({self.name}, {self.dtype})...")
+        pipe = StableDiffusionPipeline.from_pretrained(
+            self.model_path,
+            vae=vae,
+            torch_dtype=self.dtype,
+            use_safetensors=True,
+            local_files_only=self.local_files_only
+        ).to(self.device)
+        _configure_pipeline(pipe)
+        self.optimize(pipe)
+
+        # Task variants share the base pipeline's weights and are built once at startup
+        print("Building task pipelines...")
+        self.registry = PipelineRegistry(pipe.components, configure=_configure_pipeline)
+        self.registry.add("txt2img", pipe)
+        self.registry.register("img2img", StableDiffusionImg2ImgPipeline)
+        self.registry.register("inpaint", StableDiffusionInpaintPipeline)
+        self.registry.build_all()
+
+        print("Encoding negative prompt...")
+        self.prompt_cache = PromptEmbeddingCache(
+            pipe.tokenizer,
+            pipe.text_encoder,
+            negative_prompt=self.negative_prompt,
+            max_entries=self.prompt_cache_entries
+        )
+
+        print("Creating schedulers...")
+        self.schedulers = build_schedulers(pipe.scheduler)
+        return self
+
+    def optimize(self, pipe):
+        # Engine-specific changes to the loaded components, made before task pipelines share them
+        pass
+
+    @torch.no_grad()
+    def encode_image(self, image):
+        # What the img2img pipeline does to its init image, except that it takes the latent distribution's mode
+        # rather than a seeded sample, so the result can be shared by every seed (the two differ negligibly)
+        pipeline = self.pipeline("img2img")
+        pixels = pipeline.image_processor.preprocess(image).to(device=self.device, dtype=self.dtype)
+        latents = pipeline.vae.encode(pixels).latent_dist.mode()
+        return latents * pipeline.vae.config.scaling_factor
+
+    @torch.no_grad()
+    def decode(self, latents):
+        pipeline = self.pipeline("txt2img")
+        image = pipeline.vae.decode(latents / pipeline.vae.config.scaling_factor, return_dict=False)[0]
+        return pipeline.image_processor.postprocess(image, output_type="pil")
+
+
+class CudaBackend(DiffusersBackend):
+    """fp16 on a CUDA device, with memory savings chosen per batch by the MemoryPlanner."""
+
+    name = "cuda"
+    dtype = torch.float16
+
+    def __init__(self, model_path, vae_path, device="cuda", memory_budget_mb=0, memory_budget_fraction=0.9,
+                 memory_overflow="downscale", **kwargs):
+        super().__init__(model_path, vae_path, device, **kwargs)
+        self.memory_budget_mb = memory_budget_mb
+        self.memory_budget_fraction = memory_budget_fraction
+        self.memory_overflow = memory_overflow
+        self._applied = {}
+
+    @property
+    def variant(self):
+        return ""
+
+    def synchronize(self):
+        torch.cuda.synchronize()
+
+    def make_planner(self):
+        if self.memory_budget_mb:
+            budget_bytes = self.memory_budget_mb * 1024 * 1024
+        else:
+            total = torch.cuda.get_device_properties(torch.device(self.device)).total_memory
+            budget_bytes = int(total * self.memory_budget_fraction)
+        sdpa = hasattr(torch.nn.functional, "scaled_dot_product_attention")
+        print(f"GPU memory budget: {budget_bytes / 2 ** 30:.1f} GiB ({'SDPA' if sdpa else 'eager'} attention)")
+        return MemoryPlanner(budget_bytes, dtype="float16", sdpa=sdpa, overflow=self.memory_overflow)
+
+    def apply_plan(self, task, plan):
+        # Toggles memory savings to match plan; _applied holds what is applied (nothing at first),
+        # so unchanged settings are free
+        pipeline = self.pipeline(task)
+        state = self._applied
+        vae = pipeline.vae
+        if state.get("vae_slicing", False) != plan.vae_slicing:
+            vae.enable_slicing() if plan.vae_slicing else vae.disable_slicing()
+        if state.get("vae_tiling", False) != plan.vae_tiling:
+            vae.enable_tiling() if plan.vae_tiling else vae.disable_tiling()
+        if state.get("attention_slicing", False) != plan.attention_slicing:
+            # The UNet is shared by every task pipeline, so this applies to all of them
+            pipeline.enable_attention_slicing() if plan.attention_slicing else pipeline.disable_attention_slicing()
+        # Offload hooks belong to the pipeline that installed them
+        offloaded = state.get("cpu_offload")
+        if plan.cpu_offload and offloaded is not pipeline:
+            if offloaded is not None:
+                offloaded.remove_all_hooks()
+            pipeline.enable_model_cpu_offload(device=self.device)
+        elif not plan.cpu_offload and offloaded is not None:
+            offloaded.remove_all_hooks()
+            offloaded.to(self.device)
+        state.update(plan._asdict(), cpu_offload=pipeline if plan.cpu_offload else None)
+
+
+class CpuBackend(DiffusersBackend):
+    """torch on CPU: bf16 or int8 weights, channels_last convolutions and a tuned thread count.
+
+    Intel Extension for PyTorch is applied when installed. About an order of
+    magnitude slower than a GPU per image, so it suits batch-priority and
+    draft-profile work on spare CPU capacity.
+    """
+
+    name = "cpu"
+
+    def __init__(self, model_path, vae_path, precision="auto", threads=0, **kwargs):
+        super().__init__(model_path, vae_path, "cpu", **kwargs)
+        if precision not in CPU_PRECISIONS:
+            raise ValueError(f"unknown CPU precision {precision!r}, expected one of {', '.join(CPU_PRECISIONS)}")
+        self.precision = _native_bf16_precision() if precision == "auto" else precision
+        self.threads = threads
+        self.dtype = torch.bfloat16 if self.precision == "bf16" else torch.float32
+
+    @property
+    def variant(self):
+        return f"cpu-{self.precision}"
+
+    def load(self):
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        print(f"CPU backend: {self.precision}, {torch.get_num_threads()} threads")
+        return super().load()
+
+    def optimize(self, pipe):
+        # NHWC lets oneDNN pick its fastest convolution kernels
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+        if self.precision == "int8":
+            # Linear layers hold most of the attention and feed-forward weights; swapped in place,
+            # so the task pipelines built from these components share the quantized modules
+            for module in (pipe.unet, pipe.text_encoder):
+                torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+            return
+        try:
+            import intel_extension_for_pytorch as ipex
+        except ImportError:
+            return
+        pipe.unet = ipex.optimize(pipe.unet.eval(), dtype=self.dtype, inplace=True)
+        pipe.vae = ipex.optimize(pipe.vae.eval(), dtype=self.dtype, inplace=True)
+        print("Intel Extension for PyTorch optimizations enabled")
+
+
+def _configure_pipeline(pipeline):
+    # Memory savings are chosen per batch by the planner, see CudaBackend.apply_plan
+    pipeline.safety_checker = None
+
+
+def _native_bf16_precision():
+    # bf16 only where oneDNN has native kernels for it; emulated bf16 is slower than fp32
+    try:
+        return "bf16" if torch.ops.mkldnn._is_mkldnn_bf16_supported() else "fp32"
+    except (AttributeError, RuntimeError):
+        return "fp32"
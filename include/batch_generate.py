@@ -0,0 +1,378 @@
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import time
+from collections import namedtuple
+from concurrent import futures
+
+from image_encoding import PNG, encode_image, extension, parse_format
+from sampling import normalize_size, resolve_mode, resolve_sampling, resolve_size, upscale_saves
+
+# Offline bulk generation over a prompt file, e.g. prompts.json:
+#   python include/batch_generate.py prompts.json                      (loads the model in this process)
+#   python include/batch_generate.py prompts.jsonl --target host:50051  (against a running server or router)
+# Each entry takes the same fields as a TextRequest (prompt, width, height, size, profile,
+# num_inference_steps, scheduler, guidance_scale, seed, num_images, mode, refine_strength) plus an optional "id".
+# Progress is checkpointed in the output directory's manifest.jsonl; rerunning the same command resumes.
+
+# Entries read and sorted at a time; larger windows fill more batches, at the cost of memory and ordering
+BATCH_WINDOW = int(os.environ.get("BATCH_WINDOW", 256))
+# Requests in flight against a remote server, enough to let its micro-batcher fill batches
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 8))
+BATCH_RPC_TIMEOUT = float(os.environ.get("BATCH_RPC_TIMEOUT", 600))
+# Longest pause between retries of requests the server throttled or shed
+BATCH_MAX_BACKOFF = float(os.environ.get("BATCH_MAX_BACKOFF", 30))
+
+OUTPUT_ROOT = os.path.join(os.path.dirname(__file__), "..", "images", "batch")
+
+# One entry of the prompt file with every default resolved, so runs are reproducible from the manifest
+# refine_strength is set for upscale-mode entries only (see sampling.MODES)
+Entry = namedtuple("Entry", ["id", "prompt", "width", "height", "sampling", "seeds", "refine_strength"])
+
+
+def read_entries(path):
+    # Yields (index, raw entry, decode error). JSONL is streamed line by line, and a line that isn't
+    # valid JSON fails only its own entry; a JSON file holds one list of entries
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f):
+                if not line.strip():
+                    continue
+                try:
+                    raw, error = json.loads(line), None
+                except ValueError as e:
+                    raw, error = None, e
+                yield line_number, raw, error
+    else:
+        with open(path, encoding="utf-8") as f:
+            for index, raw in enumerate(json.load(f)):
+                yield index, raw, None
+
+
+def parse_entry(index, raw):
+    # Raises ValueError for entries the server would reject; fields of the wrong type raise TypeError
+    if not isinstance(raw, dict):
+        raise ValueError("entry is not a JSON object")
+    if not raw.get("prompt"):
+        raise ValueError("missing prompt")
+    if not isinstance(raw["prompt"], str):
+        raise ValueError("prompt is not a string")
+    width, height = normalize_size(*resolve_size(raw.get("size", ""), raw.get("width", 0), raw.get("height", 0)))
+    sampling = resolve_sampling(
+        raw.get("profile", ""), raw.get("num_inference_steps"), raw.get("scheduler", ""), raw.get("guidance_scale")
+    )
+    _, refine_strength = resolve_mode(raw.get("mode", ""), raw.get("refine_strength"))
+    if refine_strength is not None and not upscale_saves(width, height, refine_strength):
+        # Like the server, upscale mode runs directly where it saves nothing
+        refine_strength = None
+    num_images = raw.get("num_images", 1)
+    if not isinstance(num_images, int) or num_images < 1:
+        raise ValueError(f"invalid num_images {num_images!r}")
+    # Unseeded entries get a seed now, so the manifest records how to regenerate them
+    seed = raw["seed"] if raw.get("seed") is not None else random.randrange(2 ** 62)
+    if not isinstance(seed, int):
+        raise ValueError(f"invalid seed {seed!r}")
+    seeds = [seed + i for i in range(num_images)]
+    return Entry(str(raw.get("id", index)), raw["prompt"], width, height, sampling, seeds, refine_strength)
+
+
+def shape_key(entry):
+    # Entries that can share a pipeline call sort next to each other
+    return (
+        entry.width, entry.height, entry.sampling.steps, entry.sampling.scheduler, entry.sampling.guidance_scale,
+        entry.refine_strength or 0.0
+    )
+
+
+def windows(entries, size):
+    window = []
+    for entry in entries:
+        window.append(entry)
+        if len(window) == size:
+            yield sorted(window, key=shape_key)
+            window = []
+    if window:
+        yield sorted(window, key=shape_key)
+
+
+class Manifest:
+    """Append-only manifest.jsonl: one line per finished entry, which doubles as the resume checkpoint."""
+
+    def __init__(self, path, restart=False):
+        self.path = path
+        self.done = set()
+        if restart and os.path.exists(path):
+            os.remove(path)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line of an interrupted run
+                    if record.get("status") == "success":
+                        self.done.add(record["id"])
+        self._file = open(path, "a", encoding="utf-8")
+
+    def record(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        # Flushed per entry, so a crash loses at most the entries still running
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        if record.get("status") == "success":
+            self.done.add(record["id"])
+
+    def close(self):
+        self._file.close()
+
+
+class LocalBackend:
+    """Runs entries through the server's batch runner and BatchScheduler in this process."""
+
+    def __init__(self, output_format=PNG):
+        import grpc_server
+        from batching import BatchScheduler, GenerationJob, gather
+
+        self._job = GenerationJob
+        self._gather = gather
+        # BACKEND and the other server settings pick the engine, e.g. BACKEND=cpu for a GPU-less machine
+        backend = grpc_server.make_backend().load()
+        self.planner = backend.make_planner()
+        run_batch = grpc_server.make_batch_runner(backend, self.planner)
+        self.scheduler = BatchScheduler(
+            run_batch, max_batch_size=grpc_server.BATCH_MAX_SIZE, max_wait=grpc_server.BATCH_MAX_WAIT
+        ).start()
+        # Encoding runs here, so the scheduler thread goes straight on to the next batch
+        self.encoder = futures.ThreadPoolExecutor(max_workers=2)
+        self.output_format = output_format
+
+    def submit(self, entry):
+        # Returns a Future of the entry's encoded images
+        width, height = entry.width, entry.height
+        if self.planner is not None:
+            width, height = self.planner.admit(width, height)
+        refine_strength = entry.refine_strength
+        if refine_strength is not None and not upscale_saves(width, height, refine_strength):
+            refine_strength = None
+        jobs = [
+            self._job(
+                entry.prompt,
+                width=width,
+                height=height,
+                num_inference_steps=entry.sampling.steps,
+                guidance_scale=entry.sampling.guidance_scale,
+                scheduler=entry.sampling.scheduler,
+                seed=seed,
+                refine_strength=refine_strength
+            )
+            for seed in entry.seeds
+        ]
+        images = self._gather(self.scheduler.submit_many(jobs))
+        encoded = futures.Future()
+
+        def encode():
+            try:
+                encoded.set_result([
+                    _encode(image, entry.width, entry.height, self.output_format) for image in images.result()
+                ])
+            except Exception as e:
+                encoded.set_exception(e)
+        images.add_done_callback(lambda _: self.encoder.submit(encode))
+        return encoded
+
+    def close(self):
+        self.scheduler.close()
+        self.encoder.shutdown()
+
+
+class RemoteBackend:
+    """Sends each entry as one GenerateImageV2 call to a server or router.
+
+    Requests go out in the batch priority class, so interactive users are
+    served first, and throttled or shed requests are retried with backoff.
+    """
+
+    def __init__(self, target, concurrency=BATCH_CONCURRENCY, timeout=BATCH_RPC_TIMEOUT, output_format=PNG):
+        import grpc
+        import text2image_pb2
+        import text2image_pb2_grpc
+        from fair_queue import CLIENT_ID_KEY, PRIORITY_KEY, RETRYABLE_KEY
+        from healthcheck import wait_until_serving
+
+        self._grpc = grpc
+        self._retryable_key = RETRYABLE_KEY
+        self._pb2 = text2image_pb2
+        self.metadata = ((CLIENT_ID_KEY, f"batch_generate@{socket.gethostname()}"), (PRIORITY_KEY, "batch"))
+        self.channel = grpc.insecure_channel(target, options=[("grpc.max_receive_message_length", 64 * 1024 * 1024)])
+        self.stub = text2image_pb2_grpc.Text2ImageStub(self.channel)
+        self.timeout = timeout
+        self.output_format = output_format
+        # Requests are rejected until models are loaded
+        print(f"Waiting for {target} to report SERVING...")
+        if wait_until_serving(target, timeout) != "SERVING":
+            raise RuntimeError(f"{target} is not serving")
+        self.executor = futures.ThreadPoolExecutor(max_workers=concurrency)
+
+    def submit(self, entry):
+        return self.executor.submit(self._generate, entry)
+
+    def _generate(self, entry):
+        request = self._pb2.TextRequest(
+            prompt=entry.prompt,
+            width=entry.width,
+            height=entry.height,
+            num_inference_steps=entry.sampling.steps,
+            scheduler=entry.sampling.scheduler,
+            guidance_scale=entry.sampling.guidance_scale,
+            seed=entry.seeds[0],
+            num_images=len(entry.seeds),
+            output_format=self.output_format.name,
+            quality=self.output_format.quality
+        )
+        if entry.refine_strength is not None:
+            request.mode = "upscale"
+            request.refine_strength = entry.refine_strength
+        deadline = time.monotonic() + self.timeout
+        backoff = 1.0
+        while True:
+            try:
+                response = self.stub.GenerateImageV2(
+                    request, timeout=deadline - time.monotonic(), metadata=self.metadata
+                )
+                break
+            except self._grpc.RpcError as e:
+                if e.code() != self._grpc.StatusCode.RESOURCE_EXHAUSTED or time.monotonic() + backoff > deadline:
+                    raise
+                # Throttled requests are retried; ones that can never fit, such as over the memory budget, aren't
+                if (self._retryable_key, "false") in tuple(e.trailing_metadata() or ()):
+                    raise
+            time.sleep(backoff)
+            backoff = min(backoff * 2, BATCH_MAX_BACKOFF)
+        if response.status != "success":
+            raise RuntimeError(response.status)
+        return list(response.images) or [response.image]
+
+    def close(self):
+        self.executor.shutdown()
+        self.channel.close()
+
+
+def _encode(image, width, height, output_format):
+    from PIL import Image
+
+    if image.size != (width, height):
+        image = image.resize((width, height), Image.BICUBIC)
+    return encode_image(image, output_format)
+
+
+def _record(entry):
+    # Manifest fields of an entry; with the seeds they are enough to regenerate its images
+    return {
+        "id": entry.id,
+        "prompt": entry.prompt,
+        "width": entry.width,
+        "height": entry.height,
+        "num_inference_steps": entry.sampling.steps,
+        "scheduler": entry.sampling.scheduler,
+        "guidance_scale": entry.sampling.guidance_scale,
+        "seeds": entry.seeds,
+        "mode": "upscale" if entry.refine_strength is not None else "direct",
+        "refine_strength": entry.refine_strength,
+    }
+
+
+def run(input_path, output_dir, backend, window=BATCH_WINDOW, restart=False):
+    suffix = extension(backend.output_format)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(os.path.join(output_dir, "manifest.jsonl"), restart=restart)
+    skipped = len(manifest.done)
+    if skipped:
+        print(f"Resuming: {skipped} entries already done")
+    completed = images = failed = 0
+
+    def pending_entries():
+        # Malformed entries count as failed, so a run of nothing but them doesn't exit 0
+        nonlocal failed
+        for index, raw, error in read_entries(input_path):
+            entry_id = str(raw.get("id", index)) if isinstance(raw, dict) else str(index)
+            if entry_id in manifest.done:
+                continue
+            try:
+                if error is not None:
+                    raise ValueError(f"invalid JSON: {error}")
+                entry = parse_entry(index, raw)
+            except (ValueError, TypeError) as e:
+                failed += 1
+                print(f"Skipping entry {entry_id}: {e}")
+                manifest.record({"id": entry_id, "status": f"error: {e}"})
+                continue
+            yield entry
+
+    started = time.monotonic()
+    try:
+        for batch in windows(pending_entries(), window):
+            # The whole window is queued at once, in shape order, so batches fill up
+            submitted = {}
+            for entry in batch:
+                try:
+                    submitted[backend.submit(entry)] = entry
+                except Exception as e:  # e.g. too large for the memory budget
+                    failed += 1
+                    print(f"Entry {entry.id} failed: {e}")
+                    manifest.record(dict(_record(entry), status=f"error: {e}"))
+            for future in futures.as_completed(submitted):
+                entry = submitted[future]
+                try:
+                    encoded = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"Entry {entry.id} failed: {e}")
+                    manifest.record(dict(_record(entry), status=f"error: {e}"))
+                    continue
+
+                files = []
+                for seed, data in zip(entry.seeds, encoded):
+                    filename = f"{entry.id}_{seed}{suffix}"
+                    with open(os.path.join(output_dir, filename), "wb") as f:
+                        f.write(data)
+                    files.append(filename)
+                manifest.record(dict(_record(entry), files=files, status="success"))
+                completed += 1
+                images += len(files)
+
+            elapsed = time.monotonic() - started
+            print(f"{completed} entries ({images} images) done, {failed} failed, {images / elapsed:.2f} images/s")
+    finally:
+        manifest.close()
+    return completed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate images for every entry of a JSON or JSONL prompt file")
+    parser.add_argument("input", help="JSON list or JSONL file of generation requests")
+    parser.add_argument("--output-dir", help="images and manifest.jsonl (default images/batch/<input name>)")
+    parser.add_argument("--target", help="gRPC server or router address; without it the model is loaded here")
+    parser.add_argument("--window", type=int, default=BATCH_WINDOW, help="entries sorted by shape at a time")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="requests in flight with --target")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start over")
+    parser.add_argument("--format", type=parse_format, default=PNG, help="image encoding, e.g. png, jpeg:90, webp:85")
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or os.path.join(OUTPUT_ROOT, os.path.splitext(os.path.basename(args.input))[0])
+    if args.target:
+        backend = RemoteBackend(args.target, args.concurrency, output_format=args.format)
+    else:
+        backend = LocalBackend(args.format)
+    try:
+        completed, failed = run(args.input, output_dir, backend, args.window, args.restart)
+    finally:
+        backend.close()
+    print(f"Wrote {completed} entries to {output_dir}, {failed} failed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
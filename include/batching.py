@@ -0,0 +1,285 @@
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from time import monotonic
+
+from fair_queue import PRIORITIES, FairQueue, priority_rank
+
+# Defaults for the micro-batching window
+DEFAULT_MAX_BATCH_SIZE = 4
+DEFAULT_MAX_WAIT_SECONDS = 0.05
+
+# Smoothing factor for the moving average of batch run time
+BATCH_TIME_SMOOTHING = 0.2
+
+
+class JobExpired(Exception):
+    """Raised for jobs whose deadline passed while they were still queued."""
+
+
+def gather(futures):
+    """Returns a Future of the list of results of ``futures``; None entries stay None.
+
+    It completes once every future has, with the first exception if any failed.
+    """
+    combined = Future()
+    lock = threading.Lock()
+    remaining = [sum(future is not None for future in futures)]
+
+    def resolve():
+        if combined.cancelled():
+            return
+        try:
+            combined.set_result([future.result() if future is not None else None for future in futures])
+        except BaseException as e:  # includes CancelledError
+            combined.set_exception(e)
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        resolve()
+
+    if not remaining[0]:
+        resolve()
+    for future in futures:
+        if future is not None:
+            future.add_done_callback(on_done)
+    return combined
+
+
+class GenerationJob:
+    """A single generation request waiting to be batched with compatible ones."""
+
+    def __init__(self, prompt, width=512, height=512, num_inference_steps=None, guidance_scale=7.5,
+                 step_callback=None, task="txt2img", init_image=None, strength=None, seed=None,
+                 trace=None, deadline=None, scheduler="default", init_latents=None, init_key=None,
+                 priority="interactive", client_id="", refine_strength=None):
+        self.task = task
+        self.prompt = prompt
+        self.width = width
+        self.height = height
+        self.num_inference_steps = num_inference_steps
+        self.guidance_scale = guidance_scale
+        # Name of the diffusers scheduler to sample with, see sampling.SCHEDULERS
+        self.scheduler = scheduler
+        self.seed = seed
+        # Per-step progress hook; jobs that have one always run alone
+        self.step_callback = step_callback
+        # img2img inputs; the init image is per job, strength must match across a batch
+        self.init_image = init_image
+        self.strength = strength
+        # VAE-encoded init image when already cached under init_key, in which case init_image may be None
+        self.init_latents = init_latents
+        self.init_key = init_key
+        # Upscale mode (see sampling.MODES): txt2img jobs with a refine strength denoise a draft at native
+        # resolution, then refine it at width x height with an img2img pass of this strength
+        self.refine_strength = refine_strength
+        # Optional metrics.RequestTrace the runner records stage timings on
+        self.trace = trace
+        # monotonic() time after which the caller no longer wants the result
+        self.deadline = deadline
+        # Scheduling class (see fair_queue.PRIORITIES) and the client it is fairly queued against
+        self.priority = priority
+        self.client_id = client_id
+        # Set by the scheduler's FairQueue: (class rank, finish tag, sequence), and the start tag
+        self.order = None
+        self.start_tag = 0.0
+        self.future = Future()
+        self.enqueued_at = monotonic()
+
+    def batch_key(self):
+        # Only jobs sharing output shape and sampling settings can run in one pipeline call
+        return (
+            self.task, self.width, self.height, self.num_inference_steps,
+            self.guidance_scale, self.scheduler, self.strength, self.refine_strength, self.step_callback
+        )
+
+
+class BatchScheduler:
+    """Groups queued jobs by batch key and runs each group as one pipeline call.
+
+    The next batch comes from the group holding the most urgent job: any
+    interactive job before batch ones, then weighted fair queueing across
+    clients (see fair_queue.FairQueue), so a client queueing hundreds of
+    jobs delays others by a fair share rather than by its whole backlog.
+
+    ``run_batch(key, jobs)`` must return one result per job, in order. It is
+    called from a single worker thread, so the underlying pipeline is never
+    entered concurrently.
+    """
+
+    def __init__(self, run_batch, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT_SECONDS,
+                 fair_queue=None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.fair_queue = fair_queue or FairQueue()
+        self._pending = OrderedDict()  # batch key -> list of jobs in fair-queue order
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self._depth = 0
+        self._depths = [0] * len(PRIORITIES)
+        self._running = 0
+        self.avg_batch_seconds = None
+        self.expired = 0
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="batch-scheduler", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, job):
+        return self.submit_many([job])[0]
+
+    def submit_many(self, jobs):
+        # Enqueued atomically, so jobs with the same key land in the same batch (up to max_batch_size)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BatchScheduler is closed")
+            for job in jobs:
+                self.fair_queue.tag(job)
+                group = self._pending.setdefault(job.batch_key(), [])
+                group.append(job)
+                group.sort(key=_order)
+                self._depths[job.order[0]] += 1
+            self._depth += len(jobs)
+            self._cond.notify_all()
+        return [job.future for job in jobs]
+
+    def promote(self, job, priority):
+        """Moves a still-queued job up to a more preferred class, e.g. when an interactive request joins it."""
+        with self._cond:
+            group = self._pending.get(job.batch_key())
+            if group is None or job.order is None or priority_rank(priority) >= job.order[0]:
+                return
+            if not any(queued is job for queued in group):
+                return
+            self._depths[job.order[0]] -= 1
+            job.priority = priority
+            self.fair_queue.tag(job)
+            self._depths[job.order[0]] += 1
+            group.sort(key=_order)
+
+    def close(self, wait=True):
+        # Pending jobs are still flushed before the worker exits
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if not self._pending:
+                return None, None
+
+            # Serve the group holding the most urgent job, giving it until max_wait to fill up
+            key, jobs = min(self._pending.items(), key=lambda item: item[1][0].order)
+            deadline = jobs[0].enqueued_at + self.max_wait
+            batchable = jobs[0].step_callback is None
+            while batchable and len(jobs) < self.max_batch_size and not self._closed:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = jobs[:self.max_batch_size]
+            del jobs[:self.max_batch_size]
+            if not jobs:
+                del self._pending[key]
+            self.fair_queue.advance(batch)
+            for job in batch:
+                self._depths[job.order[0]] -= 1
+            self._depth -= len(batch)
+            self._running = len(batch)
+            return key, batch
+
+    def depth(self):
+        # Jobs waiting for a batch slot, excluding the batch currently running
+        with self._cond:
+            return self._depth
+
+    def estimated_wait(self, priority=None):
+        """Rough seconds until a job submitted now starts running; with a priority, only jobs of that class or better count."""
+        with self._cond:
+            if self.avg_batch_seconds is None:
+                return 0.0
+            depth = self._depth if priority is None else sum(self._depths[:priority_rank(priority) + 1])
+            batches_ahead = math.ceil(depth / self.max_batch_size) + (1 if self._running else 0)
+            return batches_ahead * self.avg_batch_seconds
+
+    def stats(self):
+        with self._cond:
+            values = {
+                "queue_depth": self._depth,
+                "queue_running": self._running,
+                "queue_expired": self.expired,
+                "queue_avg_batch_seconds": self.avg_batch_seconds or 0.0,
+            }
+            for priority, depth in zip(PRIORITIES, self._depths):
+                values[f"queue_depth_{priority}"] = depth
+            return values
+
+    def _loop(self):
+        while True:
+            key, batch = self._next_batch()
+            if batch is None:
+                return
+            self._dispatch(key, batch)
+
+    def _dispatch(self, key, batch):
+        try:
+            self._run(key, batch)
+        finally:
+            with self._cond:
+                self._running = 0
+
+    def _run(self, key, batch):
+        # Drop jobs whose callers already gave up or whose deadline has passed
+        now = monotonic()
+        live = []
+        for job in batch:
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            if job.deadline is not None and now > job.deadline:
+                self.expired += 1
+                job.future.set_exception(JobExpired("deadline passed while queued"))
+                continue
+            live.append(job)
+        batch = live
+        if not batch:
+            return
+
+        start = monotonic()
+        try:
+            results = self.run_batch(key, batch)
+            if len(results) != len(batch):
+                raise RuntimeError(f"run_batch returned {len(results)} results for {len(batch)} jobs")
+        except Exception as e:
+            for job in batch:
+                job.future.set_exception(e)
+            return
+
+        elapsed = monotonic() - start
+        with self._cond:
+            if self.avg_batch_seconds is None:
+                self.avg_batch_seconds = elapsed
+            else:
+                self.avg_batch_seconds += BATCH_TIME_SMOOTHING * (elapsed - self.avg_batch_seconds)
+
+        for job, result in zip(batch, results):
+            job.future.set_result(result)
+
+
+def _order(job):
+    return job.order
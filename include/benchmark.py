@@ -0,0 +1,328 @@
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent import futures
+
+import grpc
+import text2image_pb2
+import text2image_pb2_grpc
+from fair_queue import CLIENT_ID_KEY, PRIORITIES, PRIORITY_KEY
+from healthcheck import wait_until_serving
+from sampling import MODES
+
+# Load test against the gRPC server, router or REST gateway:
+#   python include/benchmark.py --fake --concurrency 8 --requests 200        (spawns a fake-pipeline server, no GPU)
+#   python include/benchmark.py --address localhost:50051 --rate 0.5 --duration 300
+#   python include/benchmark.py --protocol rest --address localhost:8000 --concurrency 4
+#   python include/benchmark.py --priority batch --client-id soak --concurrency 8   (background load for
+#       a second, interactive run, to check that its latency holds up)
+# Requests draw prompts and sizes from prompts.json; the request plan depends only on --seed.
+
+PROMPTS_PATH = os.path.join(os.path.dirname(__file__), "..", "prompts.json")
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "grpc_server.py")
+
+# Fake server cost model for --fake: fixed seconds per step, plus seconds per step per 512x512 image
+BENCH_FAKE_STEP_TIME = float(os.environ.get("BENCH_FAKE_STEP_TIME", 0.002))
+BENCH_FAKE_IMAGE_STEP_TIME = float(os.environ.get("BENCH_FAKE_IMAGE_STEP_TIME", 0.004))
+
+PERCENTILES = (50, 95, 99)
+
+# One request of the plan: seconds after the start it is due (open loop only) and what it asks for
+PlannedRequest = namedtuple("PlannedRequest", ["offset", "prompt", "width", "height"])
+Sample = namedtuple("Sample", ["offset", "latency", "width", "height", "status"])
+
+
+def load_mix(path=PROMPTS_PATH):
+    # (prompt, width, height) of every entry; sampling with replacement keeps the file's size mix
+    with open(path, encoding="utf-8") as f:
+        return [(entry["prompt"], entry.get("width", 512), entry.get("height", 512)) for entry in json.load(f)]
+
+
+def plan_requests(mix, count, seed, rate=None):
+    # Open loop: Poisson arrivals at ``rate`` per second; closed loop: offsets are unused
+    rng = random.Random(seed)
+    plan = []
+    offset = 0.0
+    for _ in range(count):
+        if rate:
+            offset += rng.expovariate(rate)
+        prompt, width, height = rng.choice(mix)
+        plan.append(PlannedRequest(offset, prompt, width, height))
+    return plan
+
+
+class GrpcClient:
+    def __init__(self, address, timeout, options, metadata=()):
+        self.channel = grpc.insecure_channel(address, options=[("grpc.max_receive_message_length", 64 * 1024 * 1024)])
+        self.stub = text2image_pb2_grpc.Text2ImageStub(self.channel)
+        self.timeout = timeout
+        self.options = options
+        self.metadata = metadata
+
+    def generate(self, planned):
+        # Returns "success", the response's error status, or the gRPC status code name
+        request = text2image_pb2.TextRequest(
+            prompt=planned.prompt, width=planned.width, height=planned.height, **self.options
+        )
+        try:
+            return self.stub.GenerateImageV2(request, timeout=self.timeout, metadata=self.metadata).status
+        except grpc.RpcError as e:
+            return e.code().name
+
+    def stats(self):
+        try:
+            return dict(self.stub.GetStats(text2image_pb2.StatsRequest(), timeout=self.timeout).values)
+        except grpc.RpcError:
+            return {}
+
+    def close(self):
+        self.channel.close()
+
+
+class RestClient:
+    # One keep-alive connection per thread, like a pool of HTTP clients
+    def __init__(self, address, timeout, options, metadata=()):
+        self.host, _, port = address.partition(":")
+        self.port = int(port or 80)
+        self.timeout = timeout
+        self.options = options
+        self.metadata = metadata
+        self._local = threading.local()
+
+    def generate(self, planned):
+        body = json.dumps(dict(self.options, prompt=planned.prompt, width=planned.width, height=planned.height))
+        headers = {"Content-Type": "application/json", "X-Timeout": str(self.timeout)}
+        headers.update(self.metadata)
+        try:
+            connection = self._connection()
+            connection.request("POST", "/generate-image", body, headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self._local.connection = None
+            return type(e).__name__
+        return "success" if response.status == 200 else f"http_{response.status}"
+
+    def _connection(self):
+        if getattr(self._local, "connection", None) is None:
+            self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._local.connection
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+def closed_loop(client, plan, concurrency):
+    # ``concurrency`` clients each send their next request as soon as the previous one returns
+    samples = []
+    lock = threading.Lock()
+    requests = iter(plan)
+    started = time.perf_counter()
+
+    def worker():
+        while True:
+            with lock:
+                planned = next(requests, None)
+            if planned is None:
+                return
+            start = time.perf_counter()
+            status = client.generate(planned)
+            sample = Sample(start - started, time.perf_counter() - start, planned.width, planned.height, status)
+            with lock:
+                samples.append(sample)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def open_loop(client, plan, max_inflight):
+    # Requests go out at their planned times whether or not earlier ones finished. Latency runs from
+    # the planned time, so a client that falls behind still counts the delay (no coordinated omission)
+    samples = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def send(planned):
+        status = client.generate(planned)
+        latency = time.perf_counter() - (started + planned.offset)
+        with lock:
+            samples.append(Sample(planned.offset, latency, planned.width, planned.height, status))
+
+    with futures.ThreadPoolExecutor(max_workers=max_inflight) as executor:
+        for planned in plan:
+            delay = started + planned.offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, planned)
+    return samples, time.perf_counter() - started
+
+
+def percentile(sorted_values, q):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(q / 100 * len(sorted_values)) - 1)]
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    summary = {f"p{q}": percentile(latencies, q) for q in PERCENTILES}
+    summary["mean"] = sum(latencies) / len(latencies) if latencies else 0.0
+    summary["max"] = latencies[-1] if latencies else 0.0
+    return summary
+
+
+def summarize(samples, elapsed, num_images=1, warmup=0):
+    # Requests starting in the first ``warmup`` seconds are left out, as are their share of the run time
+    measured = [sample for sample in samples if sample.offset >= warmup]
+    ok = [sample for sample in measured if sample.status == "success"]
+    duration = max(elapsed - warmup, 1e-9)
+    statuses = {}
+    for sample in measured:
+        statuses[sample.status] = statuses.get(sample.status, 0) + 1
+
+    by_size = {}
+    for sample in ok:
+        by_size.setdefault(f"{sample.width}x{sample.height}", []).append(sample.latency)
+    return {
+        "requests": len(measured),
+        "succeeded": len(ok),
+        "statuses": statuses,
+        "duration_seconds": duration,
+        "throughput_rps": len(ok) / duration,
+        "throughput_images_per_second": len(ok) * num_images / duration,
+        "latency_seconds": latency_summary([sample.latency for sample in ok]),
+        "latency_by_size": {size: latency_summary(latencies) for size, latencies in sorted(by_size.items())},
+    }
+
+
+def print_report(summary):
+    print(f"Requests: {summary['requests']} ({summary['succeeded']} succeeded) in {summary['duration_seconds']:.1f}s")
+    for status, count in sorted(summary["statuses"].items()):
+        if status != "success":
+            print(f"  {status}: {count}")
+    print(f"Throughput: {summary['throughput_rps']:.2f} req/s, {summary['throughput_images_per_second']:.2f} images/s")
+    rows = [("all", summary["latency_seconds"])] + list(summary["latency_by_size"].items())
+    print(f"{'latency (s)':>12} " + " ".join(f"{name:>8}" for name in ("p50", "p95", "p99", "mean", "max")))
+    for name, latency in rows:
+        print(f"{name:>12} " + " ".join(f"{latency[key]:8.3f}" for key in ("p50", "p95", "p99", "mean", "max")))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def spawn_fake_server(step_time=BENCH_FAKE_STEP_TIME, image_step_time=BENCH_FAKE_IMAGE_STEP_TIME):
+    # A grpc_server.py on the fake pipeline, for CI runs of the scheduling and transport path
+    port = _free_port()
+    env = dict(
+        os.environ,
+        PIPELINE="fake",
+        DEVICE="cpu",
+        GRPC_PORT=str(port),
+        METRICS_PORT=str(_free_port()),
+        FAKE_STEP_TIME=str(step_time),
+        FAKE_IMAGE_STEP_TIME=str(image_step_time),
+        WARMUP_SIZES="",
+        # Every run should measure generation, not cache hits from the previous one
+        RESULT_CACHE_DISK="0",
+    )
+    process = subprocess.Popen([sys.executable, SERVER_SCRIPT], env=env, stdout=subprocess.DEVNULL)
+    return process, f"localhost:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the Text2Image gRPC server or REST gateway")
+    parser.add_argument("--protocol", choices=("grpc", "rest"), default="grpc")
+    parser.add_argument("--address", default="localhost:50051")
+    parser.add_argument("--fake", action="store_true", help="start a fake-pipeline gRPC server to test against")
+    parser.add_argument("--concurrency", type=int, default=4, help="closed loop: clients sending back to back")
+    parser.add_argument("--rate", type=float, help="open loop: Poisson arrivals per second (overrides --concurrency)")
+    parser.add_argument("--requests", type=int, default=100, help="requests to send (closed loop)")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of arrivals (open loop)")
+    parser.add_argument("--max-inflight", type=int, default=256, help="open loop: concurrent requests at most")
+    parser.add_argument("--warmup", type=float, default=0, help="seconds at the start left out of the results")
+    parser.add_argument("--prompts", default=PROMPTS_PATH, help="JSON list of prompt, width, height entries")
+    parser.add_argument("--profile", default="", help="sampling profile, e.g. draft")
+    parser.add_argument("--num-images", type=int, default=1)
+    parser.add_argument("--mode", choices=MODES, default="direct", help="text-to-image mode, e.g. upscale")
+    parser.add_argument("--output-format", default="", help="response encoding, e.g. webp (default: the server's)")
+    parser.add_argument("--timeout", type=float, default=300, help="per-request deadline in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="seeds the request plan")
+    parser.add_argument("--priority", choices=PRIORITIES, help="scheduling class (default: the server's)")
+    parser.add_argument("--client-id", help="client to queue and limit requests as (default: this address)")
+    parser.add_argument("--output", help="write the summary as JSON, e.g. for comparing CI runs")
+    args = parser.parse_args()
+
+    mix = load_mix(args.prompts)
+    if args.rate:
+        plan = plan_requests(mix, math.ceil(args.rate * args.duration * 2) + 10, args.seed, args.rate)
+        plan = [planned for planned in plan if planned.offset < args.duration]
+    else:
+        plan = plan_requests(mix, args.requests, args.seed)
+
+    server = None
+    address = args.address
+    if args.fake:
+        if args.protocol != "grpc":
+            parser.error("--fake only starts a gRPC server")
+        server, address = spawn_fake_server()
+    try:
+        if args.protocol == "grpc":
+            print(f"Waiting for {address} to report SERVING...")
+            if wait_until_serving(address, 900) != "SERVING":
+                sys.exit(f"{address} is not serving")
+        options = {
+            "profile": args.profile, "num_images": args.num_images, "mode": args.mode, "output_format": args.output_format
+        }
+        metadata = []
+        if args.client_id:
+            metadata.append((CLIENT_ID_KEY, args.client_id))
+        if args.priority:
+            metadata.append((PRIORITY_KEY, args.priority))
+        client_class = GrpcClient if args.protocol == "grpc" else RestClient
+        client = client_class(address, args.timeout, options, metadata)
+
+        if args.rate:
+            print(f"Open loop: {len(plan)} requests at {args.rate}/s against {args.protocol}://{address}")
+            samples, elapsed = open_loop(client, plan, args.max_inflight)
+        else:
+            print(f"Closed loop: {len(plan)} requests from {args.concurrency} clients against {args.protocol}://{address}")
+            samples, elapsed = closed_loop(client, plan, args.concurrency)
+
+        summary = summarize(samples, elapsed, args.num_images, args.warmup)
+        summary["config"] = {key: value for key, value in vars(args).items() if key != "output"}
+        summary["server_stats"] = client.stats()
+        client.close()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_report(summary)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    sys.exit(0 if summary["succeeded"] == summary["requests"] else 1)
+
+
+if __name__ == "__main__":
+    main()
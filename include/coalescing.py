@@ -0,0 +1,145 @@
+import threading
+from concurrent.futures import Future
+
+from fair_queue import priority_rank
+
+
+class Flight:
+    """One generation shared by every request waiting for the same result."""
+
+    def __init__(self, key, deadline, priority="interactive"):
+        self.key = key
+        # Resolves to the job's result; cancelled only once no request is waiting
+        self.future = Future()
+        self.job = None
+        self.waiters = 1
+        self.deadline = deadline
+        # Most preferred scheduling class among the waiters
+        self.priority = priority
+        # Futures of work derived from the result once, for every waiter, e.g. its encoding per format
+        self.shared = {}
+
+
+class SingleFlight:
+    """Coalesces identical in-flight jobs, keyed by their result cache key.
+
+    The first request for a key leads: it creates the job and calls start().
+    Requests arriving before that job finishes join its flight and wait on
+    the same future instead of queueing a duplicate, and share() lets them
+    encode and archive the result once rather than each. Each request calls
+    release() when its RPC ends; the job is cancelled only when every waiter
+    has gone, and its deadline is the latest of theirs, so one caller's
+    cancellation or deadline never fails the others. Likewise the job runs
+    in the most preferred class of its waiters, through ``promote(job,
+    priority)`` (BatchScheduler.promote).
+    """
+
+    def __init__(self, promote=None):
+        self.promote = promote
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.led = 0
+        self.joined = 0
+
+    def acquire(self, key, deadline, priority="interactive"):
+        """Returns (flight, leader); a leader must follow up with start() or fail()."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = Flight(key, deadline, priority)
+                self.led += 1
+                return flight, True
+            flight.waiters += 1
+            flight.deadline = _later(flight.deadline, deadline)
+            promoted = priority_rank(priority) < priority_rank(flight.priority)
+            if promoted:
+                flight.priority = priority
+            job = flight.job
+            if job is not None:
+                # Read by the batch scheduler when the job is dispatched
+                job.deadline = flight.deadline
+            self.joined += 1
+        if promoted and job is not None:
+            self._promote(job, priority)
+        return flight, False
+
+    def start(self, flight, job):
+        with self._lock:
+            flight.job = job
+            job.deadline = flight.deadline
+            priority = flight.priority
+            cancelled = not flight.waiters
+        job.future.add_done_callback(lambda future: self._finish(flight, future))
+        if cancelled:
+            job.future.cancel()
+        elif priority_rank(priority) < priority_rank(job.priority):
+            # Joined by a more preferred request between queueing and start()
+            self._promote(job, priority)
+
+    def fail(self, flight, error):
+        # The leader couldn't create or queue the job; waiters that already joined get its error
+        self._remove(flight)
+        if flight.future.set_running_or_notify_cancel():
+            flight.future.set_exception(error)
+
+    def release(self, flight):
+        """Drops one waiter, cancelling the job if it was the last and the job hasn't started."""
+        with self._lock:
+            if flight.future.done() or not flight.waiters:
+                return
+            flight.waiters -= 1
+            if flight.waiters:
+                return
+            # New requests start a fresh flight rather than join one being cancelled
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            job = flight.job
+        if job is not None:
+            job.future.cancel()
+
+    def share(self, flight, name):
+        """Returns (future, owner) for work every waiter derives from the result, such as encoding it.
+
+        The first caller for ``name`` owns the work and must resolve the future; the others wait on it.
+        """
+        with self._lock:
+            future = flight.shared.get(name)
+            if future is not None:
+                return future, False
+            future = flight.shared[name] = Future()
+            return future, True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "coalesce_led": self.led,
+                "coalesce_joined": self.joined,
+                "coalesce_inflight": len(self._flights),
+            }
+
+    def _promote(self, job, priority):
+        if self.promote is not None:
+            self.promote(job, priority)
+
+    def _finish(self, flight, future):
+        self._remove(flight)
+        if future.cancelled():
+            flight.future.cancel()
+        elif flight.future.set_running_or_notify_cancel():
+            error = future.exception()
+            if error is not None:
+                flight.future.set_exception(error)
+            else:
+                flight.future.set_result(future.result())
+
+    def _remove(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+
+def _later(a, b):
+    # Deadlines are monotonic() times; None means no deadline and wins
+    if a is None or b is None:
+        return None
+    return max(a, b)
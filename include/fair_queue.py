@@ -0,0 +1,173 @@
+import threading
+from itertools import count
+from time import monotonic
+
+try:
+    # When imported as include.fair_queue, e.g. by app.py
+    from .sampling import denoise_pixel_steps
+except ImportError:
+    # When imported from another module in the include directory
+    from sampling import denoise_pixel_steps
+
+# Scheduling classes, most preferred first: queued interactive jobs always run before batch ones,
+# so bulk work only soaks up capacity interactive traffic leaves idle
+PRIORITIES = ("interactive", "batch")
+
+# Request metadata naming the client and its scheduling class
+CLIENT_ID_KEY = "x-client-id"
+PRIORITY_KEY = "x-priority"
+# Trailing metadata set to "false" on RESOURCE_EXHAUSTED errors that retrying can't fix
+RETRYABLE_KEY = "x-retryable"
+
+# Cost of a 512x512, 50-step image in virtual time; other jobs scale by pixels and steps
+REFERENCE_COST = 512 * 512 * 50
+
+
+class LimitExceeded(Exception):
+    """Raised when a client is over its concurrency or rate limit."""
+
+
+def priority_rank(priority):
+    return PRIORITIES.index(priority)
+
+
+def client_identity(metadata, peer, default_priority="interactive"):
+    """Returns (client_id, priority) of a request; without an id, the peer's address identifies the client."""
+    values = dict(metadata or ())
+    priority = values.get(PRIORITY_KEY) or default_priority
+    if priority not in PRIORITIES:
+        raise ValueError(f"unknown priority {priority!r}, expected one of {', '.join(PRIORITIES)}")
+    return values.get(CLIENT_ID_KEY) or peer_host(peer), priority
+
+
+def peer_host(peer):
+    # "ipv4:10.0.0.5:53412" -> "ipv4:10.0.0.5"; the port changes with every connection
+    if not peer:
+        return "unknown"
+    host, _, port = peer.rpartition(":")
+    return host if host and port.isdigit() else peer
+
+
+def identity_metadata(context, default_priority=None):
+    # Metadata a proxy forwards, so workers see the original client rather than the proxy's address
+    values = dict(context.invocation_metadata() or ())
+    metadata = [(CLIENT_ID_KEY, values.get(CLIENT_ID_KEY) or peer_host(context.peer()))]
+    priority = values.get(PRIORITY_KEY) or default_priority
+    if priority:
+        metadata.append((PRIORITY_KEY, priority))
+    return metadata
+
+
+def parse_weights(spec):
+    # "app=4,nightly=1" -> {"app": 4.0, "nightly": 1.0}
+    weights = {}
+    for item in spec.split(","):
+        if item.strip():
+            client_id, _, weight = item.partition("=")
+            weights[client_id.strip()] = float(weight)
+    return weights
+
+
+def job_cost(job, direct=False):
+    # Relative GPU time of a job; img2img only denoises the last ``strength`` of the schedule.
+    # ``direct`` prices an upscale-mode job as if it were denoised at its output size instead.
+    refine_strength = None if direct else job.refine_strength
+    cost = denoise_pixel_steps(job.width, job.height, job.num_inference_steps or 50, refine_strength) / REFERENCE_COST
+    if job.task == "img2img" and job.strength:
+        cost *= job.strength
+    return cost
+
+
+class FairQueue:
+    """Weighted fair queueing order for jobs, with one virtual clock per priority class.
+
+    A job's finish tag is its client's previous finish tag (or the class
+    clock, if later) plus the job's cost over the client's weight. Serving
+    jobs in tag order gives every backlogged client a share of the GPU in
+    proportion to its weight, however many jobs it has queued, while a
+    client that was idle starts level with the clock rather than ahead of it.
+    Not thread-safe; BatchScheduler calls it under its lock.
+    """
+
+    def __init__(self, weights=None):
+        self.weights = weights or {}
+        self._clocks = [0.0] * len(PRIORITIES)
+        self._finish = [{} for _ in PRIORITIES]  # per class: client id -> finish tag of its last job
+        self._sequence = count()
+
+    def tag(self, job):
+        # Sets job.order, the sort key the scheduler serves jobs by
+        rank = priority_rank(job.priority)
+        start = max(self._clocks[rank], self._finish[rank].get(job.client_id, 0.0))
+        finish = start + job_cost(job) / self.weights.get(job.client_id, 1.0)
+        self._finish[rank][job.client_id] = finish
+        job.start_tag = start
+        job.order = (rank, finish, next(self._sequence))
+
+    def advance(self, jobs):
+        # Virtual time moves up to the start tags of the jobs entering service
+        for job in jobs:
+            rank = job.order[0]
+            self._clocks[rank] = max(self._clocks[rank], job.start_tag)
+        # Clients whose last job is behind the clock would start from the clock anyway
+        for clock, finish in zip(self._clocks, self._finish):
+            for client_id in [client_id for client_id, tag in finish.items() if tag <= clock]:
+                del finish[client_id]
+
+
+class ClientLimiter:
+    """Per-client caps on requests in flight and on request rate (a token bucket).
+
+    Over-limit requests are rejected before they queue, so a client sending a
+    burst can't take every handler thread or queue slot. A limit of 0 is off.
+    """
+
+    def __init__(self, max_inflight=0, rate=0.0, burst=10):
+        self.max_inflight = max_inflight
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._inflight = {}
+        self._buckets = {}  # client id -> (tokens, monotonic() of the last update)
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    def acquire(self, client_id):
+        """Counts a request against the client's limits; raises LimitExceeded if it is over one."""
+        with self._lock:
+            inflight = self._inflight.get(client_id, 0)
+            if self.max_inflight and inflight >= self.max_inflight:
+                self.throttled += 1
+                raise LimitExceeded(f"client {client_id} already has {inflight} requests in flight")
+            if self.rate:
+                now = monotonic()
+                tokens, updated = self._buckets.get(client_id, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - updated) * self.rate)
+                if tokens < 1:
+                    self.throttled += 1
+                    raise LimitExceeded(f"client {client_id} is over {self.rate:g} requests/s")
+                self._buckets[client_id] = (tokens - 1, now)
+                if len(self._buckets) > 4 * self.burst + 1024:
+                    self._prune(now)
+            self._inflight[client_id] = inflight + 1
+
+    def release(self, client_id):
+        with self._lock:
+            inflight = self._inflight.get(client_id, 0) - 1
+            if inflight > 0:
+                self._inflight[client_id] = inflight
+            else:
+                self._inflight.pop(client_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients_throttled": self.throttled,
+                "clients_inflight": len(self._inflight),
+            }
+
+    def _prune(self, now):
+        # Buckets that have refilled are the same as new ones
+        self._buckets = {
+            client_id: (tokens, updated) for client_id, (tokens, updated) in self._buckets.items()
+            if tokens + (now - updated) * self.rate < self.burst
+        }
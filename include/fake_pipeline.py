@@ -0,0 +1,57 @@
+import hashlib
+import time
+from types import SimpleNamespace
+
+from PIL import Image
+
+# Image size the per-image step cost is quoted at
+REFERENCE_PIXELS = 512 * 512
+
+
+class FakePipeline:
+    """CPU stand-in for StableDiffusionPipeline.
+
+    Accepts the same call signature the server uses and returns one
+    flat-colour image per prompt, so scheduling code can be exercised without
+    a GPU. Each inference step sleeps ``step_time`` seconds of fixed overhead
+    plus ``image_step_time`` per image at 512x512, scaled by pixel count, so
+    batching gains and resolution costs behave like a GPU's, deterministically.
+    """
+
+    def __init__(self, step_time=0.0, default_steps=50, image_step_time=0.0):
+        self.step_time = step_time
+        self.image_step_time = image_step_time
+        self.default_steps = default_steps
+        self.calls = []  # batch size of every call, in order
+
+    def __call__(self, prompt=None, height=512, width=512, num_inference_steps=None,
+                 negative_prompt=None, guidance_scale=7.5, callback_on_step_end=None, **kwargs):
+        if prompt is None:
+            # Called with precomputed embeddings; one image per embedding row
+            prompts = [str(i) for i in range(len(kwargs["prompt_embeds"]))]
+        else:
+            prompts = [prompt] if isinstance(prompt, str) else list(prompt)
+        steps = num_inference_steps or self.default_steps
+
+        # img2img calls carry no size; follow the init images like diffusers does
+        init_images = kwargs.get("image")
+        if init_images is not None:
+            width, height = init_images[0].size
+            # Like diffusers, img2img only runs the last ``strength`` of the schedule
+            steps = max(1, int(steps * kwargs.get("strength", 1.0)))
+
+        self.calls.append(len(prompts))
+        self.num_timesteps = steps
+        step_seconds = self.step_time + self.image_step_time * len(prompts) * width * height / REFERENCE_PIXELS
+        for step in range(steps):
+            if step_seconds:
+                time.sleep(step_seconds)
+            if callback_on_step_end is not None:
+                callback_on_step_end(self, step, steps - step, {"latents": None})
+        images = [Image.new("RGB", (width, height), _prompt_colour(p)) for p in prompts]
+        return SimpleNamespace(images=images)
+
+
+def _prompt_colour(prompt):
+    digest = hashlib.sha1(prompt.encode("utf-8")).digest()
+    return digest[0], digest[1], digest[2]
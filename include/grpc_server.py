@@ -1,144 +1,1137 @@
+import asyncio
 import grpc
 from concurrent import futures
 import base64
-import io
 import torch
 from PIL import Image
-from diffusers import StableDiffusionPipeline, StableDiffusionImg2ImgPipeline, AutoencoderKL
-import datetime
 import os
+import random
 import sys
+import hashlib
 import text2image_pb2
 import text2image_pb2_grpc
-import csv
-from time import time
+from grpc_health.v1 import health, health_pb2, health_pb2_grpc
+from batching import BatchScheduler, GenerationJob, JobExpired, gather
+from streaming import GenerationCancelled, ProgressStream
+from transport import collect_upload, collect_upload_async
+from result_cache import ResultCache, result_key
+from output_writer import OutputWriter
+from image_encoding import ImageEncoder, encode_image, extension, mime_type, parse_format, resolve_format
+from metrics import Metrics, RequestTrace, start_metrics_server
+from startup import ModelLoader
+from sampling import (
+    UPSCALE_SPACES, draft_size, normalize_size, resolve_mode, resolve_sampling, resolve_size, upscale_saves
+)
+from memory_planner import ExceedsMemoryBudget
+from backends import CpuBackend, CudaBackend, FakeBackend, resolve_backend
+from image_input import InitLatentCache, check_image, decode_image
+from coalescing import SingleFlight
+from fair_queue import (
+    RETRYABLE_KEY, ClientLimiter, FairQueue, LimitExceeded, client_identity, job_cost, parse_weights
+)
+from time import time, monotonic, perf_counter
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 MODEL_ID = "SG161222/Realistic_Vision_V5.1_noVAE"
+VAE_ID = "stabilityai/sd-vae-ft-mse"
+
+# Either Hub ids or local snapshot directories; LOCAL_FILES_ONLY=1 skips the Hub entirely
+MODEL_PATH = os.environ.get("MODEL_PATH", MODEL_ID)
+VAE_PATH = os.environ.get("VAE_PATH", VAE_ID)
+LOCAL_FILES_ONLY = os.environ.get("LOCAL_FILES_ONLY", "0") == "1"
 
-TORCH_DTYPE = torch.float16
+# Device and port are per process, so a router can run one worker per GPU
+DEVICE = os.environ.get("DEVICE", "cuda")
+GRPC_PORT = int(os.environ.get("GRPC_PORT", 50051))
+# "diffusers" loads the real model; "fake" serves FakePipeline images on CPU for testing
+PIPELINE = os.environ.get("PIPELINE", "diffusers")
+# Inference engine: "cuda" (fp16), "cpu", "fake", or "auto" to pick from PIPELINE, DEVICE and the hardware
+BACKEND = os.environ.get("BACKEND", "auto")
+# CPU backend weights ("auto", "fp32", "bf16" or "int8") and torch threads (0 keeps torch's default)
+CPU_PRECISION = os.environ.get("CPU_PRECISION", "auto")
+CPU_THREADS = int(os.environ.get("CPU_THREADS", 0))
+FAKE_STEP_TIME = float(os.environ.get("FAKE_STEP_TIME", 0.01))
+# Extra seconds per step for each 512x512 image in a fake batch, so batch size and resolution cost time
+FAKE_IMAGE_STEP_TIME = float(os.environ.get("FAKE_IMAGE_STEP_TIME", 0))
 negative_prompt = (
     "blurry, low quality, poorly drawn hands, text, watermark, distorted face, bad anatomy, low resolution"
 )
 
-# Path to performance CSV
-PERF_CSV_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "performance.csv")
-os.makedirs(os.path.dirname(PERF_CSV_PATH), exist_ok=True)
-
-# Initialize CSV with headers if it doesn't exist
-if not os.path.exists(PERF_CSV_PATH):
-    with open(PERF_CSV_PATH, mode='w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(["image_id", "width", "height", "time_taken_seconds", "saved_path"])
-
-print("Loading VAE...")
-vae = AutoencoderKL.from_pretrained(
-    "stabilityai/sd-vae-ft-mse",
-    torch_dtype=TORCH_DTYPE
-).to("cuda")
-
-print("Loading text-to-image pipeline...")
-pipe = StableDiffusionPipeline.from_pretrained(
-    MODEL_ID,
-    vae=vae,
-    torch_dtype=TORCH_DTYPE,
-    use_safetensors=True
-).to("cuda")
-
-pipe.enable_vae_slicing()
-pipe.enable_attention_slicing()
-pipe.safety_checker = None
+# Micro-batching window for concurrent text-to-image requests
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 4))
+BATCH_MAX_WAIT = float(os.environ.get("BATCH_MAX_WAIT", 0.05))
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", 16))
+
+# "sync" uses a thread pool, "aio" the grpc.aio event loop
+SERVER_MODE = os.environ.get("SERVER_MODE", "sync")
+SHUTDOWN_GRACE = float(os.environ.get("SHUTDOWN_GRACE", 10))
+
+# Requests are rejected with RESOURCE_EXHAUSTED once the estimated queue wait exceeds this
+MAX_QUEUE_WAIT = float(os.environ.get("MAX_QUEUE_WAIT", 60))
+
+# Clients are identified by x-client-id metadata, else their address, and pick a class with x-priority
+# ("interactive" or "batch"); queued interactive jobs run first, batch ones use the capacity left over
+DEFAULT_PRIORITY = os.environ.get("DEFAULT_PRIORITY", "interactive")
+# Per-client limits on requests in flight and requests per second (with bursts of CLIENT_BURST); 0 disables
+CLIENT_MAX_INFLIGHT = int(os.environ.get("CLIENT_MAX_INFLIGHT", 8))
+CLIENT_RATE = float(os.environ.get("CLIENT_RATE", 0))
+CLIENT_BURST = int(os.environ.get("CLIENT_BURST", 10))
+# Fair-queueing weights within a class, e.g. "app=4,nightly=1"; unlisted clients weigh 1
+CLIENT_WEIGHTS = parse_weights(os.environ.get("CLIENT_WEIGHTS", ""))
+
+# Largest img2img input accepted, in encoded bytes (any RPC) and in decoded pixels
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 32 * 1024 * 1024))
+MAX_INPUT_PIXELS = int(os.environ.get("MAX_INPUT_PIXELS", 50_000_000))
+
+# VAE-encoded img2img inputs kept per (input, size), so strength and seed sweeps skip decode and encode
+INIT_LATENT_CACHE_ENTRIES = int(os.environ.get("INIT_LATENT_CACHE_ENTRIES", 256))
+
+# Where upscale-mode drafts are enlarged before refinement: "pixel" (VAE round trip) or "latent"
+UPSCALE_SPACE = os.environ.get("UPSCALE_SPACE", "pixel")
+
+# Upper bound of num_images; more than BATCH_MAX_SIZE images are split across batches
+MAX_NUM_IMAGES = int(os.environ.get("MAX_NUM_IMAGES", 4))
+
+# Steps the fake pipeline runs when a call doesn't specify them
+DEFAULT_STEPS = 50
+
+# Result cache for seeded (deterministic) requests; the disk tier lives under images/
+IMAGES_DIR = os.path.join(os.path.dirname(__file__), "..", "images")
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_BYTES", 256 * 1024 * 1024))
+RESULT_CACHE_DISK = os.environ.get("RESULT_CACHE_DISK", "1") == "1"
+# Disk tier budget; least recently used files are removed past it. 0 leaves the disk tier unbounded
+RESULT_CACHE_DISK_BYTES = int(os.environ.get("RESULT_CACHE_DISK_BYTES", 2 * 1024 * 1024 * 1024))
+
+# Number of distinct prompts whose text-encoder outputs are kept
+PROMPT_CACHE_ENTRIES = int(os.environ.get("PROMPT_CACHE_ENTRIES", 512))
+
+# Image saves that may queue up before request threads block
+OUTPUT_QUEUE_SIZE = int(os.environ.get("OUTPUT_QUEUE_SIZE", 64))
+
+# Encoding of returned images when a request doesn't pick one, e.g. "png", "png:1", "jpeg:90" or "webp:85"
+OUTPUT_FORMAT = parse_format(os.environ.get("OUTPUT_FORMAT", "png"))
+# Encoding of the copies archived in images/; empty archives the bytes sent to the client
+ARCHIVE_FORMAT = os.environ.get("ARCHIVE_FORMAT", "")
+# Threads encoding response and archive images; PIL releases the GIL while encoding, so they run in parallel
+ENCODE_WORKERS = int(os.environ.get("ENCODE_WORKERS", min(4, os.cpu_count() or 1)))
+
+# Prometheus endpoint and Parquet rollups of per-request stage timings
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9090))
+METRICS_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "metrics")
+METRICS_ROLLUP_INTERVAL = float(os.environ.get("METRICS_ROLLUP_INTERVAL", 30))
+
+# Short generations run after loading, before the server reports SERVING; empty disables
+WARMUP_SIZES = [
+    tuple(int(side) for side in size.split("x"))
+    for size in os.environ.get("WARMUP_SIZES", "512x512").split(",") if size.strip()
+]
+WARMUP_STEPS = int(os.environ.get("WARMUP_STEPS", 2))
+
+# Health service names: "" is the server as a whole
+HEALTH_SERVICES = ("", "Text2Image")
+
+# GPU memory a batch may use; slicing, tiling and CPU offload are only enabled for batches that would exceed it.
+# 0 takes MEMORY_BUDGET_FRACTION of the device's total memory
+MEMORY_BUDGET_MB = int(os.environ.get("MEMORY_BUDGET_MB", 0))
+MEMORY_BUDGET_FRACTION = float(os.environ.get("MEMORY_BUDGET_FRACTION", 0.9))
+# What happens to requests too large for the budget: "downscale" or "reject"
+MEMORY_OVERFLOW = os.environ.get("MEMORY_OVERFLOW", "downscale")
+
+def make_backend(name=None, cpu_precision=None):
+    # The configured Backend, not loaded yet; arguments override BACKEND and CPU_PRECISION
+    name = resolve_backend(name or BACKEND, PIPELINE, DEVICE)
+    if name == "fake":
+        return FakeBackend(FAKE_STEP_TIME, DEFAULT_STEPS, FAKE_IMAGE_STEP_TIME, negative_prompt=negative_prompt)
+    options = dict(
+        negative_prompt=negative_prompt,
+        local_files_only=LOCAL_FILES_ONLY,
+        prompt_cache_entries=PROMPT_CACHE_ENTRIES
+    )
+    if name == "cpu":
+        precision = cpu_precision or CPU_PRECISION
+        return CpuBackend(MODEL_PATH, VAE_PATH, precision=precision, threads=CPU_THREADS, **options)
+    return CudaBackend(
+        MODEL_PATH,
+        VAE_PATH,
+        DEVICE,
+        memory_budget_mb=MEMORY_BUDGET_MB,
+        memory_budget_fraction=MEMORY_BUDGET_FRACTION,
+        memory_overflow=MEMORY_OVERFLOW,
+        **options
+    )
+
+def warm_up(run_batch):
+    # First calls at a shape pay for kernel selection and allocator growth; do that before traffic
+    for width, height in WARMUP_SIZES:
+        print(f"Warming up at {width}x{height}...")
+        job = GenerationJob("warm-up", width=width, height=height, num_inference_steps=WARMUP_STEPS)
+        run_batch(job.batch_key(), [job])
+
+def _init_latents(backend, jobs, latent_cache):
+    # Variations of one request share an init image and are encoded once
+    encoded = {}
+    for job in jobs:
+        if job.init_latents is None:
+            if job.init_key not in encoded:
+                encoded[job.init_key] = latent_cache.put(job.init_key, backend.encode_image(job.init_image))
+            job.init_latents = encoded[job.init_key]
+    # The img2img pipeline uses 4-channel inputs as init latents as they are
+    return torch.cat([job.init_latents for job in jobs])
+
+def make_batch_runner(backend, planner=None, latent_cache=None, upscale_space=UPSCALE_SPACE):
+    # Runs one batch of compatible jobs as a single pipeline call, or several if the memory planner splits it
+    if upscale_space not in UPSCALE_SPACES:
+        raise ValueError(f"unknown upscale space {upscale_space!r}, expected one of {', '.join(UPSCALE_SPACES)}")
+
+    def run_batch(key, jobs):
+        if planner is None:
+            return run_chunk(jobs)
+        first = jobs[0]
+        images = []
+        while len(images) < len(jobs):
+            size, plan = planner.split(first.width, first.height, len(jobs) - len(images))
+            backend.apply_plan(first.task, plan)
+            images.extend(run_chunk(jobs[len(images):len(images) + size]))
+        return images
+
+    def run_chunk(jobs):
+        first = jobs[0]
+        # Images of one request share a trace, so stages are recorded once per request
+        traces = []
+        dispatched = monotonic()
+        for job in jobs:
+            if job.trace is not None and job.trace not in traces:
+                traces.append(job.trace)
+                job.trace.batch_size = len(jobs)
+                job.trace.record("queue_wait", dispatched - job.enqueued_at)
+
+        start = perf_counter()
+        kwargs = backend.encode_prompt([job.prompt for job in jobs])
+        _record(traces, "text_encode", perf_counter() - start)
+        if first.num_inference_steps:
+            kwargs["num_inference_steps"] = first.num_inference_steps
+        if first.step_callback is not None:
+            kwargs["callback_on_step_end"] = first.step_callback
+        seeds = [job.seed for job in jobs]
+        if first.task == "img2img":
+            if latent_cache is not None:
+                start = perf_counter()
+                kwargs["image"] = _init_latents(backend, jobs, latent_cache)
+                _record(traces, "vae_encode", perf_counter() - start)
+            else:
+                kwargs["image"] = [job.init_image for job in jobs]
+            kwargs["strength"] = first.strength
+        else:
+            kwargs["height"] = first.height
+            kwargs["width"] = first.width
+        drafted = ""
+        if first.refine_strength is not None:
+            # Upscale mode: the first pass runs at the model's native resolution
+            kwargs["width"], kwargs["height"] = draft_size(first.width, first.height)
+            drafted = f", drafted at {kwargs['width']}x{kwargs['height']}"
+        print(
+            f"[{first.task}] Running batch of {len(jobs)} at {first.width}x{first.height}, "
+            f"{first.num_inference_steps} steps, {first.scheduler}{drafted}"
+        )
+
+        # Stop at latents so denoising and VAE decoding are timed separately
+        start = perf_counter()
+        latents = backend.denoise(first.task, first.scheduler, seeds, guidance_scale=first.guidance_scale, **kwargs)
+        _record(traces, "denoise", perf_counter() - start)
+
+        if first.refine_strength is not None:
+            start = perf_counter()
+            init_latents = backend.upscale(latents, first.width, first.height, upscale_space)
+            _record(traces, "upscale", perf_counter() - start)
+            # The refinement pass reuses the prompt embeddings and re-runs the end of the schedule at full size;
+            # streamed progress restarts with it
+            del kwargs["width"], kwargs["height"]
+            start = perf_counter()
+            latents = backend.denoise(
+                "img2img", first.scheduler, seeds,
+                guidance_scale=first.guidance_scale,
+                image=init_latents,
+                strength=first.refine_strength,
+                **kwargs
+            )
+            _record(traces, "refine", perf_counter() - start)
+
+        start = perf_counter()
+        images = backend.decode(latents)
+        _record(traces, "vae_decode", perf_counter() - start)
+        return images
+    return run_batch
+
+def _record(traces, stage, seconds):
+    for trace in traces:
+        trace.record(stage, seconds)
+
+class Overloaded(Exception):
+    """Raised when a request is shed because the GPU queue is too long."""
+
+class NotReady(Overloaded):
+    """Raised while models are still loading; handled wherever Overloaded is."""
+
+class PendingImages:
+    # A request's cache hits and submitted jobs, plus what is needed to turn them into a response
+    def __init__(self, trace, width, height, seeds, cache_keys, cached, futures, adjustment="", output_format=None):
+        self.trace = trace
+        # Response size; jobs may run smaller if the memory planner downscaled them
+        self.width = width
+        self.height = height
+        self.adjustment = adjustment
+        self.seeds = seeds
+        self.cache_keys = cache_keys
+        # Encoded bytes per image, None where a job was submitted instead
+        self.cached = cached
+        self.output_format = output_format
+        # Resolves to the generated images, None in the positions of cache hits
+        self.future = gather(futures)
+        # Every generated image came from another request's job
+        self.coalesced = False
+        # Image index -> the SingleFlight flight it was generated or waited on through
+        self.flights = {}
+
+class GeneratedImages:
+    def __init__(self, encoded, mime_type, seeds, width, height, adjustment=""):
+        self.encoded = encoded
+        self.mime_type = mime_type
+        self.seeds = seeds
+        self.width = width
+        self.height = height
+        self.adjustment = adjustment
 
 # gRPC Service Implementation
 class Text2ImageServicer(text2image_pb2_grpc.Text2ImageServicer):
-    def GenerateImage(self, request, context):
-        prompt = request.prompt
-        height = request.height or 512
-        width = request.width or 512
-
-        try:
-            print(f"[Text2Image] Prompt: {prompt}")
-            start_time = time()
-            image = pipe(
-                prompt, 
-                height=height, 
-                width=width,
-                negative_prompt=negative_prompt,
-                guidance_scale=7.5
-            ).images[0]
+    def __init__(self, scheduler, writer, metrics, cache=None, stats_sources=(), max_queue_wait=None, loader=None,
+                 planner=None, latent_cache=None, flights=None, limiter=None, model_id=MODEL_ID, encoder=None,
+                 output_format=OUTPUT_FORMAT, archive_format=None):
+        self.scheduler = scheduler
+        self.writer = writer
+        # Encodes on the calling thread without one
+        self.encoder = encoder
+        # Default response encoding, and the archive's when it differs from the response's
+        self.output_format = output_format
+        self.archive_format = archive_format
+        self.metrics = metrics
+        self.cache = cache
+        self.max_queue_wait = max_queue_wait
+        self.loader = loader
+        self.planner = planner
+        self.latent_cache = latent_cache
+        self.flights = flights
+        self.limiter = limiter
+        # Part of every result cache key, so engines that render a seed differently never share entries
+        self.model_id = model_id
+        # Anything with a stats() -> dict method, reported through GetStats
+        self.stats_sources = [
+            source for source in (writer, metrics, cache, loader, planner, latent_cache, flights, limiter, encoder,
+                           *stats_sources)
+            if source is not None
+        ]
 
-            return self._prepare_response(image, width, height, start_time)
+    def GetStats(self, request, context):
+        values = {}
+        for source in self.stats_sources:
+            values.update(source.stats())
+        return text2image_pb2.StatsResponse(values=values)
 
+    # v1 RPCs: base64 strings, kept for existing clients
+    def GenerateImage(self, request, context):
+        try:
+            return _legacy_response(self._text2image(request, context))
+        except _ABORTED as e:
+            _abort(context, e)
         except Exception as e:
             print(f"Error in text-to-image: {e}")
             return text2image_pb2.ImageResponse(image_base64="", status=f"error: {str(e)}")
 
     def GenerateImageFromImage(self, request, context):
         try:
-            init_image = Image.open(io.BytesIO(base64.b64decode(request.input_image_base64))).convert("RGB")
-            init_image = init_image.resize((request.width, request.height))
+            images = self._image2image(request, base64.b64decode(request.input_image_base64), context)
+            return _legacy_response(images)
+        except _ABORTED as e:
+            _abort(context, e)
+        except Exception as e:
+            print(f"Error in img2img: {e}")
+            return text2image_pb2.ImageResponse(image_base64="", status=f"error: {str(e)}")
+
+    # v2 RPCs: raw PNG bytes
+    def GenerateImageV2(self, request, context):
+        try:
+            return _image_response(self._text2image(request, context))
+        except _ABORTED as e:
+            _abort(context, e)
+        except Exception as e:
+            print(f"Error in text-to-image: {e}")
+            return text2image_pb2.ImageResponseV2(status=f"error: {str(e)}")
+
+    def GenerateImageFromImageV2(self, request, context):
+        try:
+            return _image_response(self._image2image(request, request.input_image, context))
+        except _ABORTED as e:
+            _abort(context, e)
+        except Exception as e:
+            print(f"Error in img2img: {e}")
+            return text2image_pb2.ImageResponseV2(status=f"error: {str(e)}")
+
+    def UploadImageFromImage(self, request_iterator, context):
+        try:
+            params, image_bytes = collect_upload(request_iterator, MAX_UPLOAD_BYTES)
+            return _image_response(self._image2image(params, image_bytes, context))
+        except _ABORTED as e:
+            _abort(context, e)
+        except Exception as e:
+            print(f"Error in img2img upload: {e}")
+            return text2image_pb2.ImageResponseV2(status=f"error: {str(e)}")
+
+    def GenerateImageStream(self, request, context):
+        start_time = time()
+        try:
+            sampling = _sampling(request)
+            _num_images(request)
+            _mode(request)
+            self._output_format(request)
+        except ValueError as e:
+            _abort(context, e)
+        stream = ProgressStream(sampling.steps)
+        try:
+            pending = self._submit_text2image(request, context, stream.callback, sampling)
+        except _ABORTED as e:
+            _abort(context, e)
 
-            print("[Img2Img] Converting base pipeline to img2img...")
-            torch.cuda.empty_cache()
-            img2img_pipe = StableDiffusionImg2ImgPipeline(**pipe.components).to("cuda")
-            img2img_pipe.to(torch_dtype=TORCH_DTYPE)
-            img2img_pipe.enable_attention_slicing()
-            img2img_pipe.safety_checker = None
+        # Client cancellation drops the jobs if queued and aborts the denoising loop if running;
+        # a full cache hit finishes the stream right away
+        pending.future.add_done_callback(lambda _: stream.finish())
+        self._on_done(context, stream.cancel)
 
-            full_prompt = request.prompt
-            strength = request.strength or 0.75
+        for update in stream:
+            yield _progress_update(*update)
 
-            print(f"[Img2Img] Prompt: {full_prompt} | Strength: {strength}")
-            start_time = time()
-            image = img2img_pipe(
-                prompt=full_prompt, 
-                image=init_image, 
+        if stream.cancelled:
+            print("[Text2Image] Stream cancelled by client")
+            return
+
+        try:
+            response = _image_response(self._complete(pending, pending.future.result()))
+        except GenerationCancelled:
+            return
+        except JobExpired as e:
+            _abort(context, e)
+        except Exception as e:
+            print(f"Error in streaming text-to-image: {e}")
+            response = text2image_pb2.ImageResponseV2(status=f"error: {str(e)}")
+
+        yield _final_update(stream.total_steps, start_time, response)
+
+    def _text2image(self, request, context):
+        pending = self._submit_text2image(request, context)
+        return self._complete(pending, pending.future.result())
+
+    def _image2image(self, request, image_bytes, context):
+        pending = self._submit_image2image(request, image_bytes, context)
+        return self._complete(pending, pending.future.result())
+
+    def _submit_text2image(self, request, context, step_callback=None, sampling=None):
+        # Returns PendingImages; cached images are reused, the rest queued as one group of jobs
+        prompt = request.prompt
+        (width, height), (job_width, job_height), adjustment = self._sizes(request)
+        sampling = sampling or _sampling(request)
+        mode, refine_strength = _mode(request)
+        output_format = self._output_format(request)
+        seeds, seeded = _seeds(request)
+        if mode == "upscale" and not upscale_saves(job_width, job_height, refine_strength):
+            mode, refine_strength = "direct", None
+            note = f"upscale mode saves nothing at {job_width}x{job_height}, ran directly"
+            adjustment = f"{adjustment}, {note}" if adjustment else note
+
+        print(f"[Text2Image] Prompt: {prompt} | Images: {len(seeds)} | Mode: {mode}")
+        trace = self._trace("txt2img", width, height, sampling, len(seeds), context)
+        trace.mode = mode
+        cache_keys = [
+            self._cache_key(
+                "txt2img", prompt, width, height, seed if seeded else None, sampling, refine_strength=refine_strength
+            )
+            for seed in seeds
+        ]
+
+        def make_jobs(seeds, deadline):
+            return [
+                GenerationJob(
+                    prompt,
+                    width=job_width,
+                    height=job_height,
+                    num_inference_steps=sampling.steps,
+                    guidance_scale=sampling.guidance_scale,
+                    scheduler=sampling.scheduler,
+                    seed=seed,
+                    step_callback=step_callback,
+                    trace=trace,
+                    deadline=deadline,
+                    priority=trace.priority,
+                    client_id=trace.client_id,
+                    refine_strength=refine_strength
+                )
+                for seed in seeds
+            ]
+        # Streams report progress from their own job, so they never share one
+        return self._submit(
+            trace, width, height, seeds, cache_keys, make_jobs, context, adjustment, output_format,
+            coalesce=step_callback is None
+        )
+
+    def _submit_image2image(self, request, image_bytes, context):
+        prompt = request.prompt
+        (width, height), (job_width, job_height), adjustment = self._sizes(request)
+        sampling = _sampling(request)
+        strength = request.strength or 0.75
+        output_format = self._output_format(request)
+        seeds, seeded = _seeds(request)
+        # Header only: oversized inputs fail before anything is decoded or queued
+        check_image(image_bytes, MAX_UPLOAD_BYTES, MAX_INPUT_PIXELS)
+
+        print(f"[Img2Img] Prompt: {prompt} | Strength: {strength} | Images: {len(seeds)}")
+        trace = self._trace("img2img", width, height, sampling, len(seeds), context)
+        # The input digest is taken from the raw upload, so hits skip image decoding too
+        input_digest = hashlib.sha256(image_bytes).hexdigest()
+        cache_keys = [
+            self._cache_key(
+                "img2img", prompt, width, height, seed if seeded else None, sampling,
                 strength=strength,
-                negative_prompt=negative_prompt
-            ).images[0]
+                input_digest=input_digest
+            )
+            for seed in seeds
+        ]
+
+        def make_jobs(seeds, deadline):
+            # Only decoded once admitted and when its latents aren't cached, and shared by all variations
+            init_key = (input_digest, job_width, job_height)
+            init_latents = self.latent_cache.get(init_key) if self.latent_cache is not None else None
+            init_image = None
+            if init_latents is None:
+                with trace.stage("input_decode"):
+                    init_image = decode_image(image_bytes, job_width, job_height)
+            return [
+                GenerationJob(
+                    prompt,
+                    width=job_width,
+                    height=job_height,
+                    num_inference_steps=sampling.steps,
+                    guidance_scale=sampling.guidance_scale,
+                    scheduler=sampling.scheduler,
+                    seed=seed,
+                    task="img2img",
+                    init_image=init_image,
+                    init_latents=init_latents,
+                    init_key=init_key,
+                    strength=strength,
+                    trace=trace,
+                    deadline=deadline,
+                    priority=trace.priority,
+                    client_id=trace.client_id
+                )
+                for seed in seeds
+            ]
+        return self._submit(trace, width, height, seeds, cache_keys, make_jobs, context, adjustment, output_format)
+
+    def _sizes(self, request):
+        # Returns the response size, the size the pipeline runs at, and how they differ from the request
+        requested = resolve_size(request.size, request.width, request.height)
+        width, height = normalize_size(*requested)
+        notes = []
+        if (width, height) != requested:
+            notes.append(f"{requested[0]}x{requested[1]} snapped to {width}x{height}")
+        job_width, job_height = width, height
+        if self.planner is not None:
+            job_width, job_height = self.planner.admit(width, height)
+            if (job_width, job_height) != (width, height):
+                notes.append(f"generated at {job_width}x{job_height} to fit GPU memory")
+        adjustment = ", ".join(notes)
+        if adjustment:
+            print(f"Size adjusted: {adjustment}")
+        return (width, height), (job_width, job_height), adjustment
 
-            return self._prepare_response(image, request.width, request.height, start_time)
+    def _submit(self, trace, width, height, seeds, cache_keys, make_jobs, context, adjustment="", output_format=None,
+                coalesce=True):
+        output_format = output_format or self.output_format
+        cached = [self._cache_get(cache_key, output_format) for cache_key in cache_keys]
+        futures = [None] * len(seeds)
+        missing = [i for i, data in enumerate(cached) if data is None]
+        coalesced = False
+        flights = {}
+        if missing:
+            coalesced = self._submit_missing(
+                seeds, cache_keys, missing, futures, flights, make_jobs, trace, context, coalesce
+            )
+        pending = PendingImages(trace, width, height, seeds, cache_keys, cached, futures, adjustment, output_format)
+        pending.coalesced = coalesced
+        pending.flights = flights
+        return pending
 
+    def _submit_missing(self, seeds, cache_keys, missing, futures, flights, make_jobs, trace, context, coalesce):
+        # Fills in futures, and flights where coalescing applies, for the missing images; returns True if
+        # all of them joined other requests' jobs
+        deadline = self._admit(trace, context)
+        # Seeded images another request is already generating are waited on rather than generated again
+        if self.flights is not None and coalesce:
+            for i in missing:
+                if cache_keys[i] is not None:
+                    flights[i], leader = self.flights.acquire(cache_keys[i], deadline, trace.priority)
+                    if not leader:
+                        futures[i] = flights[i].future
+        to_run = [i for i in missing if futures[i] is None]
+
+        try:
+            jobs = make_jobs([seeds[i] for i in to_run], deadline) if to_run else []
+            # Submitted together so the variations share one pipeline call
+            job_futures = self.scheduler.submit_many(jobs)
+            for job in jobs:
+                trace.gpu_cost += job_cost(job)
+                trace.direct_gpu_cost += job_cost(job, direct=True)
+        except Exception as e:
+            for i in to_run:
+                if i in flights:
+                    self.flights.fail(flights[i], e)
+            self._release(flights.values(), ())
+            raise
+        own = []
+        for i, job, future in zip(to_run, jobs, job_futures):
+            if i in flights:
+                self.flights.start(flights[i], job)
+                future = flights[i].future
+            else:
+                own.append(future)
+            futures[i] = future
+        # Release the queue slots if the client goes away before the batch runs; shared jobs only
+        # once every request waiting on them has gone
+        self._on_done(context, lambda: self._release(flights.values(), own))
+        return not to_run
+
+    def _release(self, flights, own):
+        for flight in flights:
+            self.flights.release(flight)
+        _cancel_all(own)
+
+    def _complete(self, pending, images):
+        output_format = pending.output_format
+        encoded = list(pending.cached)
+        generated = [index for index, data in enumerate(encoded) if data is None]
+        if generated:
+            # Requests sharing a flight encode, archive and cache its image once: the first to finish does
+            # the work, and the others in the same format wait for its bytes
+            owned, shared, waiting = [], {}, {}
+            for index in generated:
+                flight = pending.flights.get(index)
+                if flight is None:
+                    owned.append(index)
+                    continue
+                future, owner = self.flights.share(flight, ("encoded", output_format))
+                if owner:
+                    owned.append(index)
+                    shared[index] = future
+                else:
+                    waiting[index] = future
+            with pending.trace.stage("encode"):
+                try:
+                    resized = [self._resize(images[index], pending.width, pending.height, pending.trace)
+                               for index in owned]
+                    # Variations encode in parallel on the encoder pool
+                    encoded_images = self._encode_all(resized, output_format)
+                except BaseException as e:
+                    for future in shared.values():
+                        future.set_exception(e)
+                    raise
+                for index, data in zip(owned, encoded_images):
+                    if index in shared:
+                        shared[index].set_result(data)
+                for index, future in waiting.items():
+                    encoded[index] = future.result()
+            for index, image, data in zip(owned, resized, encoded_images):
+                flight = pending.flights.get(index)
+                if flight is None or self.flights.share(flight, "archive")[1]:
+                    suffix = f"_{index}" if len(images) > 1 else ""
+                    self._archive(image, data, output_format, pending.trace, suffix)
+                self._cache_put(pending.cache_keys[index], output_format, data)
+                encoded[index] = data
+        if not generated:
+            status = "cache_hit"
+        else:
+            status = "coalesced" if pending.coalesced else "success"
+        pending.trace.mark_ready(status)
+        return GeneratedImages(
+            encoded, mime_type(output_format), pending.seeds, pending.width, pending.height, pending.adjustment
+        )
+
+    def _admit(self, trace, context):
+        # Returns the job deadline, or raises Overloaded if the request should be shed
+        if self.loader is not None and not self.loader.ready:
+            trace.status = "not_ready"
+            raise NotReady(f"models are {self.loader.state}")
+
+        remaining = context.time_remaining()
+        deadline = monotonic() + remaining if remaining is not None else None
+        if self.max_queue_wait is not None:
+            # Batch jobs queue behind interactive ones, so only the queue at or above this class counts
+            wait = self.scheduler.estimated_wait(trace.priority)
+            if wait > self.max_queue_wait:
+                trace.status = "shed"
+                raise Overloaded(f"estimated queue wait {wait:.1f}s exceeds {self.max_queue_wait:.1f}s")
+            if remaining is not None and wait > remaining:
+                trace.status = "shed"
+                raise Overloaded(f"estimated queue wait {wait:.1f}s exceeds the request deadline")
+
+        if self.limiter is not None:
+            try:
+                self.limiter.acquire(trace.client_id)
+            except LimitExceeded as e:
+                trace.status = "throttled"
+                raise Overloaded(str(e))
+            self._on_done(context, lambda: self.limiter.release(trace.client_id))
+        return deadline
+
+    def _on_done(self, context, callback):
+        context.add_callback(callback)
+
+    def _trace(self, task, width, height, sampling, num_images, context):
+        trace = RequestTrace(task, width, height, sampling.steps)
+        trace.num_images = num_images
+        trace.client_id, trace.priority = client_identity(
+            context.invocation_metadata(), context.peer(), DEFAULT_PRIORITY
+        )
+        # Runs once the RPC has completed, after the response went out
+        self._on_done(context, lambda: self.metrics.finish(trace))
+        return trace
+
+    def _cache_key(self, task, prompt, width, height, seed, sampling, strength=None, input_digest=None,
+                   refine_strength=None):
+        # Only seeded requests are deterministic, so unseeded ones are never cached or coalesced
+        if seed is None:
+            return None
+        # Only upscale-mode keys name the mode, so direct-mode keys stay what they were
+        upscale = {}
+        if refine_strength is not None:
+            upscale = dict(mode="upscale", refine_strength=refine_strength, upscale_space=UPSCALE_SPACE)
+        return result_key(
+            model_id=self.model_id,
+            task=task,
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            width=width,
+            height=height,
+            seed=seed,
+            steps=sampling.steps,
+            scheduler=sampling.scheduler,
+            guidance_scale=sampling.guidance_scale,
+            strength=strength,
+            input_digest=input_digest,
+            **upscale
+        )
+
+    def _cache_get(self, cache_key, output_format):
+        if self.cache is None or cache_key is None:
+            return None
+        cache_key = _stored_key(cache_key, output_format)
+        cached = self.cache.get(cache_key, extension(output_format))
+        if cached is not None:
+            print(f"[Cache] Hit {cache_key[:12]}")
+        return cached
+
+    def _cache_put(self, cache_key, output_format, data):
+        if self.cache is not None and cache_key is not None:
+            self.cache.put(_stored_key(cache_key, output_format), data, extension(output_format))
+
+    def _output_format(self, request):
+        quality = request.quality if request.HasField("quality") else None
+        return resolve_format(request.output_format, quality, self.output_format)
+
+    def _resize(self, image, width, height, trace):
+        # Sizes are normalized up front, so only memory-planner downscales still need a resize
+        if image.size != (width, height):
+            with trace.stage("postprocess"):
+                image = image.resize((width, height), Image.BICUBIC)
+        return image
+
+    def _encode_all(self, images, output_format):
+        if self.encoder is None:
+            return [encode_image(image, output_format) for image in images]
+        return self.encoder.encode_all(images, output_format)
+
+    def _archive(self, image, data, output_format, trace, suffix=""):
+        # Disk writes happen on the writer thread; a separate archive format is encoded on the pool meanwhile
+        archive_format = self.archive_format or output_format
+        filename = os.path.join(IMAGES_DIR, f"generated_{trace.request_id}{suffix}{extension(archive_format)}")
+        if archive_format == output_format:
+            self.writer.save_image(filename, data)
+        elif self.encoder is None:
+            self.writer.save_image(filename, encode_image(image, archive_format))
+        else:
+            future = self.encoder.submit(image, archive_format)
+            future.add_done_callback(lambda f: self._save_archive(filename, f))
+
+    def _save_archive(self, filename, future):
+        try:
+            self.writer.save_image(filename, future.result())
+        except Exception as e:
+            print(f"Error encoding archive image {filename}: {e}")
+
+class AsyncText2ImageServicer(Text2ImageServicer):
+    """grpc.aio handlers over the same core.
+
+    Handlers await the GPU job future instead of blocking a thread; CPU work
+    (image decode, resize, waiting on the encoder pool) runs in the loop's default executor.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loop = asyncio.get_running_loop()
+
+    async def GetStats(self, request, context):
+        return super().GetStats(request, context)
+
+    async def GenerateImage(self, request, context):
+        try:
+            return _legacy_response(await self._text2image_async(request, context))
+        except _ABORTED as e:
+            await _abort_async(context, e)
+        except Exception as e:
+            print(f"Error in text-to-image: {e}")
+            return text2image_pb2.ImageResponse(image_base64="", status=f"error: {str(e)}")
+
+    async def GenerateImageFromImage(self, request, context):
+        try:
+            images = await self._image2image_async(
+                request, base64.b64decode(request.input_image_base64), context
+            )
+            return _legacy_response(images)
+        except _ABORTED as e:
+            await _abort_async(context, e)
         except Exception as e:
             print(f"Error in img2img: {e}")
             return text2image_pb2.ImageResponse(image_base64="", status=f"error: {str(e)}")
 
-    def _prepare_response(self, image, width, height, start_time):
-        # Resize to ensure output matches requested size
-        image = image.resize((width, height), Image.LANCZOS)
+    async def GenerateImageV2(self, request, context):
+        try:
+            return _image_response(await self._text2image_async(request, context))
+        except _ABORTED as e:
+            await _abort_async(context, e)
+        except Exception as e:
+            print(f"Error in text-to-image: {e}")
+            return text2image_pb2.ImageResponseV2(status=f"error: {str(e)}")
 
-        # Save image
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        image_id = f"generated_{timestamp}"
-        save_dir = os.path.join(os.path.dirname(__file__), "..", "images")
-        os.makedirs(save_dir, exist_ok=True)
-        filename = os.path.join(save_dir, f"{image_id}.png")
-        image.save(filename)
-        print(f"Image saved: {filename}")
+    async def GenerateImageFromImageV2(self, request, context):
+        try:
+            return _image_response(await self._image2image_async(request, request.input_image, context))
+        except _ABORTED as e:
+            await _abort_async(context, e)
+        except Exception as e:
+            print(f"Error in img2img: {e}")
+            return text2image_pb2.ImageResponseV2(status=f"error: {str(e)}")
 
-        # Convert image to base64
-        buffer = io.BytesIO()
-        image.save(buffer, format="PNG")
-        image_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    async def UploadImageFromImage(self, request_iterator, context):
+        try:
+            params, image_bytes = await collect_upload_async(request_iterator, MAX_UPLOAD_BYTES)
+            return _image_response(await self._image2image_async(params, image_bytes, context))
+        except _ABORTED as e:
+            await _abort_async(context, e)
+        except Exception as e:
+            print(f"Error in img2img upload: {e}")
+            return text2image_pb2.ImageResponseV2(status=f"error: {str(e)}")
+
+    async def GenerateImageStream(self, request, context):
+        start_time = time()
+        try:
+            sampling = _sampling(request)
+            _num_images(request)
+            _mode(request)
+            self._output_format(request)
+        except ValueError as e:
+            await _abort_async(context, e)
+        stream = ProgressStream(sampling.steps)
+        try:
+            # Admission, cache lookups (possibly on disk) and memory planning stay off the event loop
+            pending = await self.loop.run_in_executor(
+                None, self._submit_text2image, request, context, stream.callback, sampling
+            )
+        except _ABORTED as e:
+            await _abort_async(context, e)
 
-        # Log performance
-        time_taken = time() - start_time
-        self._log_performance(image_id, width, height, time_taken, filename)
+        pending.future.add_done_callback(lambda _: stream.finish())
+        self._on_done(context, stream.cancel)
 
-        return text2image_pb2.ImageResponse(image_base64=image_base64, status="success")
+        # ProgressStream blocks on a queue, so pull updates from an executor thread
+        updates = iter(stream)
+        while True:
+            update = await self.loop.run_in_executor(None, next, updates, None)
+            if update is None:
+                break
+            yield _progress_update(*update)
 
-    def _log_performance(self, image_id, width, height, time_taken, saved_path):
-        with open(PERF_CSV_PATH, mode='a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([image_id, width, height, f"{time_taken:.4f}", saved_path])
+        if stream.cancelled:
+            print("[Text2Image] Stream cancelled by client")
+            return
+
+        try:
+            images = await asyncio.wrap_future(pending.future)
+            response = _image_response(await self.loop.run_in_executor(None, self._complete, pending, images))
+        except GenerationCancelled:
+            return
+        except JobExpired as e:
+            await _abort_async(context, e)
+        except Exception as e:
+            print(f"Error in streaming text-to-image: {e}")
+            response = text2image_pb2.ImageResponseV2(status=f"error: {str(e)}")
+
+        yield _final_update(stream.total_steps, start_time, response)
+
+    async def _text2image_async(self, request, context):
+        pending = await self.loop.run_in_executor(None, self._submit_text2image, request, context)
+        images = await asyncio.wrap_future(pending.future)
+        return await self.loop.run_in_executor(None, self._complete, pending, images)
+
+    async def _image2image_async(self, request, image_bytes, context):
+        pending = await self.loop.run_in_executor(
+            None, self._submit_image2image, request, image_bytes, context
+        )
+        images = await asyncio.wrap_future(pending.future)
+        return await self.loop.run_in_executor(None, self._complete, pending, images)
+
+    def _on_done(self, context, callback):
+        # aio contexts belong to the event loop, while parts of the core run in executor threads
+        self.loop.call_soon_threadsafe(context.add_done_callback, lambda _: callback())
+
+# Errors that end an RPC with a status code; anything else is a server fault, reported in the response status.
+# Invalid requests raise ValueError.
+_STATUS_CODES = {
+    Overloaded: grpc.StatusCode.RESOURCE_EXHAUSTED,
+    JobExpired: grpc.StatusCode.DEADLINE_EXCEEDED,
+    NotReady: grpc.StatusCode.UNAVAILABLE,
+    ExceedsMemoryBudget: grpc.StatusCode.RESOURCE_EXHAUSTED,
+    ValueError: grpc.StatusCode.INVALID_ARGUMENT,
+}
+_ABORTED = tuple(_STATUS_CODES)
+
+def _status_code(error):
+    # The most specific registered class wins, e.g. NotReady over Overloaded
+    return next(_STATUS_CODES[cls] for cls in type(error).__mro__ if cls in _STATUS_CODES)
+
+def _trailing_metadata(error):
+    # A request over the memory budget fails the same way under any load
+    return ((RETRYABLE_KEY, "false"),) if isinstance(error, ExceedsMemoryBudget) else ()
+
+def _abort(context, error):
+    context.set_trailing_metadata(_trailing_metadata(error))
+    context.abort(_status_code(error), str(error))
+
+async def _abort_async(context, error):
+    await context.abort(_status_code(error), str(error), _trailing_metadata(error))
+
+def _num_images(request):
+    num_images = request.num_images or 1
+    if not 1 <= num_images <= MAX_NUM_IMAGES:
+        raise ValueError(f"num_images must be between 1 and {MAX_NUM_IMAGES}")
+    return num_images
+
+def _seeds(request):
+    # Returns (seeds, seeded): image i uses seed + i, so any variation can be regenerated alone.
+    # Unseeded requests get a random base seed, reported back but not used for caching.
+    num_images = _num_images(request)
+    if request.HasField("seed"):
+        return [request.seed + i for i in range(num_images)], True
+    base = random.randrange(2 ** 62)
+    return [base + i for i in range(num_images)], False
+
+def _cancel_all(futures):
+    for future in futures:
+        if future is not None:
+            future.cancel()
+
+def _sampling(request):
+    # Unset optional fields fall back to the profile's values
+    return resolve_sampling(
+        request.profile,
+        steps=request.num_inference_steps if request.HasField("num_inference_steps") else None,
+        scheduler=request.scheduler,
+        guidance_scale=request.guidance_scale if request.HasField("guidance_scale") else None
+    )
+
+def _stored_key(cache_key, output_format):
+    # PNG is lossless at every compression level, so all PNG requests share the generation's own key
+    if output_format.name == "png":
+        return cache_key
+    return result_key(generation=cache_key, output_format=output_format.name, quality=output_format.quality)
+
+def _mode(request):
+    return resolve_mode(request.mode, request.refine_strength if request.HasField("refine_strength") else None)
+
+def _image_response(result):
+    return text2image_pb2.ImageResponseV2(
+        image=result.encoded[0],
+        images=result.encoded if len(result.encoded) > 1 else [],
+        seeds=result.seeds,
+        width=result.width,
+        height=result.height,
+        size_adjustment=result.adjustment,
+        status="success",
+        mime_type=result.mime_type
+    )
+
+def _legacy_response(result):
+    images = [base64.b64encode(data).decode("utf-8") for data in result.encoded]
+    return text2image_pb2.ImageResponse(
+        image_base64=images[0],
+        images_base64=images if len(images) > 1 else [],
+        seeds=result.seeds,
+        width=result.width,
+        height=result.height,
+        size_adjustment=result.adjustment,
+        status="success"
+    )
+
+def _progress_update(step, total_steps, elapsed, preview_png):
+    return text2image_pb2.GenerationUpdate(
+        step=step,
+        total_steps=total_steps,
+        elapsed_seconds=elapsed,
+        preview_png=preview_png
+    )
+
+def _final_update(total_steps, start_time, response):
+    return text2image_pb2.GenerationUpdate(
+        step=total_steps,
+        total_steps=total_steps,
+        elapsed_seconds=time() - start_time,
+        result=response
+    )
+
+def build_servicer(servicer_class):
+    def load():
+        return make_batch_runner(backend.load(), planner, latent_cache)
+
+    # Needs only the device, so requests can be sized against it while models load
+    backend = make_backend()
+    planner = backend.make_planner()
+    # The fake pipeline has no VAE and takes init images as they are
+    latent_cache = InitLatentCache(INIT_LATENT_CACHE_ENTRIES) if backend.name != "fake" else None
+
+    # Nothing is queued before the loader is ready, so the runner can be looked up per batch
+    loader = ModelLoader(load, warmup=warm_up if WARMUP_SIZES else None)
+    scheduler = BatchScheduler(
+        lambda key, jobs: loader.value(key, jobs),
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait=BATCH_MAX_WAIT,
+        fair_queue=FairQueue(CLIENT_WEIGHTS)
+    ).start()
+
+    writer = OutputWriter(max_pending=OUTPUT_QUEUE_SIZE).start()
+    encoder = ImageEncoder(ENCODE_WORKERS).start()
+    metrics = Metrics(rollup_dir=METRICS_DIR, rollup_interval=METRICS_ROLLUP_INTERVAL).start()
+    metrics.register_gauges(scheduler)
+    start_metrics_server(metrics, METRICS_PORT)
+    cache = ResultCache(
+        RESULT_CACHE_BYTES,
+        disk_dir=os.path.join(IMAGES_DIR, "cache") if RESULT_CACHE_DISK else None,
+        max_disk_bytes=RESULT_CACHE_DISK_BYTES,
+        writer=writer
+    )
+
+    servicer = servicer_class(
+        scheduler,
+        writer,
+        metrics,
+        cache,
+        stats_sources=[scheduler, backend],
+        max_queue_wait=MAX_QUEUE_WAIT,
+        loader=loader,
+        planner=planner,
+        latent_cache=latent_cache,
+        flights=SingleFlight(promote=scheduler.promote),
+        limiter=ClientLimiter(CLIENT_MAX_INFLIGHT, CLIENT_RATE, CLIENT_BURST),
+        model_id=f"{MODEL_ID}@{backend.variant}" if backend.variant else MODEL_ID,
+        encoder=encoder,
+        output_format=OUTPUT_FORMAT,
+        archive_format=parse_format(ARCHIVE_FORMAT) if ARCHIVE_FORMAT else None
+    )
+    return servicer
+
+def shutdown_servicer(servicer):
+    # Flush queued work: remaining batches first, then archive encodes, their image saves and metrics
+    servicer.scheduler.close()
+    if servicer.encoder is not None:
+        servicer.encoder.close()
+    servicer.writer.close()
+    servicer.metrics.close()
+
+def _health_status(state):
+    if state == "ready":
+        return health_pb2.HealthCheckResponse.SERVING
+    return health_pb2.HealthCheckResponse.NOT_SERVING
 
 def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
-    text2image_pb2_grpc.add_Text2ImageServicer_to_server(Text2ImageServicer(), server)
-    server.add_insecure_port('[::]:50051')
-    print("gRPC server started on port 50051")
+    servicer = build_servicer(Text2ImageServicer)
+    health_servicer = health.HealthServicer()
+    for service in HEALTH_SERVICES:
+        health_servicer.set(service, _health_status("loading"))
+
+    # Enough handler threads to let concurrent requests meet in the batch queue
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=SERVER_WORKERS))
+    text2image_pb2_grpc.add_Text2ImageServicer_to_server(servicer, server)
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+    server.add_insecure_port(f'[::]:{GRPC_PORT}')
+    print(f"gRPC server started on port {GRPC_PORT} ({DEVICE}), loading models")
     server.start()
-    server.wait_for_termination()
+
+    def on_state(state):
+        for service in HEALTH_SERVICES:
+            health_servicer.set(service, _health_status(state))
+        if state == "failed":
+            # Exit so a supervisor (router, Docker, Kubernetes) restarts the process
+            server.stop(0)
+
+    # Port first, weights second: probes get NOT_SERVING instead of connection refused
+    servicer.loader.start(on_state)
+    try:
+        server.wait_for_termination()
+    finally:
+        health_servicer.enter_graceful_shutdown()
+        shutdown_servicer(servicer)
+    if servicer.loader.error is not None:
+        sys.exit(1)
+
+async def serve_async():
+    servicer = build_servicer(AsyncText2ImageServicer)
+    health_servicer = health.aio.HealthServicer()
+    for service in HEALTH_SERVICES:
+        await health_servicer.set(service, _health_status("loading"))
+
+    # Concurrency is bounded by admission control rather than a thread pool
+    server = grpc.aio.server()
+    text2image_pb2_grpc.add_Text2ImageServicer_to_server(servicer, server)
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+    server.add_insecure_port(f'[::]:{GRPC_PORT}')
+    print(f"gRPC aio server started on port {GRPC_PORT} ({DEVICE}), loading models")
+    await server.start()
+
+    loop = asyncio.get_running_loop()
+
+    def on_state(state):
+        # Called from the loader thread; the health servicer and server belong to the loop
+        for service in HEALTH_SERVICES:
+            asyncio.run_coroutine_threadsafe(health_servicer.set(service, _health_status(state)), loop)
+        if state == "failed":
+            asyncio.run_coroutine_threadsafe(server.stop(0), loop)
+
+    servicer.loader.start(on_state)
+    try:
+        await server.wait_for_termination()
+    finally:
+        await health_servicer.enter_graceful_shutdown()
+        await server.stop(SHUTDOWN_GRACE)
+        shutdown_servicer(servicer)
+    if servicer.loader.error is not None:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    serve()
\ No newline at end of file
+    if SERVER_MODE == "aio":
+        asyncio.run(serve_async())
+    else:
+        serve()
@@ -0,0 +1,52 @@
+import argparse
+import os
+import sys
+import time
+
+import grpc
+from grpc_health.v1 import health_pb2, health_pb2_grpc
+
+GRPC_SERVER_ADDRESS = os.environ.get("GRPC_SERVER_ADDRESS", "localhost:50051")
+
+
+def server_status(address=GRPC_SERVER_ADDRESS, timeout=2.0, channel=None):
+    """Returns the server's health status name, e.g. "SERVING", or None if it can't be reached.
+
+    Pass ``channel`` to reuse an open channel instead of connecting to ``address``.
+    """
+    if channel is None:
+        with grpc.insecure_channel(address) as channel:
+            return server_status(address, timeout, channel)
+    try:
+        # wait_for_ready lets a reused channel reconnect within the timeout instead of failing fast
+        response = health_pb2_grpc.HealthStub(channel).Check(
+            health_pb2.HealthCheckRequest(service=""), timeout=timeout, wait_for_ready=True
+        )
+    except grpc.RpcError:
+        return None
+    return health_pb2.HealthCheckResponse.ServingStatus.Name(response.status)
+
+
+def wait_until_serving(address=GRPC_SERVER_ADDRESS, timeout=600.0, interval=1.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        status = server_status(address)
+        if status == "SERVING" or time.monotonic() >= deadline:
+            return status
+        time.sleep(interval)
+
+
+def main():
+    # Exit code 0 once the server reports SERVING, for start scripts and container health checks
+    parser = argparse.ArgumentParser(description="Check the gRPC server's health status")
+    parser.add_argument("--address", default=GRPC_SERVER_ADDRESS)
+    parser.add_argument("--wait", type=float, default=0, help="seconds to wait for SERVING")
+    args = parser.parse_args()
+
+    status = wait_until_serving(args.address, args.wait) if args.wait else server_status(args.address)
+    print(f"{args.address}: {status or 'unreachable'}")
+    sys.exit(0 if status == "SERVING" else 1)
+
+
+if __name__ == "__main__":
+    main()
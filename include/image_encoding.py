@@ -0,0 +1,153 @@
+import io
+import threading
+from collections import namedtuple
+from concurrent import futures
+
+# name -> (PIL format, MIME type, file extension)
+FORMATS = {
+    "png": ("PNG", "image/png", ".png"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "webp": ("WEBP", "image/webp", ".webp"),
+}
+ALIASES = {"jpg": "jpeg"}
+
+# Per format: (lowest, highest, default) quality. PNG's is its zlib compression level, which trades
+# encode time for size and never changes the pixels; JPEG and WebP are lossy
+QUALITY_RANGES = {
+    "png": (0, 9, 6),
+    "jpeg": (1, 100, 90),
+    "webp": (1, 100, 85),
+}
+
+DEFAULT_WORKERS = 4
+
+OutputFormat = namedtuple("OutputFormat", ["name", "quality"])
+
+PNG = OutputFormat("png", QUALITY_RANGES["png"][2])
+
+
+def resolve_format(name="", quality=None, default=PNG):
+    """Returns the OutputFormat a request asks for; raises ValueError for bad values."""
+    if not name:
+        if quality is None:
+            return default
+        name = default.name
+    name = ALIASES.get(name.lower(), name.lower())
+    if name not in FORMATS:
+        raise ValueError(f"unknown output format {name!r}, expected one of {', '.join(FORMATS)}")
+    lowest, highest, default_quality = QUALITY_RANGES[name]
+    if quality is None:
+        return OutputFormat(name, default_quality)
+    if not lowest <= quality <= highest:
+        raise ValueError(f"{name} quality must be between {lowest} and {highest}")
+    return OutputFormat(name, quality)
+
+
+def parse_format(spec, default=PNG):
+    """Parses "webp", "jpeg:85" or "png:1" as used in settings; an empty spec gives ``default``."""
+    name, _, quality = spec.partition(":")
+    return resolve_format(name.strip(), int(quality) if quality.strip() else None, default)
+
+
+def negotiate_format(accept):
+    """Returns the format an HTTP Accept header prefers among the encodable ones, or "" if it names none."""
+    preferences = []
+    for position, item in enumerate(accept.split(",")):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        weight = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if weight > 0:
+            preferences.append((-weight, position, media_type.lower()))
+    # Highest q first, then the header's order; wildcards express no preference
+    by_type = {mime_type: name for name, (_, mime_type, _) in FORMATS.items()}
+    for _, _, media_type in sorted(preferences):
+        if media_type in by_type:
+            return by_type[media_type]
+    return ""
+
+
+def mime_type(output_format):
+    return FORMATS[output_format.name][1]
+
+
+def extension(output_format):
+    return FORMATS[output_format.name][2]
+
+
+def extension_for_mime(mime_type):
+    """File extension of images of ``mime_type`` as responses report it; PNG's if it is unknown or empty."""
+    for _, format_mime_type, format_extension in FORMATS.values():
+        if format_mime_type == mime_type:
+            return format_extension
+    return FORMATS["png"][2]
+
+
+def encode_image(image, output_format):
+    """Returns ``image`` encoded as ``output_format``."""
+    buffer = io.BytesIO()
+    if output_format.name == "png":
+        image.save(buffer, format="PNG", compress_level=output_format.quality)
+    else:
+        image.save(buffer, format=FORMATS[output_format.name][0], quality=output_format.quality)
+    return buffer.getvalue()
+
+
+class ImageEncoder:
+    """Encodes images on a pool of threads, off the RPC threads.
+
+    PIL's encoders release the GIL while compressing, so the variations of a
+    request, and concurrent requests, encode in parallel without pickling
+    images across processes.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._encoded = {}  # format name -> [images, bytes]
+
+    def start(self):
+        self._executor = futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="encoder")
+        return self
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def submit(self, image, output_format):
+        """Returns a Future of the encoded bytes."""
+        with self._lock:
+            self._pending += 1
+        return self._executor.submit(self._encode, image, output_format)
+
+    def encode_all(self, images, output_format):
+        # Encodes in parallel and waits; returns the bytes in order
+        return [future.result() for future in [self.submit(image, output_format) for image in images]]
+
+    def stats(self):
+        with self._lock:
+            values = {"encoder_pending": self._pending}
+            for name, (images, size) in self._encoded.items():
+                values[f"encoded_images_{name}"] = images
+                values[f"encoded_bytes_{name}"] = size
+            return values
+
+    def _encode(self, image, output_format):
+        try:
+            data = encode_image(image, output_format)
+        finally:
+            with self._lock:
+                self._pending -= 1
+        with self._lock:
+            counts = self._encoded.setdefault(output_format.name, [0, 0])
+            counts[0] += 1
+            counts[1] += len(data)
+        return data
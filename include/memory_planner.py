@@ -0,0 +1,169 @@
+import math
+from collections import namedtuple
+
+# Rough Stable Diffusion 1.5 figures. Activation sizes scale with dtype and were
+# sized so a 512x512 fp16 batch of 1 peaks around 3.5 GB; tune them against
+# torch.cuda.max_memory_allocated() if the model changes.
+UNET_PARAMS = 860e6
+TEXT_ENCODER_PARAMS = 123e6
+VAE_PARAMS = 84e6
+LATENT_SCALE = 8
+ATTENTION_HEADS = 8
+# UNet activations per latent pixel per sample (classifier-free guidance runs two samples per image)
+UNET_ELEMENTS_PER_LATENT_PIXEL = 24 * 1024
+# VAE decoder activations per output pixel per image
+VAE_ELEMENTS_PER_PIXEL = 2 * 1024
+# Tile edge diffusers' VAE tiling decodes at, in output pixels
+VAE_TILE_SIZE = 512
+# Fragmentation and allocator slack
+ALLOCATOR_OVERHEAD = 1.1
+
+DTYPE_BYTES = {"float16": 2, "bfloat16": 2, "float32": 4}
+
+# Cheapest first: each step trades speed for memory
+PLAN_STEPS = ("vae_slicing", "vae_tiling", "attention_slicing", "cpu_offload")
+
+ExecutionPlan = namedtuple(
+    "ExecutionPlan",
+    ["width", "height", "batch_size", "vae_slicing", "vae_tiling", "attention_slicing", "cpu_offload",
+     "estimated_bytes", "fits"]
+)
+
+
+class ExceedsMemoryBudget(Exception):
+    """Raised for requests that can't fit the memory budget even with every saving enabled."""
+
+
+def estimate_peak_bytes(width, height, batch_size, dtype="float16", vae_slicing=False, vae_tiling=False,
+                        attention_slicing=False, cpu_offload=False, sdpa=True):
+    """Estimated peak GPU memory of one pipeline call, in bytes.
+
+    ``sdpa`` means PyTorch's fused scaled_dot_product_attention is in use, which
+    never materialises the attention matrix; without it (or with attention
+    slicing, which replaces it) attention memory grows with the square of the
+    latent pixel count.
+    """
+    element = DTYPE_BYTES[dtype]
+    latent_pixels = (width // LATENT_SCALE) * (height // LATENT_SCALE)
+    samples = 2 * batch_size
+
+    # Model offload keeps only the component that is running on the GPU
+    if cpu_offload:
+        weights = max(UNET_PARAMS, TEXT_ENCODER_PARAMS, VAE_PARAMS) * element
+    else:
+        weights = (UNET_PARAMS + TEXT_ENCODER_PARAMS + VAE_PARAMS) * element
+
+    unet = samples * latent_pixels * UNET_ELEMENTS_PER_LATENT_PIXEL * element
+    if attention_slicing:
+        # One head at a time, and no fused kernel
+        unet += latent_pixels ** 2 * element * 3
+    elif not sdpa:
+        unet += samples * ATTENTION_HEADS * latent_pixels ** 2 * element * 3
+
+    decoded_images = 1 if vae_slicing else batch_size
+    decoded_pixels = width * height
+    vae_latent_pixels = latent_pixels
+    if vae_tiling:
+        decoded_pixels = min(decoded_pixels, VAE_TILE_SIZE ** 2)
+        vae_latent_pixels = decoded_pixels // LATENT_SCALE ** 2
+    vae = decoded_images * decoded_pixels * VAE_ELEMENTS_PER_PIXEL * element
+    if not sdpa:
+        # The VAE mid-block has a single-head self-attention over the latent
+        vae += decoded_images * vae_latent_pixels ** 2 * element * 3
+
+    # Denoising and decoding don't overlap
+    return int((weights + max(unet, vae)) * ALLOCATOR_OVERHEAD)
+
+
+def plan_execution(width, height, batch_size, budget_bytes, dtype="float16", sdpa=True):
+    """Returns the fastest ExecutionPlan whose estimate fits ``budget_bytes``.
+
+    Savings from PLAN_STEPS are switched on one at a time, cheapest first,
+    skipping any that don't lower the estimate (attention slicing under
+    SDPA, VAE tiling below the tile size). If even all of them don't fit,
+    the returned plan has ``fits=False``.
+    """
+    options = dict.fromkeys(PLAN_STEPS, False)
+    estimate = estimate_peak_bytes(width, height, batch_size, dtype=dtype, sdpa=sdpa, **options)
+    while estimate > budget_bytes:
+        # A step can start to matter once another one moved the peak, e.g. tiling after attention slicing
+        for step in PLAN_STEPS:
+            if options[step]:
+                continue
+            candidate = dict(options, **{step: True})
+            candidate_estimate = estimate_peak_bytes(width, height, batch_size, dtype=dtype, sdpa=sdpa, **candidate)
+            if candidate_estimate < estimate:
+                options, estimate = candidate, candidate_estimate
+                break
+        else:
+            break
+    return ExecutionPlan(
+        width, height, batch_size, estimated_bytes=estimate, fits=estimate <= budget_bytes, **options
+    )
+
+
+def fit_size(width, height, budget_bytes, dtype="float16", sdpa=True, multiple=64, min_side=256):
+    """Largest (width, height) with the same aspect ratio that fits the budget for a single image.
+
+    Returns None when even ``min_side`` doesn't fit.
+    """
+    scale = 1.0
+    while True:
+        fitted_width = max(multiple, int(width * scale) // multiple * multiple)
+        fitted_height = max(multiple, int(height * scale) // multiple * multiple)
+        if min(fitted_width, fitted_height) < min_side:
+            return None
+        if plan_execution(fitted_width, fitted_height, 1, budget_bytes, dtype, sdpa).fits:
+            return fitted_width, fitted_height
+        scale *= math.sqrt(0.8)
+
+
+class MemoryPlanner:
+    """Applies the estimator to requests (admission) and batches (execution).
+
+    ``overflow`` decides what happens to requests that can't fit at their
+    size: "downscale" generates them at the largest size that does, "reject"
+    raises ExceedsMemoryBudget.
+    """
+
+    def __init__(self, budget_bytes, dtype="float16", sdpa=True, overflow="downscale"):
+        if overflow not in ("downscale", "reject"):
+            raise ValueError(f"overflow must be 'downscale' or 'reject', got {overflow!r}")
+        self.budget_bytes = budget_bytes
+        self.dtype = dtype
+        self.sdpa = sdpa
+        self.overflow = overflow
+        self.downscaled = 0
+        self.rejected = 0
+
+    def admit(self, width, height):
+        """Returns the (width, height) to generate at; raises ExceedsMemoryBudget if nothing fits."""
+        if plan_execution(width, height, 1, self.budget_bytes, self.dtype, self.sdpa).fits:
+            return width, height
+        fitted = fit_size(width, height, self.budget_bytes, self.dtype, self.sdpa) if self.overflow == "downscale" else None
+        if fitted is None:
+            self.rejected += 1
+            raise ExceedsMemoryBudget(
+                f"{width}x{height} exceeds the GPU memory budget of {self.budget_bytes / 2 ** 30:.1f} GiB"
+            )
+        self.downscaled += 1
+        return fitted
+
+    def plan(self, width, height, batch_size):
+        return plan_execution(width, height, batch_size, self.budget_bytes, self.dtype, self.sdpa)
+
+    def split(self, width, height, batch_size):
+        """Largest batch size up to ``batch_size`` that fits, and its plan."""
+        for size in range(batch_size, 0, -1):
+            plan = self.plan(width, height, size)
+            if plan.fits:
+                return size, plan
+        # Admission let it in, so run it with every saving enabled rather than fail here
+        return 1, plan
+
+    def stats(self):
+        return {
+            "memory_budget_bytes": self.budget_bytes,
+            "memory_downscaled": self.downscaled,
+            "memory_rejected": self.rejected,
+        }
@@ -0,0 +1,272 @@
+import datetime
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+# Per-request stages, in the order they happen
+STAGES = (
+    "input_decode",
+    "queue_wait",
+    "text_encode",
+    "vae_encode",
+    "denoise",
+    "upscale",
+    "refine",
+    "vae_decode",
+    "postprocess",
+    "encode",
+    "transport",
+)
+
+# Histogram bucket upper bounds in seconds, spanning cache hits to slow 1024x1024 runs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0)
+
+DEFAULT_ROLLUP_INTERVAL = 30.0
+
+
+def new_request_id():
+    # Timestamp keeps ids sortable; the random suffix keeps them unique under concurrency
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{timestamp}_{uuid.uuid4().hex[:8]}"
+
+
+class RequestTrace:
+    """Timings and attributes of one request, filled in as it moves through the server."""
+
+    def __init__(self, task, width, height, steps):
+        self.request_id = new_request_id()
+        self.task = task
+        self.width = width
+        self.height = height
+        self.steps = steps
+        self.num_images = 1
+        self.batch_size = 1
+        # Text-to-image mode (see sampling.MODES), and the estimated GPU cost of the jobs this request ran
+        # (fair_queue.job_cost units) next to what they would have cost in direct mode
+        self.mode = "direct"
+        self.gpu_cost = 0.0
+        self.direct_gpu_cost = 0.0
+        # Scheduling class and client, see fair_queue
+        self.priority = "interactive"
+        self.client_id = ""
+        # Stays "incomplete" for errors and cancellations
+        self.status = "incomplete"
+        self.stages = {}
+        self.started = perf_counter()
+        self.ready_at = None
+
+    @contextmanager
+    def stage(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, perf_counter() - start)
+
+    def record(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def mark_ready(self, status="success"):
+        # Response is built; whatever follows until the RPC completes counts as transport
+        self.status = status
+        self.ready_at = perf_counter()
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Metrics:
+    """In-process histograms and counters, plus periodic columnar rollups.
+
+    Finished traces update histograms immediately and are buffered as rows;
+    a background thread writes the buffer to a Parquet part file under
+    ``rollup_dir`` every ``rollup_interval`` seconds and on ``close``.
+    """
+
+    def __init__(self, rollup_dir=None, rollup_interval=DEFAULT_ROLLUP_INTERVAL, buckets=DEFAULT_BUCKETS):
+        self.rollup_dir = rollup_dir
+        self.rollup_interval = rollup_interval
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._stage_histograms = {}  # (task, stage) -> Histogram
+        self._latency_histograms = {}  # (task, priority) -> Histogram
+        self._requests = {}  # (task, status) -> count
+        self._costs = {}  # (task, mode) -> [GPU cost, direct-mode GPU cost]
+        self._rows = []
+        self._gauge_sources = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.rollup_dir:
+            os.makedirs(self.rollup_dir, exist_ok=True)
+            self._thread = threading.Thread(target=self._rollup_loop, name="metrics-rollup", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def register_gauges(self, source):
+        # source.stats() values are exported as gauges, e.g. the batch queue depth
+        self._gauge_sources.append(source)
+
+    def finish(self, trace):
+        now = perf_counter()
+        if trace.ready_at is not None:
+            trace.record("transport", now - trace.ready_at)
+        total = now - trace.started
+
+        with self._lock:
+            key = (trace.task, trace.status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._histogram(self._latency_histograms, (trace.task, trace.priority)).observe(total)
+            if trace.gpu_cost:
+                costs = self._costs.setdefault((trace.task, trace.mode), [0.0, 0.0])
+                costs[0] += trace.gpu_cost
+                costs[1] += trace.direct_gpu_cost
+            for stage, seconds in trace.stages.items():
+                self._histogram(self._stage_histograms, (trace.task, stage)).observe(seconds)
+
+            row = {
+                "request_id": trace.request_id,
+                "finished_at": datetime.datetime.now(),
+                "task": trace.task,
+                "status": trace.status,
+                "priority": trace.priority,
+                "client_id": trace.client_id,
+                "mode": trace.mode,
+                "width": trace.width,
+                "height": trace.height,
+                "steps": trace.steps,
+                "num_images": trace.num_images,
+                "batch_size": trace.batch_size,
+                "gpu_cost": trace.gpu_cost,
+                "direct_gpu_cost": trace.direct_gpu_cost,
+                "total_seconds": total,
+            }
+            for stage in STAGES:
+                row[f"{stage}_seconds"] = trace.stages.get(stage)
+            if self.rollup_dir:
+                self._rows.append(row)
+
+    def stats(self):
+        with self._lock:
+            values = {}
+            for (task, status), count in self._requests.items():
+                values[f"requests_{task}_{status}"] = count
+            for (task, stage), histogram in self._stage_histograms.items():
+                values[f"stage_{task}_{stage}_mean_seconds"] = histogram.sum / histogram.count
+            for (task, mode), (cost, direct_cost) in self._costs.items():
+                values[f"gpu_cost_{task}_{mode}"] = cost
+                values[f"gpu_cost_direct_{task}_{mode}"] = direct_cost
+            return values
+
+    def render_prometheus(self):
+        """Renders counters and histograms in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            lines.append("# TYPE text2image_requests_total counter")
+            for (task, status), count in sorted(self._requests.items()):
+                lines.append(f'text2image_requests_total{{task="{task}",status="{status}"}} {count}')
+
+            # Upscale mode's savings are the gap between the two
+            lines.append("# TYPE text2image_gpu_cost_total counter")
+            for (task, mode), (cost, _) in sorted(self._costs.items()):
+                lines.append(f'text2image_gpu_cost_total{{task="{task}",mode="{mode}"}} {cost:.6f}')
+            lines.append("# TYPE text2image_gpu_cost_direct_total counter")
+            for (task, mode), (_, direct_cost) in sorted(self._costs.items()):
+                lines.append(f'text2image_gpu_cost_direct_total{{task="{task}",mode="{mode}"}} {direct_cost:.6f}')
+
+            lines.append("# TYPE text2image_request_seconds histogram")
+            for (task, priority), histogram in sorted(self._latency_histograms.items()):
+                labels = f'task="{task}",priority="{priority}"'
+                lines.extend(_histogram_lines("text2image_request_seconds", labels, histogram))
+
+            lines.append("# TYPE text2image_stage_seconds histogram")
+            for (task, stage), histogram in sorted(self._stage_histograms.items()):
+                lines.extend(_histogram_lines("text2image_stage_seconds", f'task="{task}",stage="{stage}"', histogram))
+
+        for source in self._gauge_sources:
+            for name, value in sorted(source.stats().items()):
+                lines.append(f"# TYPE text2image_{name} gauge")
+                lines.append(f"text2image_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+        if not rows:
+            return
+        try:
+            # pandas is only needed once there is something to write
+            import pandas as pd
+            path = os.path.join(self.rollup_dir, f"metrics-{new_request_id()}.parquet")
+            pd.DataFrame(rows).to_parquet(path, index=False)
+        except Exception as e:
+            print(f"Error writing metrics rollup: {e}")
+
+    def _histogram(self, histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def _rollup_loop(self):
+        while not self._stop.wait(self.rollup_interval):
+            self.flush()
+
+
+def _histogram_lines(name, labels, histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+    yield f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}'
+    yield f"{name}_sum{{{labels}}} {histogram.sum:.6f}"
+    yield f"{name}_count{{{labels}}} {histogram.count}"
+
+
+def start_metrics_server(metrics, port):
+    """Serves ``metrics.render_prometheus()`` at /metrics on a background thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes every few seconds would otherwise flood stdout
+            pass
+
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Metrics server started on port {port}")
+    return server
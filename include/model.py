@@ -1,18 +1,11 @@
-from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler
-import torch
+from diffusers import DPMSolverMultistepScheduler
 
-# Create pipeline with optimizations
-pipe = StableDiffusionPipeline.from_pretrained(
-    "SG161222/Realistic_Vision_V5.1_noVAE",
-    torch_dtype=torch.float16,
-    use_safetensors=True
-)
-
-# Move to GPU with potential memory optimization
-pipe = pipe.to("cuda")
+from grpc_server import make_backend
 
-# Enable memory-efficient attention
-pipe.enable_attention_slicing(slice_size="auto")
+# Create pipeline with optimizations, on the engine the server would pick: fp16 on CUDA, or the
+# CPU backend (BACKEND=cpu, CPU_PRECISION, CPU_THREADS) on machines without a GPU
+backend = make_backend().load()
+pipe = backend.pipeline("txt2img")
 
 # Fix scheduler configuration
 pipe.scheduler = DPMSolverMultistepScheduler.from_config(
@@ -21,14 +14,17 @@ pipe.scheduler = DPMSolverMultistepScheduler.from_config(
     final_sigmas_type="sigma_min"  # Use sigma_min instead of zero
 )
 
-# Optional: Enable memory efficient cross-attention (xformers)
-try:
-    import xformers
-    pipe.enable_xformers_memory_efficient_attention()
-    print("xformers optimization enabled")
-except (ImportError, AttributeError):
-    print("xformers not available, using standard attention")
+if backend.name == "cuda":
+    # Enable memory-efficient attention
+    pipe.enable_attention_slicing(slice_size="auto")
 
-# Optional: Enable VAE slicing for large images
-pipe.enable_vae_slicing()
+    # Optional: Enable memory efficient cross-attention (xformers)
+    try:
+        import xformers
+        pipe.enable_xformers_memory_efficient_attention()
+        print("xformers optimization enabled")
+    except (ImportError, AttributeError):
+        print("xformers not available, using standard attention")
 
+    # Optional: Enable VAE slicing for large images
+    pipe.enable_vae_slicing()
@@ -0,0 +1,72 @@
+import os
+import queue
+import threading
+
+DEFAULT_MAX_PENDING = 64
+
+
+class OutputWriter:
+    """Persists generated images off the request path.
+
+    Work is handed to a single background thread through a bounded queue;
+    when the queue is full, ``save_image`` blocks, so a slow disk slows
+    producers down instead of buffering without limit. ``close`` flushes
+    everything still queued.
+    """
+
+    _STOP = object()
+
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self.images_written = 0
+        self.errors = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="output-writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def save_image(self, path, data):
+        self.submit(self._write, path, data)
+
+    def submit(self, fn, *args):
+        # Other disk work, such as the result cache's disk tier, shares the thread and its backpressure
+        self._queue.put((fn, args))
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(self._STOP)
+        self._thread.join()
+        self._thread = None
+
+    def stats(self):
+        return {
+            "output_writer_pending": self._queue.qsize(),
+            "output_writer_images_written": self.images_written,
+            "output_writer_errors": self.errors,
+        }
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                return
+            fn, args = item
+            try:
+                fn(*args)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error in output writer task {fn.__name__}: {e}")
+
+    def _write(self, path, data):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+            self.images_written += 1
+            print(f"Image saved: {path}")
+        except OSError as e:
+            self.errors += 1
+            print(f"Error saving image {path}: {e}")
@@ -0,0 +1,49 @@
+import threading
+
+
+class PipelineRegistry:
+    """Builds one pipeline per task from a shared set of components.
+
+    Every pipeline is constructed with the same component objects (UNet, VAE,
+    text encoder, ...), so adding a task costs no extra weights. Factories are
+    any callable accepting the components as keyword arguments, e.g. a
+    diffusers pipeline class or a stub in tests.
+    """
+
+    def __init__(self, components, configure=None):
+        self.components = components
+        self.configure = configure
+        self._factories = {}
+        self._pipelines = {}
+        self._lock = threading.Lock()
+
+    def register(self, task, factory):
+        self._factories[task] = factory
+
+    def add(self, task, pipeline):
+        # Register an already constructed pipeline, e.g. the base txt2img one
+        self._pipelines[task] = pipeline
+
+    def tasks(self):
+        return sorted(set(self._factories) | set(self._pipelines))
+
+    def build_all(self):
+        for task in self.tasks():
+            self.get(task)
+        return self
+
+    def get(self, task):
+        pipeline = self._pipelines.get(task)
+        if pipeline is not None:
+            return pipeline
+
+        with self._lock:
+            if task not in self._pipelines:
+                if task not in self._factories:
+                    raise KeyError(f"Unknown pipeline task: {task}")
+                print(f"[Pipelines] Building {task} pipeline from shared components")
+                pipeline = self._factories[task](**self.components)
+                if self.configure is not None:
+                    self.configure(pipeline)
+                self._pipelines[task] = pipeline
+            return self._pipelines[task]
@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+
+import torch
+
+DEFAULT_MAX_ENTRIES = 512
+
+
+class PromptEmbeddingCache:
+    """LRU cache of CLIP text-encoder outputs keyed by token ids.
+
+    Prompts that tokenize identically (including ones that only differ past
+    the tokenizer's truncation length) share one entry. The negative prompt
+    is encoded once up front and never evicted.
+    """
+
+    def __init__(self, tokenizer, text_encoder, negative_prompt="", max_entries=DEFAULT_MAX_ENTRIES):
+        self.tokenizer = tokenizer
+        self.text_encoder = text_encoder
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_embeds = self._encode_ids(self._token_ids(negative_prompt))
+
+    def encode(self, prompts):
+        """Returns stacked embeddings for a list of prompts, encoding only cache misses."""
+        return torch.cat([self._lookup(prompt) for prompt in prompts])
+
+    def negative(self, batch_size):
+        return self.negative_embeds.expand(batch_size, -1, -1)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "prompt_cache_hits": self.hits,
+                "prompt_cache_misses": self.misses,
+                "prompt_cache_hit_rate": self.hits / lookups if lookups else 0.0,
+                "prompt_cache_entries": len(self._entries),
+            }
+
+    def _lookup(self, prompt):
+        key = self._token_ids(prompt)
+        with self._lock:
+            embeds = self._entries.get(key)
+            if embeds is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embeds
+            self.misses += 1
+
+        embeds = self._encode_ids(key)
+        with self._lock:
+            self._entries[key] = embeds
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return embeds
+
+    def _token_ids(self, prompt):
+        # Same padding and truncation as StableDiffusionPipeline.encode_prompt
+        input_ids = self.tokenizer(
+            prompt,
+            padding="max_length",
+            max_length=self.tokenizer.model_max_length,
+            truncation=True,
+            return_tensors="pt"
+        ).input_ids
+        return tuple(input_ids[0].tolist())
+
+    @torch.no_grad()
+    def _encode_ids(self, token_ids):
+        input_ids = torch.tensor([token_ids], device=self.text_encoder.device)
+        return self.text_encoder(input_ids)[0]
@@ -1,26 +1,321 @@
-from flask import Flask, request, jsonify
+import asyncio
+import base64
+import itertools
+import json
+import os
+from urllib.parse import parse_qs
+
 import grpc
 import text2image_pb2
 import text2image_pb2_grpc
+from fair_queue import CLIENT_ID_KEY, PRIORITIES, PRIORITY_KEY, RETRYABLE_KEY
+from image_encoding import negotiate_format
+from transport import image_chunks
+
+# ASGI gateway in front of the gRPC server. Run with:
+#   uvicorn rest_api:app --port 8000        (from the include directory)
+GRPC_SERVER_ADDRESS = os.environ.get("GRPC_SERVER_ADDRESS", "localhost:50051")
+GATEWAY_CHANNELS = int(os.environ.get("GATEWAY_CHANNELS", 4))
+# Deadline propagated to the gRPC call when the client doesn't send X-Timeout
+GATEWAY_TIMEOUT = float(os.environ.get("GATEWAY_TIMEOUT", 120))
+MAX_BODY_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 32 * 1024 * 1024))
+
+CHANNEL_OPTIONS = [
+    ("grpc.max_receive_message_length", 64 * 1024 * 1024),
+    ("grpc.max_send_message_length", 64 * 1024 * 1024),
+]
+
+# gRPC status -> HTTP status
+HTTP_STATUS = {
+    grpc.StatusCode.INVALID_ARGUMENT: 400,
+    grpc.StatusCode.NOT_FOUND: 404,
+    grpc.StatusCode.RESOURCE_EXHAUSTED: 429,
+    grpc.StatusCode.CANCELLED: 499,
+    grpc.StatusCode.UNIMPLEMENTED: 501,
+    grpc.StatusCode.UNAVAILABLE: 503,
+    grpc.StatusCode.DEADLINE_EXCEEDED: 504,
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ChannelPool:
+    """Round-robin pool of grpc.aio channels, so one HTTP/2 connection isn't a bottleneck."""
+
+    def __init__(self, target, size):
+        self.channels = [grpc.aio.insecure_channel(target, options=CHANNEL_OPTIONS) for _ in range(size)]
+        self.stubs = [text2image_pb2_grpc.Text2ImageStub(channel) for channel in self.channels]
+        self._next = itertools.count()
+
+    def stub(self):
+        return self.stubs[next(self._next) % len(self.stubs)]
+
+    async def close(self):
+        await asyncio.gather(*(channel.close() for channel in self.channels))
+
+
+pool = None
+
+
+def get_pool():
+    # Channels must be created inside the running event loop
+    global pool
+    if pool is None:
+        pool = ChannelPool(GRPC_SERVER_ADDRESS, GATEWAY_CHANNELS)
+    return pool
+
+
+def sampling_options(params, accept=""):
+    # Optional request fields shared by all generation routes: seed, sampling profile/overrides, size preset,
+    # and the image encoding, from an explicit output_format or else the Accept header
+    options = {
+        "profile": params.get("profile", ""),
+        "scheduler": params.get("scheduler", ""),
+        "size": params.get("size", ""),
+        "num_images": int(params.get("num_images", 1)),
+        "output_format": params.get("output_format") or negotiate_format(accept),
+    }
+    if params.get("seed") is not None:
+        options["seed"] = int(params["seed"])
+    if params.get("num_inference_steps") is not None:
+        options["num_inference_steps"] = int(params["num_inference_steps"])
+    if params.get("guidance_scale") is not None:
+        options["guidance_scale"] = float(params["guidance_scale"])
+    if params.get("quality") is not None:
+        options["quality"] = int(params["quality"])
+    return options
+
+
+def text_request(params, accept=""):
+    options = sampling_options(params, accept)
+    # Text-to-image only: "upscale" drafts at native resolution and refines at the requested size
+    options["mode"] = params.get("mode", "")
+    if params.get("refine_strength") is not None:
+        options["refine_strength"] = float(params["refine_strength"])
+    return text2image_pb2.TextRequest(
+        prompt=params.get("prompt", ""),
+        width=int(params.get("width", 0)),
+        height=int(params.get("height", 0)),
+        **options
+    )
+
+
+def parse_json_request(params, accept=""):
+    # JSON fields of the wrong type, e.g. {"width": null} or {"seed": {}}, are the client's error
+    try:
+        return text_request(params, accept)
+    except TypeError as e:
+        raise HTTPError(400, f"invalid request field: {e}")
+
+
+async def generate_image(request):
+    grpc_request = parse_json_request(await request.json(), request.headers.get("accept", ""))
+    response = await get_pool().stub().GenerateImageV2(
+        grpc_request, timeout=request.timeout(), metadata=request.metadata()
+    )
+    await request.send_image(response)
+
+
+async def generate_image_from_image(request):
+    # Raw image body; parameters come from the query string
+    params = request.query
+    image_bytes = await request.body()
+    if not image_bytes:
+        raise HTTPError(400, "request body must contain the input image")
+
+    chunks = image_chunks(
+        params.get("prompt", ""),
+        image_bytes,
+        int(params.get("width", 0)),
+        int(params.get("height", 0)),
+        float(params.get("strength", 0.75)),
+        **sampling_options(params, request.headers.get("accept", ""))
+    )
+    response = await get_pool().stub().UploadImageFromImage(
+        chunks, timeout=request.timeout(), metadata=request.metadata()
+    )
+    await request.send_image(response)
+
+
+async def generate_image_stream(request):
+    # Newline-delimited JSON: progress lines, then one line with the final image
+    grpc_request = parse_json_request(await request.json())
+
+    call = get_pool().stub().GenerateImageStream(
+        grpc_request, timeout=request.timeout(), metadata=request.metadata()
+    )
+    started = False
+    try:
+        async for update in call:
+            if not started:
+                await request.start(200, "application/x-ndjson")
+                started = True
+            if update.HasField("result"):
+                line = dict(image_json(update.result), elapsed_seconds=update.elapsed_seconds)
+            else:
+                line = {
+                    "step": update.step,
+                    "total_steps": update.total_steps,
+                    "elapsed_seconds": update.elapsed_seconds,
+                }
+            await request.write(json.dumps(line).encode("utf-8") + b"\n")
+    except grpc.aio.AioRpcError as e:
+        if not started:
+            raise
+        # Headers are already out; report the failure in-band
+        line = {"status": f"error: {e.code().name}: {e.details()}"}
+        await request.write(json.dumps(line).encode("utf-8") + b"\n")
+    finally:
+        # Stops the GPU work if the HTTP client went away mid-stream
+        call.cancel()
+
+    if not started:
+        await request.start(200, "application/x-ndjson")
+    await request.write(b"", more_body=False)
+
+
+async def health(request):
+    await request.send_json(200, {"status": "ok"})
+
+
+ROUTES = {
+    ("POST", "/generate-image"): generate_image,
+    ("POST", "/generate-image-from-image"): generate_image_from_image,
+    ("POST", "/generate-image-stream"): generate_image_stream,
+    ("GET", "/healthz"): health,
+}
+
+
+def image_json(response):
+    body = {
+        "status": response.status,
+        "image_base64": base64.b64encode(response.image).decode("utf-8"),
+        "seeds": list(response.seeds),
+        "width": response.width,
+        "height": response.height,
+        "mime_type": response.mime_type,
+    }
+    if response.size_adjustment:
+        body["size_adjustment"] = response.size_adjustment
+    if len(response.images) > 1:
+        body["images_base64"] = [base64.b64encode(image).decode("utf-8") for image in response.images]
+    return body
+
+
+class Request:
+    """Minimal request/response helper over the raw ASGI interface."""
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self._receive = receive
+        self._send = send
+        self.headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+        self.query = {key: values[-1] for key, values in parse_qs(scope["query_string"].decode("latin-1")).items()}
+
+    def timeout(self):
+        value = self.headers.get("x-timeout")
+        return float(value) if value else GATEWAY_TIMEOUT
+
+    def metadata(self):
+        # X-Client-Id and X-Priority pass through; otherwise the server would see every HTTP client
+        # as the gateway itself and queue and limit them as one
+        client = self.scope.get("client")
+        metadata = [(CLIENT_ID_KEY, self.headers.get("x-client-id") or (client[0] if client else "http"))]
+        priority = self.headers.get("x-priority")
+        if priority:
+            if priority not in PRIORITIES:
+                raise HTTPError(400, f"X-Priority must be one of {', '.join(PRIORITIES)}")
+            metadata.append((PRIORITY_KEY, priority))
+        return metadata
+
+    async def body(self):
+        chunks = []
+        size = 0
+        while True:
+            message = await self._receive()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > MAX_BODY_BYTES:
+                raise HTTPError(413, f"request body exceeds {MAX_BODY_BYTES} bytes")
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    async def json(self):
+        try:
+            params = json.loads(await self.body() or b"{}")
+        except ValueError:
+            raise HTTPError(400, "request body must be JSON")
+        if not isinstance(params, dict):
+            raise HTTPError(400, "request body must be a JSON object")
+        return params
+
+    async def start(self, status, content_type, extra_headers=()):
+        headers = [(b"content-type", content_type.encode("latin-1"))]
+        headers.extend(extra_headers)
+        await self._send({"type": "http.response.start", "status": status, "headers": headers})
+
+    async def write(self, data, more_body=True):
+        await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+    async def send_json(self, status, payload, extra_headers=()):
+        await self.start(status, "application/json", extra_headers)
+        await self.write(json.dumps(payload).encode("utf-8"), more_body=False)
 
-app = Flask(__name__)
+    async def send_image(self, response):
+        # Invalid requests arrive as gRPC errors, so an error status here is a server fault
+        if response.status != "success":
+            await self.send_json(500, {"status": response.status})
+        elif len(response.images) > 1 or "application/json" in self.headers.get("accept", ""):
+            # Base64 JSON only for clients that ask for it, or when there is more than one image
+            await self.send_json(200, image_json(response))
+        else:
+            headers = []
+            if response.size_adjustment:
+                headers.append((b"x-size-adjustment", response.size_adjustment.encode("latin-1")))
+            await self.start(200, response.mime_type or "image/png", headers)
+            await self.write(response.image, more_body=False)
 
-# Connect to gRPC server
-channel = grpc.insecure_channel('localhost:50051')
-stub = text2image_pb2_grpc.Text2ImageStub(channel)
 
-@app.route('/generate-image', methods=['POST'])
-def generate_image():
-    data = request.get_json()
-    prompt = data.get('prompt', '')
+async def app(scope, receive, send):
+    global pool
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                get_pool()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if pool is not None:
+                    await pool.close()
+                    pool = None
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
 
-    grpc_request = text2image_pb2.TextRequest(prompt=prompt)
-    grpc_response = stub.GenerateImage(grpc_request)
+    request = Request(scope, receive, send)
+    handler = ROUTES.get((scope["method"], scope["path"]))
+    try:
+        if handler is None:
+            raise HTTPError(404, f"no route for {scope['method']} {scope['path']}")
+        await handler(request)
+    except HTTPError as e:
+        await request.send_json(e.status, {"status": f"error: {e}"})
+    except grpc.aio.AioRpcError as e:
+        status = HTTP_STATUS.get(e.code(), 502)
+        # Load shedding: ask well-behaved clients to back off, unless retrying can't help
+        retryable = (RETRYABLE_KEY, "false") not in tuple(e.trailing_metadata() or ())
+        extra = [(b"retry-after", b"5")] if status == 429 and retryable else []
+        await request.send_json(status, {"status": f"error: {e.code().name}: {e.details()}"}, extra)
+    except ValueError as e:
+        await request.send_json(400, {"status": f"error: {e}"})
 
-    return jsonify({
-        'status': grpc_response.status,
-        'image_base64': grpc_response.image_base64
-    })
 
 if __name__ == '__main__':
-    app.run(debug=True, port=8000)
+    import uvicorn
+    uvicorn.run(app, port=8000)
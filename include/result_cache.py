@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Once the disk tier exceeds its budget, the least recently used files are removed down to this share of it
+DISK_PRUNE_FRACTION = 0.9
+
+
+def result_key(**fields):
+    """Content-addressed key for a deterministic generation.
+
+    Fields are serialized in sorted order, so callers only have to pass every
+    input that influences the output image (model, prompts, size, seed, ...).
+    """
+    payload = json.dumps(fields, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Two-tier cache of encoded images keyed by ``result_key``.
+
+    The memory tier is an LRU bounded by total bytes; the optional disk tier
+    keeps one file per key under ``disk_dir`` and is promoted into memory on
+    a hit. Files are named ``<key><suffix>``; callers caching several
+    formats pass each entry's own suffix. The disk tier is bounded by
+    ``max_disk_bytes`` (0 for no limit), evicting by file modification time,
+    which reads refresh. With a ``writer`` (an ``OutputWriter``), disk writes
+    and pruning run on its background thread instead of the caller's.
+    """
+
+    def __init__(self, max_bytes, disk_dir=None, suffix=".png", max_disk_bytes=0, writer=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.writer = writer
+        self.suffix = suffix
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_evictions = 0
+        # Disk usage is tracked incrementally and re-measured whenever the tier is pruned
+        self._disk_bytes = 0
+        self._disk_lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            with self._disk_lock:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+                if self.max_disk_bytes and self._disk_bytes > self.max_disk_bytes:
+                    self._prune_disk()
+
+    def get(self, key, suffix=None):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return data
+
+        data = self._read_disk(key, suffix)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, data)
+        return data
+
+    def put(self, key, data, suffix=None):
+        with self._lock:
+            self._remember(key, data)
+        if not self.disk_dir:
+            return
+        if self.writer is None:
+            self._write_disk(key, data, suffix)
+        else:
+            self.writer.submit(self._write_disk, key, data, suffix)
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "result_cache_memory_hits": self.memory_hits,
+                "result_cache_disk_hits": self.disk_hits,
+                "result_cache_misses": self.misses,
+                "result_cache_hit_rate": hits / lookups if lookups else 0.0,
+                "result_cache_entries": len(self._entries),
+                "result_cache_bytes": self._bytes,
+                "result_cache_disk_bytes": self._disk_bytes,
+                "result_cache_disk_evictions": self.disk_evictions,
+            }
+
+    def _remember(self, key, data):
+        # Caller holds the lock; items larger than the whole budget stay on disk only
+        if len(data) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous)
+        self._entries[key] = data
+        self._bytes += len(data)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def _path(self, key, suffix=None):
+        return os.path.join(self.disk_dir, f"{key}{suffix or self.suffix}")
+
+    def _read_disk(self, key, suffix=None):
+        if not self.disk_dir:
+            return None
+        path = self._path(key, suffix)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # Mark the file as recently used; it may have been pruned in the meantime
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _write_disk(self, key, data, suffix=None):
+        if not self.disk_dir:
+            return
+        path = self._path(key, suffix)
+        if os.path.exists(path):
+            return
+        # Write then rename so readers never see a partial file
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._disk_lock:
+            self._disk_bytes += len(data)
+            if self.max_disk_bytes and self._disk_bytes > self.max_disk_bytes:
+                self._prune_disk()
+
+    def _disk_files(self):
+        # (mtime, size, path) of every finished file; temporary files of writes in progress are skipped
+        files = []
+        with os.scandir(self.disk_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _prune_disk(self):
+        # Caller holds the disk lock; removes the least recently used files down to DISK_PRUNE_FRACTION
+        # of the budget, so a full tier isn't rescanned on every write
+        files = sorted(self._disk_files())
+        self._disk_bytes = sum(size for _, size, _ in files)
+        target = self.max_disk_bytes * DISK_PRUNE_FRACTION
+        for _, size, path in files:
+            if self._disk_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._disk_bytes -= size
+            self.disk_evictions += 1
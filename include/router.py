@@ -0,0 +1,383 @@
+import os
+import subprocess
+import sys
+import threading
+from concurrent import futures
+from time import monotonic
+
+import grpc
+import text2image_pb2
+import text2image_pb2_grpc
+from grpc_health.v1 import health, health_pb2, health_pb2_grpc
+from fair_queue import PRIORITY_KEY, identity_metadata
+from sampling import DEFAULT_PROFILE, PROFILES, denoise_pixel_steps, resolve_mode, resolve_sampling, resolve_size
+
+# One worker process per entry, e.g. "cuda:0,cuda:1" or "cpu,cpu" with PIPELINE=fake
+WORKER_DEVICES = [d.strip() for d in os.environ.get("WORKER_DEVICES", "cuda:0").split(",") if d.strip()]
+WORKER_BASE_PORT = int(os.environ.get("WORKER_BASE_PORT", 50061))
+WORKER_METRICS_BASE_PORT = int(os.environ.get("WORKER_METRICS_BASE_PORT", 9091))
+ROUTER_PORT = int(os.environ.get("ROUTER_PORT", 50051))
+ROUTER_WORKERS = int(os.environ.get("ROUTER_WORKERS", 64))
+
+# Health checking and restart policy
+HEALTH_INTERVAL = float(os.environ.get("HEALTH_INTERVAL", 5))
+HEALTH_TIMEOUT = float(os.environ.get("HEALTH_TIMEOUT", 2))
+HEALTH_FAILURES = int(os.environ.get("HEALTH_FAILURES", 3))
+RESTART_BACKOFF = float(os.environ.get("RESTART_BACKOFF", 5))
+# Workers on "cpu" run the CPU backend: their outstanding cost counts CPU_COST_FACTOR times over, and
+# while a GPU worker is healthy they only take batch-priority or draft-profile requests
+CPU_COST_FACTOR = float(os.environ.get("CPU_COST_FACTOR", 20))
+# Same default as the workers, for requests without x-priority metadata
+DEFAULT_PRIORITY = os.environ.get("DEFAULT_PRIORITY", "interactive")
+# Seconds a worker may report NOT_SERVING (loading weights, warming up) before it is restarted
+WORKER_START_TIMEOUT = float(os.environ.get("WORKER_START_TIMEOUT", 900))
+# Same limit as the workers, which inherit it; the router buffers uploads before forwarding them
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 32 * 1024 * 1024))
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "grpc_server.py")
+
+CHANNEL_OPTIONS = [
+    ("grpc.max_receive_message_length", 64 * 1024 * 1024),
+    ("grpc.max_send_message_length", 64 * 1024 * 1024),
+]
+
+# Worker errors that mean "try another worker" rather than "the request is bad"
+RETRYABLE_CODES = (grpc.StatusCode.UNAVAILABLE,)
+
+# Same health service names as the workers
+HEALTH_SERVICES = ("", "Text2Image")
+
+
+def request_cost(request):
+    """Relative GPU cost of a request; a 512x512 "final" text-to-image job costs 1.0."""
+    reference_steps = PROFILES[DEFAULT_PROFILE].steps
+    try:
+        width, height = resolve_size(request.size, request.width, request.height)
+        steps = resolve_sampling(
+            request.profile,
+            steps=request.num_inference_steps if request.HasField("num_inference_steps") else None
+        ).steps
+        refine_strength = None
+        if getattr(request, "mode", ""):
+            # Upscale mode pays for a native-resolution draft plus a short refinement pass
+            _, refine_strength = resolve_mode(
+                request.mode, request.refine_strength if request.HasField("refine_strength") else None
+            )
+    except ValueError:
+        # The worker rejects the request straight away
+        return 0.0
+    pixel_steps = denoise_pixel_steps(width, height, steps, refine_strength)
+    cost = pixel_steps / (512 * 512) / reference_steps * max(request.num_images, 1)
+    strength = getattr(request, "strength", 0.0)
+    if strength:
+        # img2img only denoises the last `strength` fraction of the schedule
+        cost *= strength
+    return cost
+
+
+def _forward_error(context, error):
+    # Ends the client's RPC with the worker's status, keeping hints such as x-retryable
+    context.set_trailing_metadata(error.trailing_metadata() or ())
+    context.abort(error.code(), error.details())
+
+
+def cpu_eligible(request, context):
+    # Low-priority and draft work may go to CPU workers; interactive full-quality requests stay on GPUs
+    priority = dict(context.invocation_metadata() or ()).get(PRIORITY_KEY) or DEFAULT_PRIORITY
+    return priority == "batch" or (request is not None and request.profile == "draft")
+
+
+class Worker:
+    """One grpc_server.py process bound to a device and port."""
+
+    def __init__(self, index, device, port, metrics_port):
+        self.index = index
+        self.device = device
+        self.cpu = device == "cpu"
+        self.cost_factor = CPU_COST_FACTOR if self.cpu else 1.0
+        self.port = port
+        self.metrics_port = metrics_port
+        self.process = None
+        self.channel = None
+        self.stub = None
+        self.healthy = False
+        self.failures = 0
+        self.restarts = 0
+        self.started_at = None
+        self.outstanding_cost = 0.0
+        self.inflight = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        env = dict(os.environ)
+        env.update({
+            "DEVICE": self.device,
+            "GRPC_PORT": str(self.port),
+            "METRICS_PORT": str(self.metrics_port),
+        })
+        print(f"[Router] Starting worker {self.index} on {self.device} (port {self.port})")
+        self.process = subprocess.Popen(
+            [sys.executable, SERVER_SCRIPT],
+            cwd=os.path.dirname(SERVER_SCRIPT),
+            env=env
+        )
+        self.channel = grpc.insecure_channel(f"localhost:{self.port}", options=CHANNEL_OPTIONS)
+        self.stub = text2image_pb2_grpc.Text2ImageStub(self.channel)
+        self.health = health_pb2_grpc.HealthStub(self.channel)
+        self.healthy = False
+        self.failures = 0
+        self.started_at = monotonic()
+
+    def stop(self):
+        if self.channel is not None:
+            self.channel.close()
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def restart(self):
+        self.restarts += 1
+        self.stop()
+        self.start()
+
+    def check(self):
+        # Returns the worker's health status, or None when the probe fails
+        if self.process.poll() is not None:
+            return None
+        try:
+            request = health_pb2.HealthCheckRequest(service="Text2Image")
+            return self.health.Check(request, timeout=HEALTH_TIMEOUT).status
+        except grpc.RpcError:
+            return None
+
+    def acquire(self, cost):
+        with self.lock:
+            self.outstanding_cost += cost
+            self.inflight += 1
+
+    def release(self, cost):
+        with self.lock:
+            self.outstanding_cost -= cost
+            self.inflight -= 1
+
+    def load(self):
+        with self.lock:
+            return self.outstanding_cost, self.inflight
+
+
+class WorkerPool:
+    """Starts workers, keeps them healthy and picks the least-loaded one per request."""
+
+    def __init__(self, workers, health_servicer=None):
+        self.workers = workers
+        self.health_servicer = health_servicer
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        self._thread = threading.Thread(target=self._health_loop, name="worker-health", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        for worker in self.workers:
+            worker.stop()
+
+    def pick(self, cost, exclude=(), cpu_ok=True):
+        # Least outstanding cost after adding this job, scaled by worker speed; in-flight count breaks ties.
+        # CPU workers are a fallback for requests that shouldn't run there, used only when no GPU one is up
+        candidates = [w for w in self.workers if w.healthy and w not in exclude]
+        if not cpu_ok and any(not w.cpu for w in candidates):
+            candidates = [w for w in candidates if not w.cpu]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda w: ((w.load()[0] + cost) * w.cost_factor, w.load()[1]))
+
+    def mark_failed(self, worker):
+        # Called on a transport failure; the health loop decides whether to restart
+        worker.healthy = False
+
+    def stats(self):
+        values = {"router_healthy_workers": sum(1 for w in self.workers if w.healthy)}
+        for worker in self.workers:
+            cost, inflight = worker.load()
+            prefix = f"router_worker{worker.index}"
+            values[f"{prefix}_healthy"] = 1 if worker.healthy else 0
+            values[f"{prefix}_inflight"] = inflight
+            values[f"{prefix}_outstanding_cost"] = cost
+            values[f"{prefix}_restarts"] = worker.restarts
+        return values
+
+    def _health_loop(self):
+        while not self._stop.is_set():
+            for worker in self.workers:
+                self._check(worker)
+            if self.health_servicer is not None:
+                # The router is ready as soon as any worker is
+                serving = any(worker.healthy for worker in self.workers)
+                status = health_pb2.HealthCheckResponse.SERVING if serving else health_pb2.HealthCheckResponse.NOT_SERVING
+                for service in HEALTH_SERVICES:
+                    self.health_servicer.set(service, status)
+            self._stop.wait(HEALTH_INTERVAL)
+
+    def _check(self, worker):
+        status = worker.check()
+        if status == health_pb2.HealthCheckResponse.SERVING:
+            if not worker.healthy:
+                print(f"[Router] Worker {worker.index} is healthy")
+            worker.healthy = True
+            worker.failures = 0
+            return
+
+        worker.healthy = False
+        exited = worker.process.poll() is not None
+        if exited:
+            reason = "exited"
+        elif status is not None:
+            # Answering but not ready yet: still loading weights or warming up
+            worker.failures = 0
+            if monotonic() - worker.started_at < WORKER_START_TIMEOUT:
+                return
+            reason = "not ready"
+        else:
+            # The port may not be bound yet; only count failures once it had time to start
+            if monotonic() - worker.started_at < RESTART_BACKOFF:
+                return
+            worker.failures += 1
+            if worker.failures < HEALTH_FAILURES:
+                return
+            reason = "unresponsive"
+        print(f"[Router] Restarting worker {worker.index} ({reason})")
+        worker.restart()
+
+
+class RouterServicer(text2image_pb2_grpc.Text2ImageServicer):
+    """Forwards every RPC to a worker, failing over to another one if the worker is unavailable."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def GetStats(self, request, context):
+        values = dict(self.pool.stats())
+        for worker in self.pool.workers:
+            if not worker.healthy:
+                continue
+            try:
+                response = worker.stub.GetStats(request, timeout=HEALTH_TIMEOUT)
+            except grpc.RpcError:
+                continue
+            for name, value in response.values.items():
+                values[f"worker{worker.index}_{name}"] = value
+        return text2image_pb2.StatsResponse(values=values)
+
+    def GenerateImage(self, request, context):
+        return self._unary("GenerateImage", request, context, request_cost(request), cpu_eligible(request, context))
+
+    def GenerateImageFromImage(self, request, context):
+        return self._unary(
+            "GenerateImageFromImage", request, context, request_cost(request), cpu_eligible(request, context)
+        )
+
+    def GenerateImageV2(self, request, context):
+        return self._unary("GenerateImageV2", request, context, request_cost(request), cpu_eligible(request, context))
+
+    def GenerateImageFromImageV2(self, request, context):
+        return self._unary(
+            "GenerateImageFromImageV2", request, context, request_cost(request), cpu_eligible(request, context)
+        )
+
+    def UploadImageFromImage(self, request_iterator, context):
+        # Buffer the chunks so the upload can be replayed on another worker, up to the workers' upload limit
+        chunks = []
+        size = 0
+        for chunk in request_iterator:
+            if chunk.WhichOneof("payload") == "data":
+                size += len(chunk.data)
+                if size > MAX_UPLOAD_BYTES:
+                    context.abort(grpc.StatusCode.INVALID_ARGUMENT, f"uploaded image exceeds {MAX_UPLOAD_BYTES} bytes")
+            chunks.append(chunk)
+        params = next((c.params for c in chunks if c.WhichOneof("payload") == "params"), None)
+        cost = request_cost(params) if params is not None else 1.0
+        return self._unary(
+            "UploadImageFromImage", chunks, context, cost, cpu_eligible(params, context), replay=lambda: iter(chunks)
+        )
+
+    def GenerateImageStream(self, request, context):
+        cost = request_cost(request)
+        worker = self._pick(cost, (), context, cpu_eligible(request, context))
+        worker.acquire(cost)
+        try:
+            call = worker.stub.GenerateImageStream(
+                request, timeout=context.time_remaining(), metadata=identity_metadata(context)
+            )
+            context.add_callback(call.cancel)
+            for update in call:
+                yield update
+        except grpc.RpcError as e:
+            # Progress may already have been sent, so streams are not retried
+            if e.code() in RETRYABLE_CODES:
+                self.pool.mark_failed(worker)
+            _forward_error(context, e)
+        finally:
+            worker.release(cost)
+
+    def _unary(self, method, request, context, cost, cpu_ok=True, replay=None):
+        # Workers queue and limit by the original client, not the router's address
+        metadata = identity_metadata(context)
+        tried = []
+        while True:
+            worker = self._pick(cost, tried, context, cpu_ok)
+            tried.append(worker)
+            worker.acquire(cost)
+            try:
+                call = getattr(worker.stub, method)
+                return call(replay() if replay else request, timeout=context.time_remaining(), metadata=metadata)
+            except grpc.RpcError as e:
+                if e.code() not in RETRYABLE_CODES:
+                    _forward_error(context, e)
+                print(f"[Router] Worker {worker.index} unavailable, failing over")
+                self.pool.mark_failed(worker)
+            finally:
+                worker.release(cost)
+
+    def _pick(self, cost, exclude, context, cpu_ok=True):
+        worker = self.pool.pick(cost, exclude, cpu_ok)
+        if worker is None:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "no healthy worker available")
+        return worker
+
+
+def serve():
+    workers = [
+        Worker(i, device, WORKER_BASE_PORT + i, WORKER_METRICS_BASE_PORT + i)
+        for i, device in enumerate(WORKER_DEVICES)
+    ]
+    health_servicer = health.HealthServicer()
+    for service in HEALTH_SERVICES:
+        health_servicer.set(service, health_pb2.HealthCheckResponse.NOT_SERVING)
+    pool = WorkerPool(workers, health_servicer).start()
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=ROUTER_WORKERS), options=CHANNEL_OPTIONS)
+    text2image_pb2_grpc.add_Text2ImageServicer_to_server(RouterServicer(pool), server)
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+    server.add_insecure_port(f'[::]:{ROUTER_PORT}')
+    print(f"Router started on port {ROUTER_PORT} with {len(workers)} workers")
+    server.start()
+    try:
+        server.wait_for_termination()
+    finally:
+        health_servicer.enter_graceful_shutdown()
+        server.stop(0)
+        pool.stop()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,164 @@
+import math
+from collections import namedtuple
+
+SamplingSettings = namedtuple("SamplingSettings", ["steps", "scheduler", "guidance_scale"])
+
+# name -> (diffusers scheduler class, from_config overrides); "default" is the model's own scheduler
+SCHEDULERS = {
+    "default": None,
+    # Same settings as include/model.py
+    "dpm++": ("DPMSolverMultistepScheduler", {"algorithm_type": "dpmsolver++", "final_sigmas_type": "sigma_min"}),
+    "dpm++_karras": ("DPMSolverMultistepScheduler", {
+        "algorithm_type": "dpmsolver++", "final_sigmas_type": "sigma_min", "use_karras_sigmas": True
+    }),
+    "euler": ("EulerDiscreteScheduler", {}),
+    "euler_a": ("EulerAncestralDiscreteScheduler", {}),
+    "ddim": ("DDIMScheduler", {}),
+    "unipc": ("UniPCMultistepScheduler", {}),
+}
+
+PROFILES = {
+    # Few-step DPM++ for previews and iteration, about a quarter of the "final" denoising cost
+    "draft": SamplingSettings(steps=12, scheduler="dpm++_karras", guidance_scale=6.0),
+    # Full quality: what the server always ran before profiles existed
+    "final": SamplingSettings(steps=50, scheduler="default", guidance_scale=7.5),
+}
+DEFAULT_PROFILE = "final"
+
+# Named resolutions; explicit width/height in a request take precedence
+SIZE_PRESETS = {
+    "square": (512, 512),
+    "portrait": (512, 768),
+    "landscape": (768, 512),
+}
+DEFAULT_SIZE = "square"
+
+# The VAE maps every 8x8 pixel block to one latent, so output sides are multiples of 8
+LATENT_MULTIPLE = 8
+MIN_SIDE = 64
+# Longest side generated; larger requests are scaled down to it, keeping their aspect ratio
+MAX_SIDE = 2048
+
+MAX_STEPS = 150
+MAX_GUIDANCE_SCALE = 30.0
+
+# Text-to-image modes: "direct" denoises at the output size; "upscale" denoises a draft at the
+# model's native resolution, enlarges it and refines it with a short img2img pass at the output size
+MODES = ("direct", "upscale")
+DEFAULT_MODE = "direct"
+# Pixels the model was trained at (SD 1.5: 512x512); upscale drafts keep the output's aspect ratio at this area
+NATIVE_PIXELS = 512 * 512
+# Share of the schedule the refinement pass re-runs; enough to add detail, too little to change the composition
+DEFAULT_REFINE_STRENGTH = 0.35
+# Where drafts are enlarged: "pixel" decodes, resizes and re-encodes; "latent" interpolates the latents,
+# skipping the VAE round trip but leaving softer results that need a higher refine strength
+UPSCALE_SPACES = ("pixel", "latent")
+
+
+def resolve_sampling(profile="", steps=None, scheduler="", guidance_scale=None):
+    """Applies per-request overrides on top of a named profile; raises ValueError for bad values."""
+    name = profile or DEFAULT_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"unknown profile {name!r}, expected one of {sorted(PROFILES)}")
+    settings = PROFILES[name]
+
+    if steps is not None:
+        if not 1 <= steps <= MAX_STEPS:
+            raise ValueError(f"num_inference_steps must be between 1 and {MAX_STEPS}")
+        settings = settings._replace(steps=steps)
+    if scheduler:
+        if scheduler not in SCHEDULERS:
+            raise ValueError(f"unknown scheduler {scheduler!r}, expected one of {sorted(SCHEDULERS)}")
+        settings = settings._replace(scheduler=scheduler)
+    if guidance_scale is not None:
+        if not 0 <= guidance_scale <= MAX_GUIDANCE_SCALE:
+            raise ValueError(f"guidance_scale must be between 0 and {MAX_GUIDANCE_SCALE}")
+        settings = settings._replace(guidance_scale=guidance_scale)
+    return settings
+
+
+def resolve_mode(mode="", refine_strength=None):
+    """Returns (mode, refine strength); the strength is None in direct mode. Raises ValueError for bad values."""
+    mode = mode or DEFAULT_MODE
+    if mode not in MODES:
+        raise ValueError(f"unknown mode {mode!r}, expected one of {', '.join(MODES)}")
+    if mode == "direct":
+        return mode, None
+    if refine_strength is None:
+        return mode, DEFAULT_REFINE_STRENGTH
+    if not 0 < refine_strength <= 1:
+        raise ValueError("refine_strength must be between 0 and 1")
+    return mode, refine_strength
+
+
+def draft_size(width, height):
+    """Size an upscale-mode draft of a (width, height) output is denoised at; the output size if not larger."""
+    scale = math.sqrt(NATIVE_PIXELS / (width * height))
+    if scale >= 1:
+        return width, height
+    return tuple(max(MIN_SIDE, int(side * scale) // LATENT_MULTIPLE * LATENT_MULTIPLE) for side in (width, height))
+
+
+def upscale_saves(width, height, refine_strength):
+    """Whether upscale mode denoises fewer pixels than direct mode at (width, height).
+
+    Close to the native resolution, the refinement pass costs more than
+    the smaller draft saves.
+    """
+    draft_width, draft_height = draft_size(width, height)
+    return draft_width * draft_height < width * height * (1 - refine_strength)
+
+
+def denoise_pixel_steps(width, height, steps, refine_strength=None):
+    """Pixels times denoising steps of a text-to-image generation, a proxy for its GPU time.
+
+    With a refine strength, the generation is an upscale-mode draft plus the
+    refinement pass, which like any img2img run only takes the last
+    ``refine_strength`` of the schedule.
+    """
+    if refine_strength is None:
+        return width * height * steps
+    draft_width, draft_height = draft_size(width, height)
+    return draft_width * draft_height * steps + width * height * steps * refine_strength
+
+
+def resolve_size(size="", width=0, height=0):
+    """Returns (width, height): explicit values first, then the named preset."""
+    name = size or DEFAULT_SIZE
+    if name not in SIZE_PRESETS:
+        raise ValueError(f"unknown size {name!r}, expected one of {sorted(SIZE_PRESETS)}")
+    preset_width, preset_height = SIZE_PRESETS[name]
+    return width or preset_width, height or preset_height
+
+
+def normalize_size(width, height):
+    """Snaps (width, height) to the nearest size the pipeline can generate exactly.
+
+    Halves round up (500 -> 504, 508 -> 512) rather than to the even multiple, and sizes whose longer
+    side exceeds MAX_SIDE are scaled down to it first.
+    """
+    if width < 1 or height < 1:
+        raise ValueError(f"invalid size {width}x{height}")
+    scale = min(1.0, MAX_SIDE / max(width, height))
+    return tuple(
+        max(MIN_SIDE, int(side * scale / LATENT_MULTIPLE + 0.5) * LATENT_MULTIPLE) for side in (width, height)
+    )
+
+
+def build_schedulers(base_scheduler):
+    """Creates every scheduler in SCHEDULERS once, from the model's scheduler config.
+
+    Schedulers keep per-run state (timesteps, step index), so an instance must
+    only be used by one pipeline call at a time; the batch worker thread
+    guarantees that.
+    """
+    import diffusers
+
+    schedulers = {}
+    for name, spec in SCHEDULERS.items():
+        if spec is None:
+            schedulers[name] = base_scheduler
+            continue
+        class_name, overrides = spec
+        schedulers[name] = getattr(diffusers, class_name).from_config(base_scheduler.config, **overrides)
+    return schedulers
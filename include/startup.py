@@ -0,0 +1,72 @@
+import threading
+from time import perf_counter
+
+
+class ModelLoader:
+    """Loads models on a background thread so the server can bind its port first.
+
+    ``state`` moves from "idle" through "loading" and "warming" to "ready",
+    or to "failed" if loading or warm-up raises. ``on_state`` is called with
+    each new state, e.g. to update the gRPC health status.
+    """
+
+    def __init__(self, load, warmup=None):
+        self._load = load
+        self._warmup = warmup
+        self._on_state = None
+        self._ready = threading.Event()
+        self._thread = None
+        self.state = "idle"
+        self.value = None
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+
+    def start(self, on_state=None):
+        self._on_state = on_state
+        self._thread = threading.Thread(target=self._run, name="model-loader", daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def stats(self):
+        values = {"startup_ready": 1 if self.ready else 0}
+        if self.load_seconds is not None:
+            values["startup_load_seconds"] = self.load_seconds
+        if self.warmup_seconds is not None:
+            values["startup_warmup_seconds"] = self.warmup_seconds
+        return values
+
+    def _run(self):
+        try:
+            self._set_state("loading")
+            start = perf_counter()
+            self.value = self._load()
+            self.load_seconds = perf_counter() - start
+            print(f"Models loaded in {self.load_seconds:.1f}s")
+
+            if self._warmup is not None:
+                self._set_state("warming")
+                start = perf_counter()
+                self._warmup(self.value)
+                self.warmup_seconds = perf_counter() - start
+                print(f"Warm-up finished in {self.warmup_seconds:.1f}s")
+        except Exception as e:
+            self.error = e
+            print(f"Error loading models: {e}")
+            self._set_state("failed")
+            return
+
+        self._ready.set()
+        self._set_state("ready")
+
+    def _set_state(self, state):
+        self.state = state
+        if self._on_state is not None:
+            self._on_state(state)
@@ -0,0 +1,86 @@
+import io
+import queue
+import threading
+from time import time
+
+import torch
+from PIL import Image
+
+# Linear projection from SD 1.x latent channels to approximate RGB,
+# used for cheap previews without running the VAE decoder
+LATENT_RGB_FACTORS = [
+    [0.298, 0.207, 0.208],
+    [0.187, 0.286, 0.173],
+    [-0.158, 0.189, 0.264],
+    [-0.184, -0.271, -0.473],
+]
+
+DEFAULT_PREVIEW_EVERY = 5
+
+
+class GenerationCancelled(Exception):
+    """Raised from the step callback to abort the denoising loop."""
+
+
+def latents_to_preview(latents):
+    # Projects the first latent of the batch to a small RGB image (1/8 of output size)
+    if latents is None:
+        return None
+    latent = latents[0].float()
+    factors = torch.tensor(LATENT_RGB_FACTORS, dtype=latent.dtype, device=latent.device)
+    rgb = torch.einsum("chw,cr->hwr", latent, factors)
+    rgb = ((rgb + 1) / 2).clamp(0, 1).mul(255).byte().cpu().numpy()
+    return Image.fromarray(rgb)
+
+
+class ProgressStream:
+    """Bridges diffusers step callbacks on the GPU thread to a streaming RPC.
+
+    ``callback`` is passed as ``callback_on_step_end``; iterating the stream
+    yields ``(step, total_steps, elapsed_seconds, preview_png)`` tuples until
+    ``finish`` is called. ``cancel`` makes the next callback raise
+    ``GenerationCancelled`` so the pipeline stops at the following step.
+    """
+
+    _DONE = object()
+
+    def __init__(self, total_steps, preview_every=DEFAULT_PREVIEW_EVERY):
+        self.total_steps = total_steps
+        self.preview_every = preview_every
+        self.start_time = time()
+        self._updates = queue.Queue()
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def callback(self, pipeline, step, timestep, callback_kwargs):
+        if self._cancelled.is_set():
+            raise GenerationCancelled("client cancelled the request")
+
+        total_steps = getattr(pipeline, "num_timesteps", None) or self.total_steps
+        preview_png = b""
+        if self.preview_every and (step + 1) % self.preview_every == 0:
+            preview = latents_to_preview(callback_kwargs.get("latents"))
+            if preview is not None:
+                buffer = io.BytesIO()
+                preview.save(buffer, format="PNG")
+                preview_png = buffer.getvalue()
+
+        self._updates.put((step + 1, total_steps, time() - self.start_time, preview_png))
+        return callback_kwargs
+
+    def cancel(self):
+        self._cancelled.set()
+        self.finish()
+
+    def finish(self):
+        self._updates.put(self._DONE)
+
+    def __iter__(self):
+        while True:
+            update = self._updates.get()
+            if update is self._DONE:
+                return
+            yield update
@@ -24,19 +24,35 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x10text2image.proto\"<\n\x0bTextRequest\x12\x0e\n\x06prompt\x18\x01 \x01(\t\x12\r\n\x05width\x18\x03 \x01(\x05\x12\x0e\n\x06height\x18\x04 \x01(\x05\"m\n\x0eImg2ImgRequest\x12\x0e\n\x06prompt\x18\x01 \x01(\t\x12\r\n\x05width\x18\x03 \x01(\x05\x12\x0e\n\x06height\x18\x04 \x01(\x05\x12\x1a\n\x12input_image_base64\x18\x05 \x01(\t\x12\x10\n\x08strength\x18\x06 \x01(\x02\"5\n\rImageResponse\x12\x14\n\x0cimage_base64\x18\x01 \x01(\t\x12\x0e\n\x06status\x18\x02 \x01(\t2v\n\nText2Image\x12-\n\rGenerateImage\x12\x0c.TextRequest\x1a\x0e.ImageResponse\x12\x39\n\x16GenerateImageFromImage\x12\x0f.Img2ImgRequest\x1a\x0e.ImageResponseb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x10text2image.proto\"\x81\x03\n\x0bTextRequest\x12\x0e\n\x06prompt\x18\x01 \x01(\t\x12\r\n\x05width\x18\x03 \x01(\x05\x12\x0e\n\x06height\x18\x04 \x01(\x05\x12\x11\n\x04seed\x18\x07 \x01(\x03H\x00\x88\x01\x01\x12\x0f\n\x07profile\x18\x08 \x01(\t\x12 \n\x13num_inference_steps\x18\t \x01(\x05H\x01\x88\x01\x01\x12\x11\n\tscheduler\x18\n \x01(\t\x12\x1b\n\x0eguidance_scale\x18\x0b \x01(\x02H\x02\x88\x01\x01\x12\x0c\n\x04size\x18\x0c \x01(\t\x12\x12\n\nnum_images\x18\r \x01(\x05\x12\x0c\n\x04mode\x18\x0e \x01(\t\x12\x1c\n\x0frefine_strength\x18\x0f \x01(\x02H\x03\x88\x01\x01\x12\x15\n\routput_format\x18\x10 \x01(\t\x12\x14\n\x07quality\x18\x11 \x01(\x05H\x04\x88\x01\x01\x42\x07\n\x05_seedB\x16\n\x14_num_inference_stepsB\x11\n\x0f_guidance_scaleB\x12\n\x10_refine_strengthB\n\n\x08_quality\"\xf2\x02\n\x0eImg2ImgRequest\x12\x0e\n\x06prompt\x18\x01 \x01(\t\x12\r\n\x05width\x18\x03 \x01(\x05\x12\x0e\n\x06height\x18\x04 \x01(\x05\x12\x1a\n\x12input_image_base64\x18\x05 \x01(\t\x12\x10\n\x08strength\x18\x06 \x01(\x02\x12\x11\n\x04seed\x18\x07 \x01(\x03H\x00\x88\x01\x01\x12\x0f\n\x07profile\x18\x08 \x01(\t\x12 \n\x13num_inference_steps\x18\t \x01(\x05H\x01\x88\x01\x01\x12\x11\n\tscheduler\x18\n \x01(\t\x12\x1b\n\x0eguidance_scale\x18\x0b \x01(\x02H\x02\x88\x01\x01\x12\x0c\n\x04size\x18\x0c \x01(\t\x12\x12\n\nnum_images\x18\r \x01(\x05\x12\x15\n\routput_format\x18\x0e \x01(\t\x12\x14\n\x07quality\x18\x0f \x01(\x05H\x03\x88\x01\x01\x42\x07\n\x05_seedB\x16\n\x14_num_inference_stepsB\x11\n\x0f_guidance_scaleB\n\n\x08_quality\"\x93\x01\n\rImageResponse\x12\x14\n\x0cimage_base64\x18\x01 \x01(\t\x12\x0e\n\x06status\x18\x02 \x01(\t\x12\x15\n\rimages_base64\x18\x03 \x03(\t\x12\r\n\x05seeds\x18\x04 \x03(\x03\x12\r\n\x05width\x18\x05 \x01(\x05\x12\x0e\n\x06height\x18\x06 \x01(\x05\x12\x17\n\x0fsize_adjustment\x18\x07 \x01(\t\"\x85\x01\n\x10GenerationUpdate\x12\x0c\n\x04step\x18\x01 \x01(\x05\x12\x13\n\x0btotal_steps\x18\x02 \x01(\x05\x12\x17\n\x0f\x65lapsed_seconds\x18\x03 \x01(\x02\x12\x13\n\x0bpreview_png\x18\x04 \x01(\x0c\x12 \n\x06result\x18\x05 \x01(\x0b\x32\x10.ImageResponseV2\"\xed\x02\n\x10Img2ImgRequestV2\x12\x0e\n\x06prompt\x18\x01 \x01(\t\x12\r\n\x05width\x18\x03 \x01(\x05\x12\x0e\n\x06height\x18\x04 \x01(\x05\x12\x13\n\x0binput_image\x18\x05 \x01(\x0c\x12\x10\n\x08strength\x18\x06 \x01(\x02\x12\x11\n\x04seed\x18\x07 \x01(\x03H\x00\x88\x01\x01\x12\x0f\n\x07profile\x18\x08 \x01(\t\x12 \n\x13num_inference_steps\x18\t \x01(\x05H\x01\x88\x01\x01\x12\x11\n\tscheduler\x18\n \x01(\t\x12\x1b\n\x0eguidance_scale\x18\x0b \x01(\x02H\x02\x88\x01\x01\x12\x0c\n\x04size\x18\x0c \x01(\t\x12\x12\n\nnum_images\x18\r \x01(\x05\x12\x15\n\routput_format\x18\x0e \x01(\t\x12\x14\n\x07quality\x18\x0f \x01(\x05H\x03\x88\x01\x01\x42\x07\n\x05_seedB\x16\n\x14_num_inference_stepsB\x11\n\x0f_guidance_scaleB\n\n\x08_quality\"N\n\x0cImg2ImgChunk\x12#\n\x06params\x18\x01 \x01(\x0b\x32\x11.Img2ImgRequestV2H\x00\x12\x0e\n\x04\x64\x61ta\x18\x02 \x01(\x0cH\x00\x42\t\n\x07payload\"\x9a\x01\n\x0fImageResponseV2\x12\r\n\x05image\x18\x01 \x01(\x0c\x12\x0e\n\x06status\x18\x02 \x01(\t\x12\x11\n\tmime_type\x18\x03 \x01(\t\x12\x0e\n\x06images\x18\x04 \x03(\x0c\x12\r\n\x05seeds\x18\x05 \x03(\x03\x12\r\n\x05width\x18\x06 \x01(\x05\x12\x0e\n\x06height\x18\x07 \x01(\x05\x12\x17\n\x0fsize_adjustment\x18\x08 \x01(\t\"\x0e\n\x0cStatsRequest\"j\n\rStatsResponse\x12*\n\x06values\x18\x01 \x03(\x0b\x32\x1a.StatsResponse.ValuesEntry\x1a-\n\x0bValuesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x01:\x02\x38\x01\x32\x8a\x03\n\nText2Image\x12-\n\rGenerateImage\x12\x0c.TextRequest\x1a\x0e.ImageResponse\x12\x39\n\x16GenerateImageFromImage\x12\x0f.Img2ImgRequest\x1a\x0e.ImageResponse\x12\x38\n\x13GenerateImageStream\x12\x0c.TextRequest\x1a\x11.GenerationUpdate0\x01\x12\x31\n\x0fGenerateImageV2\x12\x0c.TextRequest\x1a\x10.ImageResponseV2\x12?\n\x18GenerateImageFromImageV2\x12\x11.Img2ImgRequestV2\x1a\x10.ImageResponseV2\x12\x39\n\x14UploadImageFromImage\x12\r.Img2ImgChunk\x1a\x10.ImageResponseV2(\x01\x12)\n\x08GetStats\x12\r.StatsRequest\x1a\x0e.StatsResponseb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'text2image_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
-  _globals['_TEXTREQUEST']._serialized_start=20
-  _globals['_TEXTREQUEST']._serialized_end=80
-  _globals['_IMG2IMGREQUEST']._serialized_start=82
-  _globals['_IMG2IMGREQUEST']._serialized_end=191
-  _globals['_IMAGERESPONSE']._serialized_start=193
-  _globals['_IMAGERESPONSE']._serialized_end=246
-  _globals['_TEXT2IMAGE']._serialized_start=248
-  _globals['_TEXT2IMAGE']._serialized_end=366
+  _globals['_STATSRESPONSE_VALUESENTRY']._loaded_options = None
+  _globals['_STATSRESPONSE_VALUESENTRY']._serialized_options = b'8\001'
+  _globals['_TEXTREQUEST']._serialized_start=21
+  _globals['_TEXTREQUEST']._serialized_end=406
+  _globals['_IMG2IMGREQUEST']._serialized_start=409
+  _globals['_IMG2IMGREQUEST']._serialized_end=779
+  _globals['_IMAGERESPONSE']._serialized_start=782
+  _globals['_IMAGERESPONSE']._serialized_end=929
+  _globals['_GENERATIONUPDATE']._serialized_start=932
+  _globals['_GENERATIONUPDATE']._serialized_end=1065
+  _globals['_IMG2IMGREQUESTV2']._serialized_start=1068
+  _globals['_IMG2IMGREQUESTV2']._serialized_end=1433
+  _globals['_IMG2IMGCHUNK']._serialized_start=1435
+  _globals['_IMG2IMGCHUNK']._serialized_end=1513
+  _globals['_IMAGERESPONSEV2']._serialized_start=1516
+  _globals['_IMAGERESPONSEV2']._serialized_end=1670
+  _globals['_STATSREQUEST']._serialized_start=1672
+  _globals['_STATSREQUEST']._serialized_end=1686
+  _globals['_STATSRESPONSE']._serialized_start=1688
+  _globals['_STATSRESPONSE']._serialized_end=1794
+  _globals['_STATSRESPONSE_VALUESENTRY']._serialized_start=1749
+  _globals['_STATSRESPONSE_VALUESENTRY']._serialized_end=1794
+  _globals['_TEXT2IMAGE']._serialized_start=1797
+  _globals['_TEXT2IMAGE']._serialized_end=2191
 # @@protoc_insertion_point(module_scope)
@@ -50,6 +50,31 @@ class Text2ImageStub(object):
                 request_serializer=text2image__pb2.Img2ImgRequest.SerializeToString,
                 response_deserializer=text2image__pb2.ImageResponse.FromString,
                 _registered_method=True)
+        self.GenerateImageStream = channel.unary_stream(
+                '/Text2Image/GenerateImageStream',
+                request_serializer=text2image__pb2.TextRequest.SerializeToString,
+                response_deserializer=text2image__pb2.GenerationUpdate.FromString,
+                _registered_method=True)
+        self.GenerateImageV2 = channel.unary_unary(
+                '/Text2Image/GenerateImageV2',
+                request_serializer=text2image__pb2.TextRequest.SerializeToString,
+                response_deserializer=text2image__pb2.ImageResponseV2.FromString,
+                _registered_method=True)
+        self.GenerateImageFromImageV2 = channel.unary_unary(
+                '/Text2Image/GenerateImageFromImageV2',
+                request_serializer=text2image__pb2.Img2ImgRequestV2.SerializeToString,
+                response_deserializer=text2image__pb2.ImageResponseV2.FromString,
+                _registered_method=True)
+        self.UploadImageFromImage = channel.stream_unary(
+                '/Text2Image/UploadImageFromImage',
+                request_serializer=text2image__pb2.Img2ImgChunk.SerializeToString,
+                response_deserializer=text2image__pb2.ImageResponseV2.FromString,
+                _registered_method=True)
+        self.GetStats = channel.unary_unary(
+                '/Text2Image/GetStats',
+                request_serializer=text2image__pb2.StatsRequest.SerializeToString,
+                response_deserializer=text2image__pb2.StatsResponse.FromString,
+                _registered_method=True)
 
 
 class Text2ImageServicer(object):
@@ -67,6 +92,37 @@ class Text2ImageServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def GenerateImageStream(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GenerateImageV2(self, request, context):
+        """v2: raw image bytes instead of base64 strings
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GenerateImageFromImageV2(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def UploadImageFromImage(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetStats(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_Text2ImageServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -80,6 +136,31 @@ def add_Text2ImageServicer_to_server(servicer, server):
                     request_deserializer=text2image__pb2.Img2ImgRequest.FromString,
                     response_serializer=text2image__pb2.ImageResponse.SerializeToString,
             ),
+            'GenerateImageStream': grpc.unary_stream_rpc_method_handler(
+                    servicer.GenerateImageStream,
+                    request_deserializer=text2image__pb2.TextRequest.FromString,
+                    response_serializer=text2image__pb2.GenerationUpdate.SerializeToString,
+            ),
+            'GenerateImageV2': grpc.unary_unary_rpc_method_handler(
+                    servicer.GenerateImageV2,
+                    request_deserializer=text2image__pb2.TextRequest.FromString,
+                    response_serializer=text2image__pb2.ImageResponseV2.SerializeToString,
+            ),
+            'GenerateImageFromImageV2': grpc.unary_unary_rpc_method_handler(
+                    servicer.GenerateImageFromImageV2,
+                    request_deserializer=text2image__pb2.Img2ImgRequestV2.FromString,
+                    response_serializer=text2image__pb2.ImageResponseV2.SerializeToString,
+            ),
+            'UploadImageFromImage': grpc.stream_unary_rpc_method_handler(
+                    servicer.UploadImageFromImage,
+                    request_deserializer=text2image__pb2.Img2ImgChunk.FromString,
+                    response_serializer=text2image__pb2.ImageResponseV2.SerializeToString,
+            ),
+            'GetStats': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetStats,
+                    request_deserializer=text2image__pb2.StatsRequest.FromString,
+                    response_serializer=text2image__pb2.StatsResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'Text2Image', rpc_method_handlers)
@@ -144,3 +225,138 @@ class Text2Image(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def GenerateImageStream(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/Text2Image/GenerateImageStream',
+            text2image__pb2.TextRequest.SerializeToString,
+            text2image__pb2.GenerationUpdate.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GenerateImageV2(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/Text2Image/GenerateImageV2',
+            text2image__pb2.TextRequest.SerializeToString,
+            text2image__pb2.ImageResponseV2.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GenerateImageFromImageV2(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/Text2Image/GenerateImageFromImageV2',
+            text2image__pb2.Img2ImgRequestV2.SerializeToString,
+            text2image__pb2.ImageResponseV2.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def UploadImageFromImage(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/Text2Image/UploadImageFromImage',
+            text2image__pb2.Img2ImgChunk.SerializeToString,
+            text2image__pb2.ImageResponseV2.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetStats(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/Text2Image/GetStats',
+            text2image__pb2.StatsRequest.SerializeToString,
+            text2image__pb2.StatsResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
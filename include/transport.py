@@ -0,0 +1,66 @@
+try:
+    # When imported from another module in the include directory
+    from . import text2image_pb2
+except ImportError:
+    # When run directly
+    import text2image_pb2
+
+# 1 MiB keeps every chunk well under gRPC's 4 MB default message limit
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def image_chunks(prompt, image_bytes, width, height, strength, seed=None, chunk_size=UPLOAD_CHUNK_SIZE, **options):
+    """Yields Img2ImgChunk messages for UploadImageFromImage: params first, then data.
+
+    ``options`` are further Img2ImgRequestV2 fields, e.g. ``profile="draft"``.
+    """
+    params = text2image_pb2.Img2ImgRequestV2(
+        prompt=prompt,
+        width=width,
+        height=height,
+        strength=strength,
+        **options
+    )
+    if seed is not None:
+        params.seed = seed
+    yield text2image_pb2.Img2ImgChunk(params=params)
+    view = memoryview(image_bytes)
+    for offset in range(0, len(view), chunk_size):
+        yield text2image_pb2.Img2ImgChunk(data=bytes(view[offset:offset + chunk_size]))
+
+
+class _UploadAssembler:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.params = None
+        self.buffer = bytearray()
+
+    def add(self, chunk):
+        payload = chunk.WhichOneof("payload")
+        if payload == "params":
+            self.params = chunk.params
+        elif payload == "data":
+            self.buffer.extend(chunk.data)
+            if len(self.buffer) > self.max_bytes:
+                raise ValueError(f"uploaded image exceeds {self.max_bytes} bytes")
+
+    def result(self):
+        if self.params is None:
+            raise ValueError("upload did not include request parameters")
+        return self.params, bytes(self.buffer)
+
+
+def collect_upload(chunks, max_bytes):
+    """Reassembles an UploadImageFromImage stream into (params, image_bytes)."""
+    assembler = _UploadAssembler(max_bytes)
+    for chunk in chunks:
+        assembler.add(chunk)
+    return assembler.result()
+
+
+async def collect_upload_async(chunks, max_bytes):
+    """Same as ``collect_upload`` for grpc.aio request iterators."""
+    assembler = _UploadAssembler(max_bytes)
+    async for chunk in chunks:
+        assembler.add(chunk)
+    return assembler.result()
@@ -4,13 +4,15 @@
 python include/grpc_server.py &
 GRPC_PID=$!
 
-# Wait for gRPC server to start (check if port 50051 is open)
-echo "Waiting for gRPC server to start..."
-while ! nc -z localhost 50051; do
-  sleep 0.5
-done
+# The port opens immediately; wait for the health service to report SERVING (models loaded and warm)
+echo "Waiting for gRPC server to load models..."
+if ! python include/healthcheck.py --wait 900; then
+  echo "gRPC server did not become ready"
+  kill $GRPC_PID
+  exit 1
+fi
 
-echo "gRPC server is up. Starting Streamlit app..."
+echo "gRPC server is ready. Starting Streamlit app..."
 streamlit run app.py
 
 # Optionally wait on the gRPC server process if needed
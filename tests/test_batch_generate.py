@@ -0,0 +1,64 @@
+import json
+from concurrent import futures
+
+from batch_generate import run
+from image_encoding import PNG
+
+
+class EchoBackend:
+    """Returns fixed bytes for every image, so run() can be checked without a model."""
+
+    output_format = PNG
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, entry):
+        self.submitted.append(entry.id)
+        future = futures.Future()
+        future.set_result([b"image"] * len(entry.seeds))
+        return future
+
+
+def write_jsonl(path, lines):
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def manifest(output_dir):
+    with open(output_dir / "manifest.jsonl", encoding="utf-8") as f:
+        return {record["id"]: record["status"] for record in map(json.loads, f)}
+
+
+def test_malformed_entries_fail_alone(tmp_path):
+    path = write_jsonl(tmp_path / "prompts.jsonl", [
+        json.dumps({"id": "good", "prompt": "a cat", "seed": 1}),
+        "{not json",
+        json.dumps("just a string"),
+        json.dumps({"id": "width", "prompt": "a dog", "width": "512"}),
+        json.dumps({"id": "seed", "prompt": "a dog", "seed": {}}),
+        json.dumps({"id": "prompt", "prompt": ["a dog"]}),
+        json.dumps({"id": "last", "prompt": "a bird", "seed": 2}),
+    ])
+    backend = EchoBackend()
+    output_dir = tmp_path / "out"
+    assert run(path, str(output_dir), backend) == (2, 5)
+    assert sorted(backend.submitted) == ["good", "last"]
+
+    statuses = manifest(output_dir)
+    assert statuses.pop("good") == statuses.pop("last") == "success"
+    assert sorted(statuses) == ["1", "2", "prompt", "seed", "width"]
+    assert all(status.startswith("error: ") for status in statuses.values())
+
+
+def test_rerun_retries_only_failed_entries(tmp_path):
+    path = write_jsonl(tmp_path / "prompts.jsonl", [
+        json.dumps({"id": "good", "prompt": "a cat", "seed": 1}),
+        json.dumps({"id": "bad", "prompt": "a dog", "num_images": 0}),
+    ])
+    output_dir = tmp_path / "out"
+    assert run(path, str(output_dir), EchoBackend()) == (1, 1)
+
+    backend = EchoBackend()
+    assert run(path, str(output_dir), backend) == (0, 1)
+    assert backend.submitted == []
@@ -0,0 +1,184 @@
+import pytest
+
+from memory_planner import (
+    PLAN_STEPS, ExceedsMemoryBudget, MemoryPlanner, estimate_peak_bytes, fit_size, plan_execution
+)
+
+GIB = 2 ** 30
+
+
+def enabled(plan):
+    return [step for step in PLAN_STEPS if getattr(plan, step)]
+
+
+def smallest_plan(width, height, batch_size, sdpa=True):
+    # The estimate with every saving that helps switched on: the least memory the call can run in
+    return plan_execution(width, height, batch_size, 0, sdpa=sdpa)
+
+
+@pytest.mark.parametrize("sdpa", [True, False])
+@pytest.mark.parametrize("dtype", ["float16", "float32"])
+def test_estimate_grows_with_pixels(dtype, sdpa):
+    sizes = [(256, 256), (512, 512), (512, 768), (768, 768), (1024, 1024)]
+    estimates = [estimate_peak_bytes(width, height, 1, dtype=dtype, sdpa=sdpa) for width, height in sizes]
+    assert estimates == sorted(estimates)
+    assert len(set(estimates)) == len(estimates)
+
+
+@pytest.mark.parametrize("sdpa", [True, False])
+def test_estimate_grows_with_batch_size(sdpa):
+    estimates = [estimate_peak_bytes(512, 512, batch_size, sdpa=sdpa) for batch_size in range(1, 9)]
+    assert estimates == sorted(estimates)
+    assert len(set(estimates)) == len(estimates)
+
+
+def test_estimate_scales_with_dtype():
+    assert estimate_peak_bytes(512, 512, 1, dtype="float32") == pytest.approx(
+        2 * estimate_peak_bytes(512, 512, 1, dtype="float16"), rel=1e-6
+    )
+
+
+def test_estimate_of_a_single_512_image_is_a_few_gigabytes():
+    # The constants are tuned so a 512x512 fp16 image peaks around 3.5 GB
+    assert 3 * GIB < estimate_peak_bytes(512, 512, 1) < 4 * GIB
+
+
+def test_savings_lower_the_estimate():
+    baseline = estimate_peak_bytes(1024, 1024, 4)
+    assert estimate_peak_bytes(1024, 1024, 4, vae_slicing=True) < baseline
+    assert estimate_peak_bytes(1024, 1024, 4, cpu_offload=True) < baseline
+    # Without SDPA the attention matrix dominates large images, and slicing it pays off
+    assert estimate_peak_bytes(1024, 1024, 1, sdpa=False, attention_slicing=True) < estimate_peak_bytes(
+        1024, 1024, 1, sdpa=False
+    )
+
+
+def test_plan_within_budget_enables_nothing():
+    estimate = estimate_peak_bytes(512, 512, 4)
+    plan = plan_execution(512, 512, 4, estimate)
+    assert plan.fits
+    assert enabled(plan) == []
+    assert plan.estimated_bytes == estimate
+
+
+def test_plan_just_over_budget_enables_vae_slicing_first():
+    # Decoding four 512x512 images is the peak, so slicing the VAE is the only saving needed
+    sliced = estimate_peak_bytes(512, 512, 4, vae_slicing=True)
+    assert sliced < estimate_peak_bytes(512, 512, 4)
+    plan = plan_execution(512, 512, 4, sliced)
+    assert plan.fits
+    assert enabled(plan) == ["vae_slicing"]
+    assert plan.estimated_bytes == sliced
+
+    plan = plan_execution(512, 512, 4, sliced - 1)
+    assert "vae_slicing" in enabled(plan)
+    assert len(enabled(plan)) > 1
+
+
+def test_plan_tiles_large_decodes():
+    width, height = 2048, 2048
+    sliced = estimate_peak_bytes(width, height, 1, vae_slicing=True)
+    tiled = estimate_peak_bytes(width, height, 1, vae_slicing=True, vae_tiling=True)
+    assert tiled < sliced
+    plan = plan_execution(width, height, 1, tiled)
+    assert plan.fits
+    assert plan.vae_tiling
+
+
+def test_plan_skips_savings_that_do_not_help():
+    # Under SDPA, attention slicing only adds memory; tiling does nothing below the tile size
+    plan = smallest_plan(256, 256, 1, sdpa=True)
+    assert not plan.fits
+    assert not plan.attention_slicing
+    assert not plan.vae_tiling
+    assert plan.cpu_offload
+
+
+def test_plan_slices_attention_without_sdpa():
+    plan = smallest_plan(1024, 1024, 1, sdpa=False)
+    assert plan.attention_slicing
+
+
+def test_plan_reports_what_cannot_fit():
+    plan = plan_execution(512, 512, 1, 1)
+    assert not plan.fits
+    assert plan.estimated_bytes > 1
+
+
+@pytest.mark.parametrize("multiple", [64, 8])
+def test_fit_size_fits_the_budget_at_the_multiple(multiple):
+    budget = smallest_plan(768, 768, 1).estimated_bytes
+    width, height = fit_size(1536, 1024, budget, multiple=multiple)
+    assert width % multiple == 0
+    assert height % multiple == 0
+    assert width < 1536 and height < 1024
+    assert plan_execution(width, height, 1, budget).fits
+    # Aspect ratio is kept up to the rounding to the multiple
+    assert width / height == pytest.approx(1536 / 1024, abs=2 * multiple / height)
+
+
+def test_fit_size_keeps_sizes_that_fit():
+    assert fit_size(1024, 768, 80 * GIB) == (1024, 768)
+
+
+def test_fit_size_gives_up_below_min_side():
+    budget = smallest_plan(256, 256, 1).estimated_bytes - 1
+    assert fit_size(1024, 1024, budget) is None
+    assert fit_size(1024, 1024, smallest_plan(768, 768, 1).estimated_bytes - 1, min_side=768) is None
+
+
+def test_admit_at_the_boundary():
+    needed = smallest_plan(1024, 1024, 1).estimated_bytes
+    assert MemoryPlanner(needed).admit(1024, 1024) == (1024, 1024)
+
+    planner = MemoryPlanner(needed - 1, overflow="downscale")
+    width, height = planner.admit(1024, 1024)
+    assert (width, height) != (1024, 1024)
+    assert width % 64 == 0 and height % 64 == 0
+    assert plan_execution(width, height, 1, needed - 1).fits
+    assert planner.stats()["memory_downscaled"] == 1
+
+    planner = MemoryPlanner(needed - 1, overflow="reject")
+    with pytest.raises(ExceedsMemoryBudget):
+        planner.admit(1024, 1024)
+    assert planner.stats()["memory_rejected"] == 1
+
+
+def test_admit_rejects_when_nothing_fits():
+    planner = MemoryPlanner(smallest_plan(256, 256, 1).estimated_bytes - 1)
+    with pytest.raises(ExceedsMemoryBudget):
+        planner.admit(1024, 1024)
+
+
+def test_unknown_overflow_is_rejected():
+    with pytest.raises(ValueError):
+        MemoryPlanner(8 * GIB, overflow="crash")
+
+
+def test_split_at_the_boundary():
+    budget = smallest_plan(512, 512, 3).estimated_bytes
+    planner = MemoryPlanner(budget)
+    assert planner.split(512, 512, 3)[0] == 3
+
+    size, plan = planner.split(512, 512, 8)
+    assert size == 3
+    assert plan.fits
+    assert plan.batch_size == 3
+
+    size, plan = MemoryPlanner(budget - 1).split(512, 512, 8)
+    assert size == 2
+    assert plan.fits
+
+
+def test_split_keeps_batches_that_fit():
+    size, plan = MemoryPlanner(80 * GIB).split(512, 512, 4)
+    assert size == 4
+    assert enabled(plan) == []
+
+
+def test_split_runs_single_images_that_cannot_fit():
+    # Admission already let the request in, so it runs with every saving rather than failing
+    size, plan = MemoryPlanner(1).split(512, 512, 4)
+    assert size == 1
+    assert not plan.fits
+    assert plan.cpu_offload
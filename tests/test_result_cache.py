@@ -0,0 +1,37 @@
+import os
+
+from output_writer import OutputWriter
+from result_cache import ResultCache, result_key
+
+
+def test_disk_writes_run_on_the_writer(tmp_path):
+    writer = OutputWriter().start()
+    cache = ResultCache(1024, disk_dir=str(tmp_path), writer=writer)
+    key = result_key(seed=1)
+    cache.put(key, b"image", ".webp")
+    # Served from memory while the file is still queued
+    assert cache.get(key, ".webp") == b"image"
+    writer.close()
+    assert os.listdir(tmp_path) == [f"{key}.webp"]
+
+    reopened = ResultCache(1024, disk_dir=str(tmp_path))
+    assert reopened.get(key, ".webp") == b"image"
+    assert reopened.stats()["result_cache_disk_hits"] == 1
+
+
+def test_disk_tier_prunes_least_recently_used(tmp_path):
+    writer = OutputWriter().start()
+    cache = ResultCache(0, disk_dir=str(tmp_path), max_disk_bytes=250, writer=writer)
+    keys = [result_key(seed=seed) for seed in range(3)]
+    for index, key in enumerate(keys):
+        cache.put(key, b"x" * 100)
+        writer.close()
+        # Distinct modification times, oldest first
+        os.utime(os.path.join(tmp_path, f"{key}.png"), (index, index))
+        writer.start()
+    writer.close()
+
+    assert cache.stats()["result_cache_disk_evictions"] == 1
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) == b"x" * 100
+    assert cache.stats()["result_cache_disk_bytes"] <= 250 * 0.9
@@ -0,0 +1,37 @@
+import pytest
+
+from sampling import LATENT_MULTIPLE, MAX_SIDE, MIN_SIDE, normalize_size
+
+
+@pytest.mark.parametrize("side, expected", [
+    (512, 512),
+    (500, 504),
+    (508, 512),
+    (503, 504),
+    (505, 504),
+    (1, MIN_SIDE),
+    (MAX_SIDE, MAX_SIDE),
+])
+def test_normalize_size_snaps_to_the_nearest_multiple(side, expected):
+    assert normalize_size(side, side) == (expected, expected)
+
+
+def test_normalize_size_rounds_every_half_up():
+    for multiple in range(MIN_SIDE, 1024, LATENT_MULTIPLE):
+        half = multiple + LATENT_MULTIPLE // 2
+        assert normalize_size(half, half) == (multiple + LATENT_MULTIPLE,) * 2
+
+
+def test_normalize_size_scales_down_to_the_maximum_side():
+    assert normalize_size(4096, 1024) == (MAX_SIDE, 512)
+    width, height = normalize_size(3000, 2000)
+    assert width == MAX_SIDE
+    assert height % LATENT_MULTIPLE == 0
+    assert width / height == pytest.approx(1.5, abs=0.01)
+    assert normalize_size(100000, 3) == (MAX_SIDE, MIN_SIDE)
+
+
+@pytest.mark.parametrize("width, height", [(0, 512), (512, -8)])
+def test_normalize_size_rejects_empty_sizes(width, height):
+    with pytest.raises(ValueError):
+        normalize_size(width, height)